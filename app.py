@@ -6,7 +6,13 @@ from routes.sensor_routes import sensor_bp
 from routes.event_routes import event_bp
 from routes.actuator_routes import actuator_bp
 from routes.app_state_routes import app_state_bp
+from routes.metrics_routes import metrics_bp
+from routes.storage_routes import storage_bp
+from routes.export_routes import export_bp
 from mqtt_client import connect_mqtt, cleanup as mqtt_cleanup
+from database import migrate_database
+from models.backfills import resume_backfills
+from models.retention import start_retention_task
 import os
 import threading
 from models.sensor_data import cleanup
@@ -44,6 +50,9 @@ app.register_blueprint(sensor_bp, url_prefix='/api')
 app.register_blueprint(event_bp, url_prefix='/api')
 app.register_blueprint(actuator_bp, url_prefix='/api')
 app.register_blueprint(app_state_bp, url_prefix='/api')
+app.register_blueprint(metrics_bp, url_prefix='/api')
+app.register_blueprint(storage_bp, url_prefix='/api')
+app.register_blueprint(export_bp, url_prefix='/api')
 
 # Registramos los blueprints de MSAD de forma modular
 system_bp = create_system_blueprint()
@@ -54,6 +63,15 @@ app.register_blueprint(system_bp, url_prefix='/api')
 app.register_blueprint(backup_bp, url_prefix='/api')
 app.register_blueprint(report_bp, url_prefix='/api')
 
+# Aplicar las migraciones pendientes del esquema antes de atender peticiones
+migrate_database()
+
+# Continuar en segundo plano los backfills pendientes (p. ej. la migracion compacta tras un reinicio)
+resume_backfills()
+
+# Aplicar periodicamente las politicas de retencion de datos
+start_retention_task()
+
 # Inicializar MSAD (Microservicio de Almacenamiento Distribuido)
 msad_status = init_msad(auto_backup=True, backup_interval_hours=24)
 print(f"Estado de MSAD: {msad_status['message']}")
@@ -1,14 +1,41 @@
 # -*- coding: utf-8 -*-
 import sqlite3
 import os
+from models.rollups import ROLLUP_RESOLUTIONS
 
-# Funcion para crear las tablas en la base de datos
-def create_tables():
-    # Usar una ruta relativa a la ubicación del script
-    db_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sensor_data.db')
-    conn = sqlite3.connect(db_path)
-    c = conn.cursor()
+# Usar una ruta relativa a la ubicación del script
+DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sensor_data.db')
+
+# Migraciones del esquema en orden: (version, descripcion, transaccional, funcion).
+# La version aplicada se guarda en PRAGMA user_version; nunca se modifica una migracion ya publicada,
+# los cambios nuevos se anaden como una version mayor
+MIGRATIONS = []
+
+def migration(version, description, transactional=True):
+    def register(func):
+        MIGRATIONS.append((version, description, transactional, func))
+        return func
+    return register
+
+def _table_exists(c, name):
+    c.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = ?", (name,))
+    return c.fetchone() is not None
 
+@migration(1, 'auto_vacuum incremental', transactional=False)
+def _auto_vacuum(c):
+    # La retencion libera espacio con incremental_vacuum, que requiere auto_vacuum=INCREMENTAL.
+    # En una base nueva basta con fijarlo antes de crear tablas. Una existente necesitaria un VACUUM
+    # completo, que no se hace al arrancar: se convierte a mano con el servidor parado
+    c.execute('PRAGMA auto_vacuum')
+    if c.fetchone()[0] != 2:
+        c.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        c.execute("SELECT COUNT(*) FROM sqlite_master")
+        if c.fetchone()[0] > 0:
+            print("La base de datos no usa auto_vacuum incremental; para convertirla, con el servidor parado: "
+                  "sqlite3 sensor_data.db 'PRAGMA auto_vacuum = INCREMENTAL; VACUUM;'")
+
+@migration(2, 'esquema base, datos predeterminados e indices')
+def _baseline(c):
     # Crear tabla para datos de sensore SHT3x
     c.execute('''
         CREATE TABLE IF NOT EXISTS sht3x_data (
@@ -19,7 +46,6 @@ def create_tables():
             humidity REAL NOT NULL
         )
     ''')
-    print("Tabla sht3x_data creada o ya existe.")
 
     # Crear tabla para eventos
     c.execute('''
@@ -31,7 +57,6 @@ def create_tables():
             topic TEXT NOT NULL
         )
     ''')
-    print("Tabla events creada o ya existe.")
 
     # Crear tabla para actuadores
     c.execute('''
@@ -43,7 +68,6 @@ def create_tables():
             timestamp TEXT NOT NULL
         )
     ''')
-    print("Tabla actuators creada o ya existe.")
 
     # Crear tabla para parametros ideales
     c.execute('''
@@ -56,7 +80,6 @@ def create_tables():
             timestamp TEXT NOT NULL
         )
     ''')
-    print("Tabla ideal_params creada o ya existe.")
 
     # Crear tabla para el estado de la aplicacion
     c.execute('''
@@ -67,8 +90,7 @@ def create_tables():
             timestamp TEXT NOT NULL
         )
     ''')
-    print("Tabla app_state creada o ya existe.")
-    
+
     # Crear tabla para registro de clientes
     c.execute('''
         CREATE TABLE IF NOT EXISTS clients (
@@ -82,16 +104,14 @@ def create_tables():
             manually_disabled INTEGER DEFAULT 0
         )
     ''')
-    print("Tabla clients creada o ya existe.")
 
-    # Verificar si la columna manually_disabled existe en la tabla clients
+    # Las bases anteriores a manually_disabled no tienen la columna
     c.execute("PRAGMA table_info(clients)")
     columns = [column[1] for column in c.fetchall()]
     if 'manually_disabled' not in columns:
         c.execute("ALTER TABLE clients ADD COLUMN manually_disabled INTEGER DEFAULT 0")
         print("Columna manually_disabled anadida a la tabla clients")
 
-    # Verificaciones e inserciones en una sola transaccion
     # Insertar cliente predeterminado si no existe
     c.execute('SELECT COUNT(*) FROM clients WHERE client_id = "mushroom1"')
     if c.fetchone()[0] == 0:
@@ -102,54 +122,24 @@ def create_tables():
         print("Cliente predeterminado 'mushroom1' insertado.")
 
     # Insertar parametros ideales predeterminados para temperatura y humedad
-    c.execute('SELECT COUNT(*) FROM ideal_params WHERE param_type = "temperatura" AND client_id = "mushroom1"')
-    if c.fetchone()[0] == 0:
-        c.execute('''
-            INSERT INTO ideal_params (client_id, param_type, min_value, max_value, timestamp)
-            VALUES ('mushroom1', 'temperatura', 15, 30, datetime('now'))
-        ''')
-        print("Parametros ideales para 'temperatura' insertados.")
-
-    c.execute('SELECT COUNT(*) FROM ideal_params WHERE param_type = "humedad" AND client_id = "mushroom1"')
-    if c.fetchone()[0] == 0:
-        c.execute('''
-            INSERT INTO ideal_params (client_id, param_type, min_value, max_value, timestamp)
-            VALUES ('mushroom1', 'humedad', 30, 100, datetime('now'))
-        ''')
-        print("Parametros ideales para 'humedad' insertados.")
+    for param_type, min_value, max_value in (('temperatura', 15, 30), ('humedad', 30, 100)):
+        c.execute('SELECT COUNT(*) FROM ideal_params WHERE param_type = ? AND client_id = "mushroom1"', (param_type,))
+        if c.fetchone()[0] == 0:
+            c.execute('''
+                INSERT INTO ideal_params (client_id, param_type, min_value, max_value, timestamp)
+                VALUES ('mushroom1', ?, ?, ?, datetime('now'))
+            ''', (param_type, min_value, max_value))
+            print(f"Parametros ideales para '{param_type}' insertados.")
 
-    # Verificar si los actuadores predeterminados ya existen para el cliente mushroom1
-    c.execute('SELECT COUNT(*) FROM actuators WHERE name = "Iluminacion" AND client_id = "mushroom1"')
-    if c.fetchone()[0] == 0:
-        c.execute('''
-            INSERT INTO actuators (client_id, name, state, timestamp)
-            VALUES ('mushroom1', 'Iluminacion', 0, datetime('now'))
-        ''')
-        print("Actuador 'Iluminacion' insertado.")
-
-    c.execute('SELECT COUNT(*) FROM actuators WHERE name = "Ventilacion" AND client_id = "mushroom1"')
-    if c.fetchone()[0] == 0:
-        c.execute('''
-            INSERT INTO actuators (client_id, name, state, timestamp)
-            VALUES ('mushroom1', 'Ventilacion', 0, datetime('now'))
-        ''')
-        print("Actuador 'Ventilacion' insertado.")
-
-    c.execute('SELECT COUNT(*) FROM actuators WHERE name = "Humidificador" AND client_id = "mushroom1"')
-    if c.fetchone()[0] == 0:
-        c.execute('''
-            INSERT INTO actuators (client_id, name, state, timestamp)
-            VALUES ('mushroom1', 'Humidificador', 0, datetime('now'))
-        ''')
-        print("Actuador 'Humidificador' insertado.")
-
-    c.execute('SELECT COUNT(*) FROM actuators WHERE name = "Motor" AND client_id = "mushroom1"')
-    if c.fetchone()[0] == 0:
-        c.execute('''
-            INSERT INTO actuators (client_id, name, state, timestamp)
-            VALUES ('mushroom1', 'Motor', 0, datetime('now'))
-        ''')
-        print("Actuador 'Motor' insertado.")
+    # Insertar los actuadores predeterminados del cliente mushroom1
+    for name in ('Iluminacion', 'Ventilacion', 'Humidificador', 'Motor'):
+        c.execute('SELECT COUNT(*) FROM actuators WHERE name = ? AND client_id = "mushroom1"', (name,))
+        if c.fetchone()[0] == 0:
+            c.execute('''
+                INSERT INTO actuators (client_id, name, state, timestamp)
+                VALUES ('mushroom1', ?, 0, datetime('now'))
+            ''', (name,))
+            print(f"Actuador '{name}' insertado.")
 
     # Insertar estado inicial de la aplicacion si no existe para el cliente mushroom1
     c.execute('SELECT COUNT(*) FROM app_state WHERE client_id = "mushroom1"')
@@ -161,18 +151,181 @@ def create_tables():
         print("Estado inicial de la aplicacion insertado.")
 
     # Crear indices para mejorar el rendimiento de consultas frecuentes
-    c.execute('CREATE INDEX IF NOT EXISTS idx_sht3x_client_timestamp ON sht3x_data(client_id, timestamp)')
+    # En la distribucion compacta sht3x_data es una vista y no admite indices
+    if _table_exists(c, 'sht3x_data'):
+        c.execute('CREATE INDEX IF NOT EXISTS idx_sht3x_client_timestamp ON sht3x_data(client_id, timestamp)')
     c.execute('CREATE INDEX IF NOT EXISTS idx_events_client_timestamp ON events(client_id, timestamp)')
     c.execute('CREATE INDEX IF NOT EXISTS idx_actuators_client_name ON actuators(client_id, name)')
     c.execute('CREATE INDEX IF NOT EXISTS idx_ideal_params_client_type ON ideal_params(client_id, param_type)')
-    
-    # Optimizar la base de datos
-    c.execute('PRAGMA optimize')
 
-    conn.commit()
-    conn.close()
-    print("Base de datos creada, tablas inicializadas y optimizadas.")
+@migration(3, 'agregados de sht3x_data por minuto, hora y dia')
+def _rollups(c):
+    # Crear tablas de agregados (min/max/suma por cliente e intervalo) para 1m, 1h y 1d.
+    # Los agregados de las lecturas existentes se calculan despues con un backfill (migracion 5)
+    for table, _ in ROLLUP_RESOLUTIONS.values():
+        c.execute(f'''
+            CREATE TABLE IF NOT EXISTS {table} (
+                client_id TEXT NOT NULL,
+                bucket TEXT NOT NULL,
+                count INTEGER NOT NULL,
+                temperature_min REAL NOT NULL,
+                temperature_max REAL NOT NULL,
+                temperature_sum REAL NOT NULL,
+                humidity_min REAL NOT NULL,
+                humidity_max REAL NOT NULL,
+                humidity_sum REAL NOT NULL,
+                PRIMARY KEY (client_id, bucket)
+            ) WITHOUT ROWID
+        ''')
+
+@migration(4, 'ajustes de almacenamiento y politicas de retencion')
+def _storage_settings(c):
+    # Crear tabla de ajustes de almacenamiento (distribucion de sht3x_data, archivo frio)
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS storage_meta (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        )
+    ''')
+
+    # Crear tabla de politicas de retencion (client_id '' = politica global de la tabla)
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS retention_policies (
+            table_name TEXT NOT NULL,
+            client_id TEXT NOT NULL DEFAULT '',
+            retention_days INTEGER,
+            PRIMARY KEY (table_name, client_id)
+        )
+    ''')
+
+@migration(5, 'backfills por lotes reanudables')
+def _backfills(c):
+    # Progreso de las migraciones de datos que se ejecutan en segundo plano (models/backfills.py)
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS backfills (
+            name TEXT PRIMARY KEY,
+            state TEXT NOT NULL DEFAULT 'pending',
+            last_key INTEGER NOT NULL DEFAULT 0,
+            rows INTEGER NOT NULL DEFAULT 0,
+            started_at TEXT,
+            finished_at TEXT,
+            error TEXT
+        )
+    ''')
+
+    # Continuar como backfill una migracion compacta iniciada con el formato anterior
+    c.execute("SELECT value FROM storage_meta WHERE key = 'sht3x_layout'")
+    row = c.fetchone()
+    if row is not None and row[0] == 'migrating':
+        c.execute("SELECT value FROM storage_meta WHERE key = 'sht3x_migration_last_id'")
+        last_id = c.fetchone()
+        c.execute("INSERT OR IGNORE INTO backfills (name, last_key) VALUES ('sht3x_compact_copy', ?)",
+                  (int(last_id[0]) if last_id else 0,))
+    if _table_exists(c, 'sht3x_data_legacy'):
+        c.execute("INSERT OR IGNORE INTO backfills (name) VALUES ('sht3x_legacy_purge')")
+    c.execute("DELETE FROM storage_meta WHERE key = 'sht3x_migration_last_id'")
+
+    # Calcular en segundo plano los agregados de las lecturas anteriores a las tablas de la migracion 3
+    if _table_exists(c, 'sht3x_data'):
+        c.execute('''
+            SELECT EXISTS (SELECT 1 FROM sht3x_data)
+               AND NOT EXISTS (SELECT 1 FROM sht3x_rollup_1m)
+               AND NOT EXISTS (SELECT 1 FROM sht3x_rollup_1h)
+               AND NOT EXISTS (SELECT 1 FROM sht3x_rollup_1d)
+        ''')
+        if c.fetchone()[0]:
+            c.execute("INSERT OR IGNORE INTO backfills (name) VALUES ('sht3x_rollup_rebuild')")
+
+@migration(6, 'estado actual por cliente (client_latest)')
+def _client_latest(c):
+    # Ultima lectura, ultima conexion, actuadores y modo de cada cliente para el panel de toda la flota
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS client_latest (
+            client_id TEXT PRIMARY KEY,
+            timestamp TEXT,
+            temperature REAL,
+            humidity REAL,
+            last_seen TEXT,
+            actuators TEXT,
+            mode TEXT
+        ) WITHOUT ROWID
+    ''')
+
+    # Cargar el estado actual a partir de los datos existentes
+    c.execute("SELECT value FROM storage_meta WHERE key = 'sht3x_layout'")
+    row = c.fetchone()
+    order = 'id DESC' if row is not None and row[0] == 'compact' else 'timestamp DESC'
+    c.execute('SELECT client_id, last_seen FROM clients')
+    for client_id, last_seen in c.fetchall():
+        c.execute(f'SELECT timestamp, temperature, humidity FROM sht3x_data WHERE client_id = ? ORDER BY {order} LIMIT 1',
+                  (client_id,))
+        reading = c.fetchone() or (None, None, None)
+        c.execute('''
+            INSERT OR REPLACE INTO client_latest (client_id, timestamp, temperature, humidity, last_seen, actuators, mode)
+            VALUES (?, ?, ?, ?, NULLIF(MAX(COALESCE(?, ''), COALESCE(?, '')), ''),
+                    (SELECT json_group_object(name, state)
+                     FROM (SELECT name, state FROM actuators WHERE client_id = ? ORDER BY id)),
+                    (SELECT mode FROM app_state WHERE client_id = ? ORDER BY timestamp DESC LIMIT 1))
+        ''', (client_id, *reading, last_seen, reading[0], client_id, client_id))
+
+@migration(7, 'secuencias recientes de ingesta para descartar duplicados (ingest_sequences)')
+def _ingest_sequences(c):
+    # Secuencias ya guardadas por cliente: la clave primaria es el indice unico que descarta
+    # las reentregas QoS 1 que no estan en la ventana en memoria (models/dedup.py)
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS ingest_sequences (
+            client_id TEXT NOT NULL,
+            seq INTEGER NOT NULL,
+            received_at REAL NOT NULL,
+            PRIMARY KEY (client_id, seq)
+        ) WITHOUT ROWID
+    ''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_ingest_sequences_received ON ingest_sequences(received_at)')
+
+SCHEMA_VERSION = max(version for version, _, _, _ in MIGRATIONS)
+
+def _user_version(c):
+    c.execute('PRAGMA user_version')
+    return c.fetchone()[0]
+
+# Aplicar las migraciones pendientes; con el esquema al dia solo se lee user_version
+def migrate_database(db_path=DB_PATH):
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    c = conn.cursor()
+    try:
+        current = _user_version(c)
+        if current >= SCHEMA_VERSION:
+            return current
+
+        for version, description, transactional, func in sorted(MIGRATIONS, key=lambda m: m[0]):
+            if transactional:
+                # BEGIN IMMEDIATE serializa el arranque de varios procesos: se vuelve a leer la version
+                c.execute('BEGIN IMMEDIATE')
+                if _user_version(c) >= version:
+                    c.execute('ROLLBACK')
+                    continue
+                try:
+                    func(c)
+                    c.execute(f'PRAGMA user_version = {version}')
+                    c.execute('COMMIT')
+                except Exception:
+                    c.execute('ROLLBACK')
+                    raise
+            else:
+                # Migraciones que no pueden ir en una transaccion (PRAGMA auto_vacuum); deben ser idempotentes
+                if _user_version(c) >= version:
+                    continue
+                func(c)
+                c.execute(f'PRAGMA user_version = {version}')
+            print(f"Migracion {version} aplicada: {description}")
+
+        # Actualizar las estadisticas del planificador tras cambiar el esquema
+        c.execute('PRAGMA optimize')
+        print(f"Esquema de la base de datos en la version {SCHEMA_VERSION}.")
+        return SCHEMA_VERSION
+    finally:
+        conn.close()
 
-# Ejecutar la funcion para crear las tablas si el archivo se ejecuta directamente
+# Ejecutar las migraciones si el archivo se ejecuta directamente
 if __name__ == '__main__':
-    create_tables()
+    migrate_database()
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""
+Importar lecturas historicas del sensor SHT3x desde un archivo CSV o NDJSON (opcionalmente .gz).
+
+Por defecto envia el archivo por streaming al endpoint /api/Sht3xSensor/import del
+servidor en marcha. Con --direct escribe en la base de datos local (solo con el servidor detenido).
+
+    python import_readings.py lecturas.csv
+    python import_readings.py lecturas.ndjson.gz --client-id mushroom1
+    python import_readings.py lecturas.csv --direct
+"""
+import argparse
+import asyncio
+import gzip
+import io
+import json
+import os
+import sys
+import urllib.error
+import urllib.parse
+import urllib.request
+
+DEFAULT_SERVER = 'http://localhost:5000'
+UPLOAD_CHUNK_SIZE = 65536  # Bytes enviados por bloque al servidor
+
+# Formato segun la extension del archivo (sin .gz)
+def detect_format(path):
+    name = path[:-3] if path.endswith('.gz') else path
+    return 'csv' if name.endswith('.csv') else 'ndjson'
+
+def _chunks(f):
+    while True:
+        chunk = f.read(UPLOAD_CHUNK_SIZE)
+        if not chunk:
+            return
+        yield chunk
+
+# Enviar el archivo al servidor sin cargarlo en memoria (el .gz se envia comprimido)
+def import_via_server(path, fmt, client_id, server):
+    params = {'format': fmt}
+    if client_id:
+        params['client_id'] = client_id
+    url = f"{server.rstrip('/')}/api/Sht3xSensor/import?{urllib.parse.urlencode(params)}"
+    headers = {
+        'Content-Type': 'text/csv' if fmt == 'csv' else 'application/x-ndjson',
+        'Content-Length': str(os.path.getsize(path)),
+    }
+    if path.endswith('.gz'):
+        headers['Content-Encoding'] = 'gzip'
+    with open(path, 'rb') as f:
+        req = urllib.request.Request(url, data=_chunks(f), headers=headers, method='POST')
+        try:
+            with urllib.request.urlopen(req) as response:
+                return json.load(response)
+        except urllib.error.HTTPError as e:
+            raise SystemExit(f"Error del servidor ({e.code}): {e.read().decode('utf-8', 'replace')}")
+
+# Importar directamente en la base de datos local, en el mismo proceso
+def import_direct(path, fmt, client_id, batch_size):
+    from database import migrate_database
+    from models.bulk_import import IMPORT_BATCH_SIZE, import_readings
+    from models.sensor_data import cleanup
+
+    migrate_database()
+
+    async def run():
+        opener = gzip.open if path.endswith('.gz') else open
+        try:
+            with opener(path, 'rb') as raw:
+                lines = io.TextIOWrapper(raw, encoding='utf-8-sig', newline='')
+                return await import_readings(lines, fmt, client_id=client_id,
+                                            batch_size=batch_size or IMPORT_BATCH_SIZE)
+        finally:
+            await cleanup()
+    return asyncio.run(run())
+
+def main():
+    parser = argparse.ArgumentParser(description='Importar lecturas historicas del sensor SHT3x')
+    parser.add_argument('path', help='Archivo CSV o NDJSON (opcionalmente .gz)')
+    parser.add_argument('--format', choices=['csv', 'ndjson'], help='Formato (por defecto segun la extension)')
+    parser.add_argument('--client-id', help='Cliente de las lecturas sin columna client_id')
+    parser.add_argument('--server', default=DEFAULT_SERVER, help=f'URL del servidor (por defecto {DEFAULT_SERVER})')
+    parser.add_argument('--direct', action='store_true', help='Escribir en la base de datos local sin pasar por el servidor')
+    parser.add_argument('--batch-size', type=int, help='Lecturas por transaccion (solo con --direct)')
+    args = parser.parse_args()
+
+    fmt = args.format or detect_format(args.path)
+    try:
+        if args.direct:
+            report = import_direct(args.path, fmt, args.client_id, args.batch_size)
+        else:
+            report = import_via_server(args.path, fmt, args.client_id, args.server)
+    except (OSError, ValueError) as e:
+        raise SystemExit(f"Error: {e}")
+
+    print(f"Importadas {report['imported']} de {report['rows']} lecturas en {report['batches']} lotes "
+          f"({report['duration_ms'] / 1000:.1f} s, {report['rows_per_second']} lecturas/s)")
+    if report['rejected']:
+        print(f"Descartadas {report['rejected']} lecturas:")
+        for error in report['errors']:
+            print(f"  linea {error['line']}: {error['error']}")
+    return 0 if report['imported'] or not report['rows'] else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+"""
+Cola de ingesta MQTT: el callback de paho solo encola los mensajes crudos y un
+hilo consumidor los entrega por micro-lotes al bucle asincrono.
+"""
+import threading
+import time
+from collections import deque
+
+# Configuracion de la ingesta
+INGEST_QUEUE_SIZE = 10000  # Mensajes crudos en espera como maximo
+INGEST_BATCH_SIZE = 500  # Mensajes procesados como maximo por micro-lote
+INGEST_POLL_TIMEOUT = 1.0  # Segundos de espera del consumidor con la cola vacia
+INGEST_BLOCK_TIMEOUT = 30.0  # Segundos maximos bloqueando a paho (mas tiempo perderia el keepalive del broker)
+INGEST_HEALTH_WINDOW = 60  # Segundos durante los que un descarte marca la ingesta como 'shedding'
+INGEST_DEGRADED_RATIO = 0.8  # Ocupacion de la cola a partir de la que la ingesta esta 'degraded'
+
+# Politicas con la cola llena
+POLICY_BLOCK = 'block'  # Bloquear a paho hasta que haya espacio (el broker retiene el resto)
+POLICY_DROP_OLDEST = 'drop_oldest'  # Descartar el mensaje mas antiguo
+POLICY_LATEST_PER_CLIENT = 'latest_per_client'  # Conservar solo la lectura mas reciente de cada cliente
+INGEST_POLICIES = (POLICY_BLOCK, POLICY_DROP_OLDEST, POLICY_LATEST_PER_CLIENT)
+INGEST_OVERFLOW_POLICY = POLICY_BLOCK
+
+
+class IngestQueue:
+    """
+    Cola acotada y segura entre hilos con una politica para cuando se llena.
+    `coalesce_key(item)` identifica las lecturas que `latest_per_client` puede
+    sustituir por una mas reciente (None para los mensajes que nunca se descartan).
+    """
+
+    def __init__(self, maxsize=INGEST_QUEUE_SIZE, policy=INGEST_OVERFLOW_POLICY, coalesce_key=None):
+        self.maxsize = maxsize
+        self.policy = policy
+        self.coalesce_key = coalesce_key or (lambda item: None)
+        self._items = deque()
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._not_full = threading.Condition(self._lock)
+        self._closed = False
+        self._last_shed = None
+        self.stats = {
+            'enqueued': 0,
+            'dequeued': 0,
+            'blocked': 0,  # Veces que paho tuvo que esperar por la cola llena
+            'block_timeouts': 0,  # Mensajes descartados tras esperar INGEST_BLOCK_TIMEOUT
+            'dropped_oldest': 0,  # Mensajes antiguos descartados por drop_oldest
+            'coalesced': 0,  # Lecturas sustituidas por una mas reciente del mismo cliente
+            'max_depth': 0,
+        }
+
+    def set_policy(self, policy):
+        if policy not in INGEST_POLICIES:
+            raise ValueError(f"Politica no valida. Opciones: {', '.join(INGEST_POLICIES)}")
+        with self._lock:
+            self.policy = policy
+            # Despertar a paho si estaba bloqueado: la nueva politica decide
+            self._not_full.notify_all()
+
+    def _shed(self, counter, count=1):
+        self.stats[counter] += count
+        self._last_shed = time.monotonic()
+
+    def _coalesce(self):
+        # Quedarse con la ultima lectura de cada cliente (y todos los mensajes sin clave), en orden
+        latest = {}
+        for index, item in enumerate(self._items):
+            key = self.coalesce_key(item)
+            if key is not None:
+                latest[key] = index
+        kept = deque(item for index, item in enumerate(self._items)
+                     if self.coalesce_key(item) is None or latest[self.coalesce_key(item)] == index)
+        removed = len(self._items) - len(kept)
+        self._items = kept
+        if removed:
+            self._shed('coalesced', removed)
+
+    def _make_room(self):
+        # Devuelve False si el mensaje nuevo debe descartarse
+        if self.policy == POLICY_BLOCK:
+            self.stats['blocked'] += 1
+            deadline = time.monotonic() + INGEST_BLOCK_TIMEOUT
+            while len(self._items) >= self.maxsize and not self._closed and self.policy == POLICY_BLOCK:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._shed('block_timeouts')
+                    return False
+                self._not_full.wait(remaining)
+            if len(self._items) < self.maxsize or self._closed:
+                return True
+        if self.policy == POLICY_LATEST_PER_CLIENT:
+            self._coalesce()
+        while len(self._items) >= self.maxsize:
+            self._items.popleft()
+            self._shed('dropped_oldest')
+        return True
+
+    def put(self, item):
+        with self._lock:
+            if len(self._items) >= self.maxsize and not self._make_room():
+                return False
+            if self._closed:
+                return False
+            self._items.append(item)
+            self.stats['enqueued'] += 1
+            self.stats['max_depth'] = max(self.stats['max_depth'], len(self._items))
+            self._not_empty.notify()
+            return True
+
+    def get_batch(self, max_items, timeout=None):
+        """Esperar al menos un mensaje y devolver todos los disponibles hasta `max_items`"""
+        with self._lock:
+            if not self._items and not self._closed:
+                self._not_empty.wait(timeout)
+            batch = []
+            while self._items and len(batch) < max_items:
+                batch.append(self._items.popleft())
+            if batch:
+                self.stats['dequeued'] += len(batch)
+                self._not_full.notify_all()
+            return batch
+
+    def close(self):
+        """No aceptar mas mensajes y despertar a quien espere"""
+        with self._lock:
+            self._closed = True
+            self._not_empty.notify_all()
+            self._not_full.notify_all()
+
+    def get_health(self):
+        """'shedding' si se descartaron mensajes hace poco, 'degraded' si la cola esta casi llena, si no 'ok'"""
+        with self._lock:
+            depth = len(self._items)
+            last_shed = self._last_shed
+        if last_shed is not None and time.monotonic() - last_shed < INGEST_HEALTH_WINDOW:
+            status = 'shedding'
+        elif depth >= self.maxsize * INGEST_DEGRADED_RATIO:
+            status = 'degraded'
+        else:
+            status = 'ok'
+        return {
+            'status': status,
+            'policy': self.policy,
+            'depth': depth,
+            'capacity': self.maxsize,
+            'fill_ratio': round(depth / self.maxsize, 3),
+            'last_shed_seconds_ago': round(time.monotonic() - last_shed, 1) if last_shed is not None else None,
+        }
+
+    def __len__(self):
+        with self._lock:
+            return len(self._items)
+
+
+class IngestConsumer:
+    """
+    Hilo que vacia la cola por micro-lotes y ejecuta `process_batch(batch)`
+    (una corrutina) en el bucle de eventos, esperando a que termine antes del
+    siguiente lote: los mensajes que llegan mientras tanto forman el lote siguiente.
+    """
+
+    def __init__(self, ingest_queue, process_batch, run_batch, batch_size=INGEST_BATCH_SIZE):
+        self.queue = ingest_queue
+        self.process_batch = process_batch
+        self.run_batch = run_batch  # Ejecuta la corrutina en el bucle y espera su resultado
+        self.batch_size = batch_size
+        self._thread = None
+        self._stopping = False
+        self.stats = {
+            'batches': 0,
+            'messages': 0,
+            'max_batch': 0,
+            'failed_batches': 0,
+            'total_ms': 0.0,
+            'max_ms': 0.0,
+        }
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name='mqtt-ingest', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            batch = self.queue.get_batch(self.batch_size, INGEST_POLL_TIMEOUT)
+            if not batch:
+                if self._stopping:
+                    return
+                continue
+            start = time.monotonic()
+            try:
+                self.run_batch(self.process_batch(batch))
+            except Exception as e:
+                self.stats['failed_batches'] += 1
+                print(f"Error procesando lote de ingesta: {e}")
+            elapsed = (time.monotonic() - start) * 1000
+            self.stats['batches'] += 1
+            self.stats['messages'] += len(batch)
+            self.stats['max_batch'] = max(self.stats['max_batch'], len(batch))
+            self.stats['total_ms'] += elapsed
+            self.stats['max_ms'] = max(self.stats['max_ms'], elapsed)
+
+    def stop(self, timeout=10):
+        """Procesar lo que queda en la cola y detener el hilo"""
+        self._stopping = True
+        self.queue.close()
+        if self._thread is not None and self._thread.is_alive():
+            self._thread.join(timeout)
+        self._thread = None
+
+    def get_metrics(self):
+        batches = self.stats['batches']
+        return {
+            'health': self.queue.get_health()['status'],
+            'policy': self.queue.policy,
+            'depth': len(self.queue),
+            'capacity': self.queue.maxsize,
+            **self.queue.stats,
+            'batches': batches,
+            'messages': self.stats['messages'],
+            'avg_batch': round(self.stats['messages'] / batches, 2) if batches else 0.0,
+            'max_batch': self.stats['max_batch'],
+            'failed_batches': self.stats['failed_batches'],
+            'avg_batch_ms': round(self.stats['total_ms'] / batches, 3) if batches else 0.0,
+            'max_batch_ms': round(self.stats['max_ms'], 3),
+        }
@@ -0,0 +1,349 @@
+# -*- coding: utf-8 -*-
+"""
+Ingesta MQTT multiproceso (opcional).
+
+Con INGEST_WORKERS > 0 el servidor lanza N procesos worker. Cada worker tiene su
+propio cliente MQTT, cola de ingesta y bucle de eventos, y procesa solo los
+clientes cuya particion (hash estable del client_id) le corresponde: el analisis
+de los payloads y las reglas de control se reparten entre varios nucleos. Las
+escrituras (lecturas, eventos, estado de clientes y actuadores) se envian al
+proceso del servidor, que las ejecuta con su escritor unico.
+
+    python ingest_workers.py <indice> <total> <host> <puerto>   (lo lanza el servidor)
+"""
+import asyncio
+import functools
+import os
+import secrets
+import signal
+import subprocess
+import sys
+import threading
+import time
+import zlib
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener
+from ingest import INGEST_OVERFLOW_POLICY
+from models.cache import get_cache_metrics
+from models.change_bus import publish, subscribe
+
+# Configuracion de la ingesta multiproceso
+INGEST_WORKERS = 0  # Procesos worker de ingesta (0 = toda la ingesta en el proceso del servidor)
+WORKER_CHECK_INTERVAL = 5  # Segundos entre comprobaciones de los workers (se relanzan si terminan)
+WORKER_METRICS_INTERVAL = 5  # Segundos entre envios de metricas de cada worker al servidor
+WORKER_STOP_TIMEOUT = 15  # Segundos de espera a que un worker vacie su cola al detenerse
+WORKER_AUTHKEY_ENV = 'INGEST_WORKER_AUTHKEY'  # Clave de la conexion con el servidor (la genera el servidor)
+WORKER_SCRIPT = os.path.abspath(__file__)
+
+_HEALTH_ORDER = ('ok', 'degraded', 'shedding')
+
+
+# Particion de un cliente: crc32 y no hash(), que cambia entre procesos
+def shard_of(client_id, workers):
+    return zlib.crc32(client_id.encode('utf-8')) % workers
+
+
+class IngestWorkerPool:
+    """
+    Lado del servidor: lanza y supervisa los workers y ejecuta sus escrituras.
+    `writes` expone las operaciones permitidas (`writes.OPERATIONS`) y `submit(coro)`
+    programa una corrutina en el bucle del servidor y devuelve un concurrent Future.
+    """
+
+    def __init__(self, workers, writes, submit):
+        self.workers = workers
+        self.writes = writes
+        self.submit = submit
+        self.policy = INGEST_OVERFLOW_POLICY  # Politica de las colas de los workers (se reenvia a los relanzados)
+        self._authkey = secrets.token_bytes(32)
+        self._listener = None
+        self._processes = {}
+        self._connections = {}
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._state = {
+            index: {
+                'pid': None,
+                'restarts': 0,
+                'calls': 0,
+                'failed_calls': 0,
+                'queue': None,  # Ultimas metricas de la cola del worker
+                'health': None,
+                'caches': None,  # Ultimos contadores de las caches del worker
+                'reported': None,
+            }
+            for index in range(workers)
+        }
+
+    def start(self):
+        self._listener = Listener(('127.0.0.1', 0), authkey=self._authkey)
+        threading.Thread(target=self._accept, name='ingest-workers', daemon=True).start()
+        for index in range(self.workers):
+            self._launch(index)
+        threading.Thread(target=self._supervise, name='ingest-workers-check', daemon=True).start()
+        subscribe(None, self._forward)
+        print(f"Ingesta multiproceso: {self.workers} workers")
+
+    def _launch(self, index):
+        host, port = self._listener.address
+        env = dict(os.environ, **{WORKER_AUTHKEY_ENV: self._authkey.hex()})
+        process = subprocess.Popen(
+            [sys.executable, WORKER_SCRIPT, str(index), str(self.workers), host, str(port)],
+            env=env, cwd=os.path.dirname(WORKER_SCRIPT)
+        )
+        self._processes[index] = process
+        self._state[index]['pid'] = process.pid
+
+    def _supervise(self):
+        while not self._stopping.wait(WORKER_CHECK_INTERVAL):
+            for index, process in list(self._processes.items()):
+                if process.poll() is not None and not self._stopping.is_set():
+                    print(f"Worker de ingesta {index} terminado (codigo {process.returncode}), relanzando")
+                    self._state[index]['restarts'] += 1
+                    self._launch(index)
+
+    def _accept(self):
+        while not self._stopping.is_set():
+            try:
+                conn = self._listener.accept()
+            except (OSError, EOFError, AuthenticationError) as e:
+                if self._stopping.is_set():
+                    return
+                print(f"Conexion de worker de ingesta rechazada: {e}")
+                continue
+            threading.Thread(target=self._serve, args=(conn,), name='ingest-workers-conn', daemon=True).start()
+
+    @staticmethod
+    def _send(conn, lock, message):
+        try:
+            with lock:
+                conn.send(message)
+        except (OSError, ValueError) as e:
+            print(f"Error enviando al worker de ingesta: {e}")
+
+    def _serve(self, conn):
+        # El worker se presenta con ('hello', indice, pid) y despues envia llamadas y metricas
+        try:
+            _, index, pid = conn.recv()
+        except (EOFError, OSError, ValueError):
+            conn.close()
+            return
+        lock = threading.Lock()
+        with self._lock:
+            self._connections[index] = (conn, lock)
+        if self.policy != INGEST_OVERFLOW_POLICY:
+            self._send(conn, lock, ('policy', self.policy))
+
+        state = self._state[index]
+        while True:
+            try:
+                message = conn.recv()
+            except (EOFError, OSError):
+                break
+            if message[0] == 'call':
+                self._call(state, conn, lock, *message[1:])
+            elif message[0] == 'metrics':
+                state['queue'], state['health'], state['caches'] = message[1], message[2], message[3]
+                state['reported'] = time.monotonic()
+
+        with self._lock:
+            if self._connections.get(index, (None,))[0] is conn:
+                del self._connections[index]
+        conn.close()
+
+    def _call(self, state, conn, lock, request_id, name, args):
+        state['calls'] += 1
+
+        def reply(future):
+            try:
+                message = ('result', request_id, future.result())
+            except Exception as e:
+                state['failed_calls'] += 1
+                message = ('error', request_id, str(e))
+            self._send(conn, lock, message)
+
+        if name not in self.writes.OPERATIONS:
+            state['failed_calls'] += 1
+            self._send(conn, lock, ('error', request_id, f"Operacion no permitida: {name}"))
+            return
+        self.submit(getattr(self.writes, name)(*args)).add_done_callback(reply)
+
+    # Reenviar a los workers los cambios confirmados en este proceso (API o escrituras de los workers)
+    def _forward(self, change):
+        if self._stopping.is_set():
+            return
+        with self._lock:
+            connections = list(self._connections.values())
+        for conn, lock in connections:
+            self._send(conn, lock, ('change', change.kind, change.client_id, change.data))
+
+    def set_policy(self, policy):
+        self.policy = policy
+        with self._lock:
+            connections = list(self._connections.values())
+        for conn, lock in connections:
+            self._send(conn, lock, ('policy', policy))
+
+    def stop(self):
+        """Pedir a los workers que vacien sus colas y esperar a que terminen"""
+        self._stopping.set()
+        with self._lock:
+            connections = dict(self._connections)
+        for conn, lock in connections.values():
+            self._send(conn, lock, ('stop',))
+        for index, process in self._processes.items():
+            if index not in connections:
+                process.terminate()
+            try:
+                process.wait(WORKER_STOP_TIMEOUT)
+            except subprocess.TimeoutExpired:
+                print(f"Worker de ingesta {index} sin responder, terminando")
+                process.kill()
+        if self._listener is not None:
+            self._listener.close()
+
+    def _worker_health(self, index):
+        state = self._state[index]
+        process = self._processes.get(index)
+        alive = process is not None and process.poll() is None
+        stale = state['reported'] is None or time.monotonic() - state['reported'] > 3 * WORKER_METRICS_INTERVAL
+        # Un worker caido o sin reportar pierde los mensajes de sus clientes
+        if not alive or (stale and not self._stopping.is_set()):
+            return {'status': 'shedding', 'alive': alive}
+        return {**state['health'], 'alive': alive}
+
+    def get_health(self):
+        workers = [self._worker_health(index) for index in range(self.workers)]
+        return {
+            'status': max((worker['status'] for worker in workers), key=_HEALTH_ORDER.index),
+            'policy': self.policy,
+            'workers': workers,
+        }
+
+    def get_cache_metrics(self):
+        return [{'index': index, 'caches': self._state[index]['caches']} for index in range(self.workers)]
+
+    def get_metrics(self):
+        processes = []
+        for index in range(self.workers):
+            state = self._state[index]
+            processes.append({
+                'index': index,
+                'pid': state['pid'],
+                'health': self._worker_health(index)['status'],
+                'restarts': state['restarts'],
+                'calls': state['calls'],
+                'failed_calls': state['failed_calls'],
+                'queue': state['queue'],
+            })
+        return {
+            'workers': self.workers,
+            'health': self.get_health()['status'],
+            'processes': processes,
+        }
+
+
+class RemoteWrites:
+    """
+    Lado del worker: sustituye a las escrituras de la ingesta de mqtt_client. Cada
+    llamada (`await writes.save_event(...)`) se envia al servidor y espera su resultado.
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._next_id = 0
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return functools.partial(self.call, name)
+
+    def send(self, message):
+        with self._lock:
+            self.conn.send(message)
+
+    async def call(self, name, *args):
+        future = asyncio.get_running_loop().create_future()
+        with self._lock:
+            self._next_id += 1
+            request_id = self._next_id
+            self._pending[request_id] = future
+            try:
+                self.conn.send(('call', request_id, name, args))
+            except (OSError, ValueError):
+                del self._pending[request_id]
+                raise
+        return await future
+
+    def resolve(self, request_id, error, value):
+        with self._lock:
+            future = self._pending.pop(request_id, None)
+        if future is not None:
+            future.get_loop().call_soon_threadsafe(_set_future, future, error, value)
+
+    def fail_all(self, reason):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        for request_id, future in pending.items():
+            future.get_loop().call_soon_threadsafe(_set_future, future, True, reason)
+
+def _set_future(future, error, value):
+    if future.done():
+        return
+    if error:
+        future.set_exception(RuntimeError(value))
+    else:
+        future.set_result(value)
+
+# Hilo del worker que recibe las respuestas y las ordenes del servidor
+def _read_server(conn, remote, stop, mqtt_client):
+    while True:
+        try:
+            message = conn.recv()
+        except (EOFError, OSError):
+            break
+        kind = message[0]
+        if kind == 'result':
+            remote.resolve(message[1], False, message[2])
+        elif kind == 'error':
+            remote.resolve(message[1], True, message[2])
+        elif kind == 'policy':
+            mqtt_client.set_ingest_policy(message[1])
+        elif kind == 'change':
+            # Cambio confirmado en el servidor: actualizar el estado y las caches de este worker
+            publish(message[1], message[2], **message[3])
+        elif kind == 'stop':
+            stop.set()
+    remote.fail_all("Conexion con el servidor cerrada")
+    stop.set()
+
+def worker_main(index, workers, host, port):
+    import mqtt_client
+
+    conn = Client((host, port), authkey=bytes.fromhex(os.environ[WORKER_AUTHKEY_ENV]))
+    remote = RemoteWrites(conn)
+    remote.send(('hello', index, os.getpid()))
+    mqtt_client.configure_worker(index, workers, remote)
+
+    # Detenerse (vaciando la cola) cuando lo pida el servidor o con SIGTERM/SIGINT
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    signal.signal(signal.SIGINT, lambda *_: stop.set())
+    threading.Thread(target=_read_server, args=(conn, remote, stop, mqtt_client),
+                     name='ingest-worker-conn', daemon=True).start()
+
+    mqtt_client.connect_mqtt()
+    print(f"Worker de ingesta {index}/{workers} en marcha (pid {os.getpid()})")
+    while not stop.wait(WORKER_METRICS_INTERVAL):
+        try:
+            remote.send(('metrics', mqtt_client.get_ingest_queue_metrics(), mqtt_client.get_ingest_health(),
+                         get_cache_metrics()))
+        except (OSError, ValueError):
+            break
+    mqtt_client.cleanup()
+    conn.close()
+
+if __name__ == '__main__':
+    worker_main(int(sys.argv[1]), int(sys.argv[2]), sys.argv[3], int(sys.argv[4]))
@@ -1,43 +1,45 @@
 import aiosqlite
 from datetime import datetime
-from .sensor_data import get_db_connection
+from .db_pool import pool
+from .db_writer import writer
+from .client_latest import refresh_latest_actuators
+from .change_bus import ACTUATOR_ADDED, ACTUATOR_STATE_CHANGED, publish
 
-# Guardar estado de actuadores en la base de datos
+# Guardar estado de actuadores en la base de datos (y en el estado actual del cliente)
 async def save_actuator_state(client_id, name, state):
-    conn = await get_db_connection()
-    await conn.execute('INSERT INTO actuators (client_id, name, state, timestamp) VALUES (?, ?, ?, ?)',
-                       (client_id, name, state, datetime.now().isoformat()))
-    await conn.commit()
-    await conn.close()
+    async def operation(conn):
+        await conn.execute('INSERT INTO actuators (client_id, name, state, timestamp) VALUES (?, ?, ?, ?)',
+                           (client_id, name, state, datetime.now().isoformat()))
+        await refresh_latest_actuators(conn, client_id)
+    await writer.run(operation)
+    publish(ACTUATOR_ADDED, client_id, name=name, state=state)
 
-# Editar estado de actuadores en la base de datos
+# Editar estado de actuadores en la base de datos (y en el estado actual del cliente)
 async def update_actuator_state(client_id, id, state):
-    conn = await get_db_connection()
-    await conn.execute('UPDATE actuators SET state = ?, timestamp = ? WHERE id = ? AND client_id = ?',
-                       (state, datetime.now().isoformat(), id, client_id))
-    await conn.commit()
-    await conn.close()
+    async def operation(conn):
+        await conn.execute('UPDATE actuators SET state = ?, timestamp = ? WHERE id = ? AND client_id = ?',
+                           (state, datetime.now().isoformat(), id, client_id))
+        await refresh_latest_actuators(conn, client_id)
+    await writer.run(operation)
+    publish(ACTUATOR_STATE_CHANGED, client_id, actuator_id=id, state=state)
 
 # Obtener todos los actuadores desde la base de datos para un cliente
 async def get_all_actuators(client_id):
-    conn = await get_db_connection()
-    async with conn.execute('SELECT * FROM actuators WHERE client_id = ?', (client_id,)) as cursor:
-        data = await cursor.fetchall()
-    await conn.close()
+    async with pool.reader() as conn:
+        async with conn.execute('SELECT * FROM actuators WHERE client_id = ?', (client_id,)) as cursor:
+            data = await cursor.fetchall()
     return data
 
 # Obtener el estado de un actuador especfico desde la base de datos
 async def get_actuator_state(client_id, id):
-    conn = await get_db_connection()
-    async with conn.execute('SELECT state FROM actuators WHERE id = ? AND client_id = ?', (id, client_id)) as cursor:
-        state = await cursor.fetchone()
-    await conn.close()
+    async with pool.reader() as conn:
+        async with conn.execute('SELECT state FROM actuators WHERE id = ? AND client_id = ?', (id, client_id)) as cursor:
+            state = await cursor.fetchone()
     return state['state'] if state else None
 
 # Obtener un actuador por nombre para un cliente especfico
 async def get_actuator_by_name(client_id, name):
-    conn = await get_db_connection()
-    async with conn.execute('SELECT * FROM actuators WHERE client_id = ? AND name = ?', (client_id, name)) as cursor:
-        actuator = await cursor.fetchone()
-    await conn.close()
+    async with pool.reader() as conn:
+        async with conn.execute('SELECT * FROM actuators WHERE client_id = ? AND name = ?', (client_id, name)) as cursor:
+            actuator = await cursor.fetchone()
     return actuator
@@ -1,17 +1,20 @@
 import aiosqlite
 from datetime import datetime
-from .sensor_data import get_db_connection
+from .db_pool import pool
+from .db_writer import writer
+from .client_latest import set_latest_mode
+from .change_bus import MODE_CHANGED, publish
 
 async def get_app_state(client_id):
-    conn = await get_db_connection()
-    async with conn.execute('SELECT mode FROM app_state WHERE client_id = ? ORDER BY timestamp DESC LIMIT 1', (client_id,)) as cursor:
-        state = await cursor.fetchone()
-    await conn.close()
+    async with pool.reader() as conn:
+        async with conn.execute('SELECT mode FROM app_state WHERE client_id = ? ORDER BY timestamp DESC LIMIT 1', (client_id,)) as cursor:
+            state = await cursor.fetchone()
     return state['mode'] if state else None
 
 async def update_app_state(client_id, mode):
-    conn = await get_db_connection()
-    await conn.execute('INSERT INTO app_state (client_id, mode, timestamp) VALUES (?, ?, ?)', 
-                       (client_id, mode, datetime.now().isoformat()))
-    await conn.commit()
-    await conn.close()
+    async def operation(conn):
+        await conn.execute('INSERT INTO app_state (client_id, mode, timestamp) VALUES (?, ?, ?)', 
+                           (client_id, mode, datetime.now().isoformat()))
+        await set_latest_mode(conn, client_id, mode)
+    await writer.run(operation)
+    publish(MODE_CHANGED, client_id, mode=mode)
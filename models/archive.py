@@ -0,0 +1,440 @@
+import asyncio
+import heapq
+import json
+import os
+import shutil
+import struct
+import sys
+import tarfile
+import threading
+import time
+import zlib
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from urllib.parse import quote, unquote
+from .db_pool import pool
+from .db_writer import writer
+from .compact_storage import (
+    LAYOUT_COMPACT, LAYOUT_MIGRATING, get_layout, reading_client_ids, to_epoch_ms, from_epoch_ms, to_centi
+)
+from .hot_window import trim_before
+
+# Carpeta del archivo frio (dentro de 'storage', junto a backups y reportes de MSAD)
+ARCHIVE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'storage', 'archive', 'sht3x')
+
+# Configuracion del archivo
+ARCHIVE_AFTER_DAYS = 7  # Antiguedad a partir de la cual las lecturas salen de SQLite (None = desactivado)
+ARCHIVE_BATCH_SIZE = 5000  # Lecturas leidas por consulta y borradas por transaccion
+ARCHIVE_FLUSH_ROWS = 100000  # Lecturas de un mes reunidas en memoria como maximo antes de escribirlas
+
+# Formato columnar: cabecera JSON y una columna comprimida por campo (epoch ms en deltas, centesimas)
+ARCHIVE_MAGIC = b'SHT3XCOL'
+ARCHIVE_VERSION = 1
+ARCHIVE_COLUMNS = (('ts', 'q'), ('temperature_cc', 'i'), ('humidity_cp', 'i'))
+
+_archive_lock = threading.Lock()  # Serializa la reescritura de ficheros entre pasadas concurrentes
+_last_report = None
+_archive_totals = {
+    'runs': 0,
+    'rows_archived': 0,
+}
+
+# --- Ficheros columnares (sincronos, se llaman desde hilos de trabajo) ---
+
+def _client_dir(client_id):
+    return os.path.join(ARCHIVE_PATH, quote(client_id, safe=''))
+
+def _month_path(client_id, month):
+    return os.path.join(_client_dir(client_id), f'{month}.col')
+
+def _month_of(ts):
+    return datetime.fromtimestamp(ts // 1000, timezone.utc).strftime('%Y-%m')
+
+# Listar los clientes con lecturas archivadas
+def list_archived_clients():
+    try:
+        names = os.listdir(ARCHIVE_PATH)
+    except FileNotFoundError:
+        return []
+    return sorted(unquote(name) for name in names if os.path.isdir(os.path.join(ARCHIVE_PATH, name)))
+
+# Listar los meses archivados de un cliente ('YYYY-MM', en orden ascendente)
+def list_months(client_id):
+    try:
+        names = os.listdir(_client_dir(client_id))
+    except FileNotFoundError:
+        return []
+    return sorted(name[:-4] for name in names if name.endswith('.col'))
+
+def _read_header(f):
+    if f.read(len(ARCHIVE_MAGIC)) != ARCHIVE_MAGIC:
+        raise ValueError("Fichero de archivo no valido")
+    (length,) = struct.unpack('<I', f.read(4))
+    return json.loads(f.read(length))
+
+# Leer solo la cabecera de un mes (filas, rango de epoch y tamano de cada columna)
+def read_month_header(client_id, month):
+    with open(_month_path(client_id, month), 'rb') as f:
+        return _read_header(f)
+
+# Leer las columnas de un mes: (ts, temperature_cc, humidity_cp) ordenadas por ts
+def read_month(client_id, month):
+    with open(_month_path(client_id, month), 'rb') as f:
+        header = _read_header(f)
+        columns = []
+        for column in header['columns']:
+            values = array(column['type'])
+            values.frombytes(zlib.decompress(f.read(column['size'])))
+            if sys.byteorder != 'little':
+                values.byteswap()
+            columns.append(values)
+    ts, temperature, humidity = columns
+    # Deshacer la codificacion en deltas del epoch
+    total = 0
+    for i, delta in enumerate(ts):
+        total += delta
+        ts[i] = total
+    return ts, temperature, humidity
+
+def _write_month(client_id, month, ts, temperature, humidity):
+    deltas = array('q', ts)
+    for i in range(len(deltas) - 1, 0, -1):
+        deltas[i] -= deltas[i - 1]
+    blocks = []
+    for values in (deltas, temperature, humidity):
+        if sys.byteorder != 'little':
+            values = array(values.typecode, values)
+            values.byteswap()
+        blocks.append(zlib.compress(values.tobytes(), 6))
+    header = json.dumps({
+        'version': ARCHIVE_VERSION,
+        'rows': len(ts),
+        'ts_min': ts[0],
+        'ts_max': ts[-1],
+        'columns': [{'name': name, 'type': typecode, 'size': len(block)}
+                    for (name, typecode), block in zip(ARCHIVE_COLUMNS, blocks)],
+    }).encode('utf-8')
+
+    # Escribir en un temporal y sustituir de forma atomica para que los lectores nunca vean un fichero a medias
+    path = _month_path(client_id, month)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(ARCHIVE_MAGIC)
+        f.write(struct.pack('<I', len(header)))
+        f.write(header)
+        for block in blocks:
+            f.write(block)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+# Anadir de una vez las lecturas (ts, temperature_cc, humidity_cp) de un mes a su fichero. Una fila
+# identica a otra ya archivada es un reintento tras un fallo (se escribio el fichero pero no se borro
+# de SQLite) y no se repite; las lecturas distintas con el mismo epoch se conservan todas
+def write_month_rows(client_id, month, rows):
+    rows.sort(key=lambda row: row[0])  # Ya llegan ordenadas: la ordenacion es lineal y sin copia
+    with _archive_lock:
+        if os.path.exists(_month_path(client_id, month)):
+            ts, temperature, humidity = read_month(client_id, month)
+        else:
+            ts, temperature, humidity = array('q'), array('i'), array('i')
+
+        # Las lecturas posteriores a todo lo archivado (el caso habitual) se anaden al final
+        split = bisect_right(rows, ts[-1], key=lambda row: row[0]) if ts else 0
+        overlap, tail = rows[:split], rows[split:]
+        if overlap:
+            # Comparar solo con la parte del mes que solapa con las lecturas nuevas
+            start = bisect_left(ts, overlap[0][0])
+            archived = Counter(zip(ts[start:], temperature[start:], humidity[start:]))
+            fresh = []
+            for row in overlap:
+                if archived[row]:
+                    archived[row] -= 1
+                else:
+                    fresh.append(row)
+            if fresh:
+                merged = heapq.merge(zip(ts, temperature, humidity), fresh, key=lambda row: row[0])
+                ts, temperature, humidity = array('q'), array('i'), array('i')
+                for row_ts, row_temperature, row_humidity in merged:
+                    ts.append(row_ts)
+                    temperature.append(row_temperature)
+                    humidity.append(row_humidity)
+        else:
+            fresh = []
+
+        if not fresh and not tail:
+            return 0
+        for row_ts, row_temperature, row_humidity in tail:
+            ts.append(row_ts)
+            temperature.append(row_temperature)
+            humidity.append(row_humidity)
+        _write_month(client_id, month, ts, temperature, humidity)
+        return len(fresh) + len(tail)
+
+# Eliminar las lecturas archivadas con epoch anterior a `cutoff_ms` (retencion de sht3x_data): los meses
+# que quedan enteros antes del corte se borran y el que queda a caballo se reescribe sin esas lecturas.
+# Devuelve (meses eliminados, lecturas eliminadas)
+def prune_archive(client_id, cutoff_ms):
+    months_deleted = rows_deleted = 0
+    with _archive_lock:
+        for month in list_months(client_id):
+            header = read_month_header(client_id, month)
+            if header['ts_min'] >= cutoff_ms:
+                break
+            if header['ts_max'] < cutoff_ms:
+                os.remove(_month_path(client_id, month))
+                months_deleted += 1
+                rows_deleted += header['rows']
+                continue
+            ts, temperature, humidity = read_month(client_id, month)
+            keep = bisect_left(ts, cutoff_ms)
+            _write_month(client_id, month, ts[keep:], temperature[keep:], humidity[keep:])
+            rows_deleted += keep
+        if months_deleted and not list_months(client_id):
+            shutil.rmtree(_client_dir(client_id), ignore_errors=True)
+    return months_deleted, rows_deleted
+
+# Eliminar todos los ficheros archivados de un cliente
+def delete_client_archive(client_id):
+    with _archive_lock:
+        shutil.rmtree(_client_dir(client_id), ignore_errors=True)
+
+# Copiar el archivo frio a un fichero tar (backups de MSAD) sin que ninguna pasada lo modifique a la vez
+def export_archive(path):
+    with _archive_lock:
+        with tarfile.open(path, 'w') as tar:
+            if os.path.isdir(ARCHIVE_PATH):
+                tar.add(ARCHIVE_PATH, arcname='sht3x',
+                        filter=lambda info: None if info.name.endswith('.tmp') else info)
+
+# Sustituir el archivo frio por el contenido de un tar creado con export_archive
+def import_archive(path):
+    restore_path = ARCHIVE_PATH + '.restore'
+    old_path = ARCHIVE_PATH + '.old'
+    with _archive_lock:
+        shutil.rmtree(restore_path, ignore_errors=True)
+        shutil.rmtree(old_path, ignore_errors=True)
+        with tarfile.open(path) as tar:
+            tar.extractall(restore_path, filter='data')
+        if os.path.isdir(ARCHIVE_PATH):
+            os.replace(ARCHIVE_PATH, old_path)
+        restored = os.path.join(restore_path, 'sht3x')
+        if os.path.isdir(restored):
+            os.replace(restored, ARCHIVE_PATH)
+        else:
+            os.makedirs(ARCHIVE_PATH)
+        shutil.rmtree(restore_path, ignore_errors=True)
+        shutil.rmtree(old_path, ignore_errors=True)
+
+def _as_row(client_id, ts, temperature, humidity):
+    # Mismas columnas que sht3x_data; el id es el epoch en ms, como en la distribucion compacta
+    return {
+        'id': ts,
+        'client_id': client_id,
+        'timestamp': from_epoch_ms(ts),
+        'temperature': temperature / 100.0,
+        'humidity': humidity / 100.0,
+    }
+
+# Numero de lecturas archivadas de un cliente (solo lee cabeceras)
+def count_archived_rows(client_id):
+    return sum(read_month_header(client_id, month)['rows'] for month in list_months(client_id))
+
+# Lecturas archivadas de la mas reciente a la mas antigua, saltando `skip` y con epoch < `before`
+def read_archived_page(client_id, skip, limit, before=None):
+    rows = []
+    for month in reversed(list_months(client_id)):
+        header = read_month_header(client_id, month)
+        if before is not None and header['ts_min'] >= before:
+            continue
+        if before is None and skip >= header['rows']:
+            # Saltar el mes completo sin descomprimirlo
+            skip -= header['rows']
+            continue
+        ts, temperature, humidity = read_month(client_id, month)
+        for i in range(len(ts) - 1, -1, -1):
+            if before is not None and ts[i] >= before:
+                continue
+            if skip:
+                skip -= 1
+                continue
+            rows.append(_as_row(client_id, ts[i], temperature[i], humidity[i]))
+            if len(rows) >= limit:
+                return rows
+    return rows
+
+# Recorrer las lecturas archivadas con timestamp ISO en [start, end] (comparacion de texto, como en SQLite)
+# de la mas antigua a la mas reciente, descomprimiendo un mes cada vez
+def iter_archived_rows(client_id, start=None, end=None):
+    for month in list_months(client_id):
+        if (start and month < start[:7]) or (end and month > end[:7]):
+            continue
+        # Descartar por la cabecera los meses que quedan fuera del rango sin descomprimirlos
+        header = read_month_header(client_id, month)
+        if (start and from_epoch_ms(header['ts_max']) < start) or (end and from_epoch_ms(header['ts_min']) > end):
+            continue
+        ts, temperature, humidity = read_month(client_id, month)
+        for i in range(len(ts)):
+            row = _as_row(client_id, ts[i], temperature[i], humidity[i])
+            if (start and row['timestamp'] < start) or (end and row['timestamp'] > end):
+                continue
+            yield row
+
+# Lecturas archivadas con timestamp ISO en [start, end]
+def read_archived_rows(client_id, start=None, end=None, newest_first=True):
+    rows = list(iter_archived_rows(client_id, start, end))
+    if newest_first:
+        rows.reverse()
+    return rows
+
+# --- Consultas asincronas (lectura de ficheros fuera del bucle de eventos) ---
+
+async def get_archived_page(client_id, skip, limit, before=None):
+    return await asyncio.to_thread(read_archived_page, client_id, skip, limit, before)
+
+async def get_archived_rows(client_id, start=None, end=None, newest_first=True):
+    return await asyncio.to_thread(read_archived_rows, client_id, start, end, newest_first)
+
+async def get_archived_count(client_id):
+    return await asyncio.to_thread(count_archived_rows, client_id)
+
+async def get_archived_clients():
+    return await asyncio.to_thread(list_archived_clients)
+
+async def prune_archived_before(client_id, cutoff):
+    return await asyncio.to_thread(prune_archive, client_id, to_epoch_ms(cutoff))
+
+# --- Pasada de archivado ---
+
+# Obtener la antiguedad de archivado configurada (storage_meta) o la predeterminada
+async def get_archive_after_days():
+    async with pool.reader() as conn:
+        async with conn.execute("SELECT value FROM storage_meta WHERE key = 'archive_after_days'") as cursor:
+            row = await cursor.fetchone()
+    if row is None:
+        return ARCHIVE_AFTER_DAYS
+    return int(row[0]) if row[0] else None
+
+# Fijar la antiguedad de archivado (None desactiva el archivo)
+async def set_archive_after_days(days):
+    if days is not None and (not isinstance(days, int) or days < 1):
+        raise ValueError("archive_after_days debe ser un entero positivo o null")
+    await writer.execute("INSERT OR REPLACE INTO storage_meta (key, value) VALUES ('archive_after_days', ?)",
+                         ('' if days is None else str(days),))
+
+async def _fetch_batch(client_id, cutoff, layout, after=None):
+    # Leer el lote de lecturas anteriores al corte que sigue a la posicion `after` (recorrido por clave,
+    # sin depender de que se hayan borrado las anteriores). Devuelve las filas como (clave de borrado,
+    # ts, centesimas) y la posicion de la ultima
+    async with pool.reader() as conn:
+        if layout == LAYOUT_COMPACT:
+            async with conn.execute('''
+                SELECT c.ts, c.temperature_cc, c.humidity_cp FROM sht3x_compact c
+                JOIN telemetry_clients k ON k.client_key = c.client_key
+                WHERE k.client_id = ? AND c.ts < ? AND c.ts > ? ORDER BY c.ts LIMIT ?
+            ''', (client_id, to_epoch_ms(cutoff), -1 if after is None else after, ARCHIVE_BATCH_SIZE)) as cursor:
+                rows = await cursor.fetchall()
+            return [(row[0], row[0], row[1], row[2]) for row in rows], rows[-1][0] if rows else after
+        async with conn.execute('''
+            SELECT id, timestamp, temperature, humidity FROM sht3x_data
+            WHERE client_id = ? AND timestamp < ? AND (timestamp, id) > (?, ?) ORDER BY timestamp, id LIMIT ?
+        ''', (client_id, cutoff, *(after or ('', 0)), ARCHIVE_BATCH_SIZE)) as cursor:
+            rows = await cursor.fetchall()
+        return ([(row[0], to_epoch_ms(row[1]), to_centi(row[2]), to_centi(row[3])) for row in rows],
+                (rows[-1][1], rows[-1][0]) if rows else after)
+
+def _delete_archived(client_id, keys, layout):
+    # Borrar exactamente las filas ya escritas en el archivo
+    async def operation(conn):
+        if layout == LAYOUT_COMPACT:
+            await conn.executemany('''
+                DELETE FROM sht3x_compact
+                WHERE client_key = (SELECT client_key FROM telemetry_clients WHERE client_id = ?) AND ts = ?
+            ''', [(client_id, key) for key in keys])
+        else:
+            await conn.executemany('DELETE FROM sht3x_data WHERE id = ?', [(key,) for key in keys])
+    return operation
+
+async def _archive_month(client_id, month, rows, keys, layout, report):
+    # Escribir el archivo antes de borrar; si algo falla, un reintento no duplica las filas ya escritas
+    await asyncio.to_thread(write_month_rows, client_id, month, rows)
+    for i in range(0, len(keys), ARCHIVE_BATCH_SIZE):
+        await writer.run(_delete_archived(client_id, keys[i:i + ARCHIVE_BATCH_SIZE], layout))
+    report['rows_archived'] += len(rows)
+    report['months_written'] += 1
+
+# Mover a ficheros columnares las lecturas mas antiguas que la antiguedad configurada
+async def run_archive():
+    global _last_report
+    start = time.monotonic()
+    report = {
+        'started_at': datetime.now().isoformat(),
+        'archive_after_days': await get_archive_after_days(),
+        'rows_archived': 0,
+        'months_written': 0,
+    }
+    layout = await get_layout()
+    if report['archive_after_days'] is None or layout == LAYOUT_MIGRATING:
+        # Desactivado, o se espera a que termine la migracion a la distribucion compacta
+        report['skipped'] = True
+        return report
+
+    cutoff = (datetime.now() - timedelta(days=report['archive_after_days'])).date().isoformat()
+    async with pool.reader() as conn:
+        # Tambien las lecturas de clientes que nunca se registraron
+        clients = await reading_client_ids(conn)
+
+    for client_id in clients:
+        # Las lecturas llegan ordenadas: se reunen las de cada mes y su fichero se escribe una sola vez,
+        # o cada ARCHIVE_FLUSH_ROWS lecturas para acotar la memoria (las siguientes se anaden al final)
+        month, rows, keys = None, [], []
+        after = None
+        while True:
+            batch, after = await _fetch_batch(client_id, cutoff, layout, after)
+            for key, ts, temperature, humidity in batch:
+                row_month = _month_of(ts)
+                if row_month != month and rows:
+                    await _archive_month(client_id, month, rows, keys, layout, report)
+                    rows, keys = [], []
+                month = row_month
+                rows.append((ts, temperature, humidity))
+                keys.append(key)
+                if len(rows) >= ARCHIVE_FLUSH_ROWS:
+                    await _archive_month(client_id, month, rows, keys, layout, report)
+                    rows, keys = [], []
+            if len(batch) < ARCHIVE_BATCH_SIZE:
+                break
+        if rows:
+            await _archive_month(client_id, month, rows, keys, layout, report)
+        trim_before(client_id, cutoff)
+
+    report['finished_at'] = datetime.now().isoformat()
+    report['duration_ms'] = round((time.monotonic() - start) * 1000, 3)
+    _archive_totals['runs'] += 1
+    _archive_totals['rows_archived'] += report['rows_archived']
+    _last_report = report
+    return report
+
+# Obtener el estado del archivo: configuracion, totales, ultima pasada y tamano por cliente
+async def get_archive_status():
+    def disk_usage():
+        usage = {}
+        if os.path.isdir(ARCHIVE_PATH):
+            for name in os.listdir(ARCHIVE_PATH):
+                directory = os.path.join(ARCHIVE_PATH, name)
+                files = [f for f in os.listdir(directory) if f.endswith('.col')]
+                usage[name] = {
+                    'months': len(files),
+                    'bytes': sum(os.path.getsize(os.path.join(directory, f)) for f in files),
+                }
+        return usage
+    return {
+        'archive_after_days': await get_archive_after_days(),
+        'path': ARCHIVE_PATH,
+        'totals': dict(_archive_totals),
+        'last_run': _last_report,
+        'clients': await asyncio.to_thread(disk_usage),
+    }
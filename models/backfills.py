@@ -0,0 +1,107 @@
+import asyncio
+from datetime import datetime
+from .db_pool import pool
+from .db_writer import writer
+
+# Configuracion de los backfills
+BACKFILL_CHUNK_SIZE = 2000  # Filas procesadas por transaccion
+BACKFILL_PAUSE = 0.05  # Segundos entre lotes para dejar paso a la ingesta
+
+# Backfills registrados: nombre -> (chunk, finish)
+_backfills = {}
+_runner_task = None
+_rerun = False  # Se encolo un backfill mientras el ejecutor estaba activo
+
+def register_backfill(name, chunk, finish=None):
+    """
+    Registrar un backfill por lotes reanudable.
+
+    `chunk(conn, last_key, limit)` procesa el siguiente lote y devuelve
+    (filas_procesadas, nueva_clave); el backfill termina con el primer lote
+    incompleto. `finish(conn, last_key)` se ejecuta en esa misma transaccion.
+    El progreso se guarda en la tabla backfills junto con cada lote, por lo que
+    un reinicio continua exactamente donde se quedo.
+    """
+    _backfills[name] = (chunk, finish)
+
+# Encolar un backfill dentro de una transaccion en curso (migracion u operacion del escritor)
+async def enqueue_backfill(conn, name):
+    await conn.execute('''
+        INSERT OR REPLACE INTO backfills (name, state, last_key, rows, started_at, finished_at, error)
+        VALUES (?, 'pending', 0, 0, NULL, NULL, NULL)
+    ''', (name,))
+
+async def _run_one(name):
+    chunk, finish = _backfills[name]
+    await writer.execute('UPDATE backfills SET started_at = COALESCE(started_at, ?), error = NULL WHERE name = ?',
+                         (datetime.now().isoformat(), name))
+
+    async def operation(conn):
+        async with conn.execute('SELECT last_key FROM backfills WHERE name = ?', (name,)) as cursor:
+            last_key = (await cursor.fetchone())[0]
+        processed, last_key = await chunk(conn, last_key, BACKFILL_CHUNK_SIZE)
+        done = processed < BACKFILL_CHUNK_SIZE
+        if done and finish is not None:
+            await finish(conn, last_key)
+        await conn.execute('''
+            UPDATE backfills SET last_key = ?, rows = rows + ?, state = ?, finished_at = ?
+            WHERE name = ?
+        ''', (last_key, processed, 'done' if done else 'pending',
+              datetime.now().isoformat() if done else None, name))
+        return done
+
+    while not await writer.run(operation):
+        await asyncio.sleep(BACKFILL_PAUSE)
+
+async def _run_pending():
+    global _rerun
+    failed = set()
+    while True:
+        _rerun = False
+        async with pool.reader() as conn:
+            async with conn.execute("SELECT name FROM backfills WHERE state = 'pending' ORDER BY rowid") as cursor:
+                names = [row['name'] for row in await cursor.fetchall()]
+        names = [name for name in names if name not in failed]
+        if not names:
+            if _rerun:
+                continue
+            return
+        for name in names:
+            if name not in _backfills:
+                print(f"Backfill sin registrar, se omite: {name}")
+                failed.add(name)
+                continue
+            try:
+                await _run_one(name)
+            except Exception as e:
+                # Queda pendiente y se reanuda en el siguiente arranque
+                print(f"Error en el backfill {name}: {e}")
+                failed.add(name)
+                await writer.execute('UPDATE backfills SET error = ? WHERE name = ?', (str(e), name))
+
+def _ensure_runner():
+    # Se ejecuta siempre dentro del bucle del pool
+    global _runner_task, _rerun
+    if _runner_task is None or _runner_task.done():
+        _runner_task = asyncio.get_running_loop().create_task(_run_pending())
+    else:
+        _rerun = True
+
+# Ejecutar en segundo plano los backfills pendientes (al arrancar o tras encolar uno nuevo)
+def resume_backfills():
+    pool.loop.call_soon_threadsafe(_ensure_runner)
+
+# Obtener el estado de los backfills
+async def get_backfills(name=None):
+    query = 'SELECT name, state, last_key, rows, started_at, finished_at, error FROM backfills'
+    params = ()
+    if name:
+        query += ' WHERE name = ?'
+        params = (name,)
+    async with pool.reader() as conn:
+        async with conn.execute(query + ' ORDER BY rowid', params) as cursor:
+            rows = await cursor.fetchall()
+    return [dict(row) for row in rows]
+
+def is_running():
+    return _runner_task is not None and not _runner_task.done()
@@ -0,0 +1,163 @@
+import asyncio
+import csv
+import json
+import math
+import time
+from datetime import datetime
+from .db_pool import pool
+from .sensor_data import batch_insert_sht3x_data
+
+# Configuracion de la importacion masiva de lecturas
+IMPORT_BATCH_SIZE = 5000  # Lecturas por transaccion del escritor
+IMPORT_MAX_ERRORS = 20  # Errores de ejemplo incluidos en el informe
+IMPORT_FORMATS = ('csv', 'ndjson')
+
+
+class ImportRowError(ValueError):
+    """Lectura con formato no valido (se descarta y la importacion continua)"""
+
+
+def _from_epoch(value):
+    # Un epoch fuera del rango de fechas representable es una lectura no valida, no un error de la importacion
+    try:
+        return datetime.fromtimestamp(value).isoformat()
+    except (ValueError, OverflowError, OSError):
+        raise ImportRowError(f'timestamp fuera de rango: {value!r}')
+
+# Normalizar el timestamp al formato de la ingesta (ISO local sin zona); acepta ISO 8601 o epoch en segundos
+def _parse_timestamp(value):
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return _from_epoch(value)
+    if not isinstance(value, str) or not value.strip():
+        raise ImportRowError('timestamp vacio o no valido')
+    value = value.strip()
+    try:
+        epoch = float(value)
+    except ValueError:
+        epoch = None
+    if epoch is not None:
+        return _from_epoch(epoch)
+    try:
+        parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        raise ImportRowError(f'timestamp no valido: {value}')
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone().replace(tzinfo=None)
+    return parsed.isoformat()
+
+def _parse_value(record, name):
+    value = record.get(name)
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        raise ImportRowError(f'{name} no valido: {value!r}')
+    if not math.isfinite(number):
+        raise ImportRowError(f'{name} no valido: {value!r}')
+    return number
+
+# Convertir un registro (dict) en la tupla (client_id, timestamp, temperatura, humedad) de la ingesta
+def parse_record(record, default_client_id=None):
+    if not isinstance(record, dict):
+        raise ImportRowError('se esperaba un objeto')
+    client_id = record.get('client_id') or default_client_id
+    if not isinstance(client_id, str) or not client_id.strip():
+        raise ImportRowError('client_id vacio')
+    return (
+        client_id.strip(),
+        _parse_timestamp(record.get('timestamp')),
+        _parse_value(record, 'temperature'),
+        _parse_value(record, 'humidity'),
+    )
+
+# Leer registros de un iterable de lineas de texto, una a una: (numero de linea, registro o error)
+def iter_records(lines, fmt):
+    if fmt == 'csv':
+        reader = csv.DictReader(lines)
+        missing = {'timestamp', 'temperature', 'humidity'} - set(reader.fieldnames or ())
+        if missing:
+            raise ValueError(f"Faltan columnas en el CSV: {', '.join(sorted(missing))}")
+        for record in reader:
+            yield reader.line_num, record
+        return
+    for line_num, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            yield line_num, json.loads(line)
+        except ValueError:
+            yield line_num, ImportRowError('JSON no valido')
+
+async def _known_clients():
+    async with pool.reader() as conn:
+        async with conn.execute('SELECT client_id FROM clients') as cursor:
+            return {row[0] for row in await cursor.fetchall()}
+
+# Importar lecturas desde un iterable de lineas (CSV con cabecera o NDJSON) sin cargarlo entero en memoria.
+# Cada lote se inserta con las lecturas, los agregados y el estado actual en la misma transaccion,
+# y se lee el siguiente lote mientras el escritor confirma el anterior
+async def import_readings(lines, fmt, client_id=None, batch_size=IMPORT_BATCH_SIZE):
+    if fmt not in IMPORT_FORMATS:
+        raise ValueError(f"Formato no valido. Opciones: {', '.join(IMPORT_FORMATS)}")
+    start = time.monotonic()
+    clients = await _known_clients()
+    report = {
+        'rows': 0,
+        'imported': 0,
+        'rejected': 0,
+        'batches': 0,
+        'errors': [],
+    }
+
+    def reject(line_num, error):
+        report['rejected'] += 1
+        if len(report['errors']) < IMPORT_MAX_ERRORS:
+            report['errors'].append({'line': line_num, 'error': str(error)})
+
+    in_flight = None
+    batch = []
+
+    async def flush():
+        nonlocal in_flight, batch
+        if in_flight is not None:
+            report['imported'] += await in_flight
+            report['batches'] += 1
+        if batch:
+            pending = batch
+            in_flight = asyncio.ensure_future(_insert(pending))
+            await asyncio.sleep(0)  # Dejar que el lote llegue al escritor antes de seguir leyendo
+        else:
+            in_flight = None
+        batch = []
+
+    try:
+        for line_num, record in iter_records(lines, fmt):
+            report['rows'] += 1
+            try:
+                if isinstance(record, Exception):
+                    raise record
+                reading = parse_record(record, client_id)
+            except ImportRowError as e:
+                reject(line_num, e)
+                continue
+            if reading[0] not in clients:
+                reject(line_num, f'cliente no registrado: {reading[0]}')
+                continue
+            batch.append(reading)
+            if len(batch) >= batch_size:
+                await flush()
+        await flush()  # Enviar el ultimo lote
+        await flush()  # Y esperar a que se confirme
+    except BaseException:
+        if in_flight is not None:
+            # No dejar un lote a medias sin esperar
+            await asyncio.gather(in_flight, return_exceptions=True)
+        raise
+
+    elapsed = time.monotonic() - start
+    report['duration_ms'] = round(elapsed * 1000, 3)
+    report['rows_per_second'] = round(report['imported'] / elapsed, 1) if elapsed > 0 else 0.0
+    return report
+
+async def _insert(batch):
+    await batch_insert_sht3x_data(batch)
+    return len(batch)
@@ -0,0 +1,113 @@
+import threading
+import time
+from collections import OrderedDict
+
+MISSING = object()  # Resultado de get() cuando la clave no esta en cache (None puede ser un valor cacheado)
+
+_lock = threading.Lock()
+_caches = {}  # nombre -> BoundedCache, para las metricas
+
+
+class BoundedCache:
+    """
+    Cache en memoria con tamano maximo (expulsa la entrada usada hace mas
+    tiempo) y caducidad opcional por entrada. Los valores None se guardan como
+    resultados negativos ("no existe") con su propia caducidad `negative_ttl`,
+    para no repetir la consulta de algo que no esta en la base de datos. Es
+    segura entre hilos y cuenta aciertos, fallos, expulsiones y caducadas.
+    """
+
+    def __init__(self, name, max_size, ttl=None, negative_ttl=None):
+        self.name = name
+        self.max_size = max_size
+        self.ttl = ttl  # Segundos de vida de una entrada (None = sin caducidad)
+        self.negative_ttl = ttl if negative_ttl is None else negative_ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # clave -> (valor, instante de caducidad o None)
+        self._stats = {
+            'hits': 0,
+            'negative_hits': 0,  # Aciertos de un resultado negativo (valor None)
+            'misses': 0,
+            'evictions': 0,  # Entradas expulsadas por tamano
+            'expirations': 0,  # Entradas caducadas al leerlas
+            'invalidations': 0,  # Entradas descartadas con pop() o discard_where()
+        }
+        with _lock:
+            _caches[name] = self
+
+    # Valor de la clave, o MISSING si no esta o ha caducado
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] is not None and time.monotonic() >= entry[1]:
+                del self._entries[key]
+                self._stats['expirations'] += 1
+                entry = None
+            if entry is None:
+                self._stats['misses'] += 1
+                return MISSING
+            self._entries.move_to_end(key)
+            self._stats['negative_hits' if entry[0] is None else 'hits'] += 1
+            return entry[0]
+
+    # Valor de la clave sin contarlo como lectura ni moverlo en el orden LRU (para aplicar cambios)
+    def peek(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or (entry[1] is not None and time.monotonic() >= entry[1]):
+                return MISSING
+            return entry[0]
+
+    def set(self, key, value):
+        ttl = self.negative_ttl if value is None else self.ttl
+        expires = time.monotonic() + ttl if ttl is not None else None
+        with self._lock:
+            self._entries[key] = (value, expires)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self._stats['evictions'] += 1
+        return value
+
+    def pop(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._stats['invalidations'] += 1
+        return MISSING if entry is None else entry[0]
+
+    # Descartar las entradas cuya clave cumple `predicate` (p. ej. todas las de un cliente)
+    def discard_where(self, predicate):
+        with self._lock:
+            keys = [key for key in self._entries if predicate(key)]
+            for key in keys:
+                del self._entries[key]
+            self._stats['invalidations'] += len(keys)
+        return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._stats['invalidations'] += len(self._entries)
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get_metrics(self):
+        with self._lock:
+            lookups = self._stats['hits'] + self._stats['negative_hits'] + self._stats['misses']
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'ttl': self.ttl,
+                'negative_ttl': self.negative_ttl,
+                **self._stats,
+                'hit_rate': round((lookups - self._stats['misses']) / lookups, 4) if lookups else None,
+            }
+
+
+# Obtener los contadores de todas las caches de este proceso
+def get_cache_metrics():
+    with _lock:
+        caches = dict(_caches)
+    return {name: cache.get_metrics() for name, cache in sorted(caches.items())}
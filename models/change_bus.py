@@ -0,0 +1,68 @@
+import threading
+
+# Tipos de cambio que publican los modelos al confirmar una escritura (datos de cada uno)
+CLIENT_REGISTERED = 'client_registered'  # created
+CLIENT_DELETED = 'client_deleted'
+CLIENT_DISABLED = 'client_disabled'  # disabled
+THRESHOLDS_CHANGED = 'thresholds_changed'  # param_type, min_value, max_value
+MODE_CHANGED = 'mode_changed'  # mode
+ACTUATOR_ADDED = 'actuator_added'  # name, state
+ACTUATOR_STATE_CHANGED = 'actuator_state_changed'  # actuator_id, state
+CHANGE_KINDS = (
+    CLIENT_REGISTERED, CLIENT_DELETED, CLIENT_DISABLED, THRESHOLDS_CHANGED,
+    MODE_CHANGED, ACTUATOR_ADDED, ACTUATOR_STATE_CHANGED,
+)
+
+_lock = threading.Lock()
+_subscribers = {}  # tipo -> [callback]; None = todos los tipos
+_stats = {kind: {'published': 0, 'delivered': 0, 'errors': 0} for kind in CHANGE_KINDS}
+
+
+class Change:
+    """Cambio confirmado en la base de datos sobre un cliente"""
+
+    __slots__ = ('kind', 'client_id', 'data')
+
+    def __init__(self, kind, client_id, **data):
+        if kind not in CHANGE_KINDS:
+            raise ValueError(f"Tipo de cambio no valido: {kind}")
+        self.kind = kind
+        self.client_id = client_id
+        self.data = data
+
+    def __repr__(self):
+        return f"Change({self.kind}, {self.client_id}, {self.data})"
+
+
+# Suscribir `callback(change)` a unos tipos de cambio (o a todos con None).
+# Se llama en el hilo de quien publica, justo despues de confirmar: debe ser rapido y seguro entre hilos
+def subscribe(kinds, callback):
+    with _lock:
+        for kind in (kinds if kinds is not None else (None,)):
+            _subscribers.setdefault(kind, []).append(callback)
+
+# Publicar un cambio a sus suscriptores; un suscriptor con error no impide avisar a los demas
+def publish(kind, client_id, **data):
+    change = Change(kind, client_id, **data)
+    with _lock:
+        callbacks = _subscribers.get(kind, []) + _subscribers.get(None, [])
+        _stats[kind]['published'] += 1
+    for callback in callbacks:
+        try:
+            callback(change)
+            delivered, errors = 1, 0
+        except Exception as e:
+            print(f"Error en suscriptor de cambios ({kind}): {e}")
+            delivered, errors = 0, 1
+        with _lock:
+            _stats[kind]['delivered'] += delivered
+            _stats[kind]['errors'] += errors
+    return change
+
+# Obtener los contadores del bus de cambios
+def get_change_bus_metrics():
+    with _lock:
+        return {
+            'subscribers': {kind or '*': len(callbacks) for kind, callbacks in _subscribers.items()},
+            'changes': {kind: dict(stats) for kind, stats in _stats.items()},
+        }
@@ -1,56 +1,62 @@
+import asyncio
+import time
 from datetime import datetime
-from .sensor_data import get_db_connection, execute_query_with_retry, execute_write_query_with_retry
-
-# Verificar si un cliente esta manualmente desactivado
-async def is_manually_disabled(client_id):
-    query = 'SELECT manually_disabled FROM clients WHERE client_id = ?'
-    params = (client_id,)
-    result = await execute_query_with_retry(query, params)
-    return result[0]['manually_disabled'] == 1 if result else False
+from .archive import delete_client_archive
+from .client_latest import refresh_latest_actuators, set_latest_mode, touch_last_seen
+from .compact_storage import delete_client_readings, get_layout
+from .change_bus import CLIENT_DELETED, CLIENT_DISABLED, CLIENT_REGISTERED, publish
+from .db_writer import writer
+from .event import flush_events
+from .last_seen import mark_clients_seen
+from .rollups import ROLLUP_RESOLUTIONS
+from .sensor_data import execute_query_with_retry, execute_write_query
 
 # Registrar un nuevo cliente
 async def register_client(client_id, name, description=""):
-    # Verificar si el cliente ya existe
-    conn = await get_db_connection()
-    async with conn.execute('SELECT * FROM clients WHERE client_id = ?', (client_id,)) as cursor:
-        existing = await cursor.fetchone()
-    
-    if existing:
-        # Verificar si el cliente esta marcado como desactivado manualmente
-        is_disabled = await is_manually_disabled(client_id)
+    async def operation(conn):
+        # Verificar si el cliente ya existe
+        async with conn.execute('SELECT * FROM clients WHERE client_id = ?', (client_id,)) as cursor:
+            existing = await cursor.fetchone()
         
-        if is_disabled:
-            # Solo actualizar last_seen y name/description, pero mantener status=offline
-            query = '''
-                UPDATE clients 
-                SET name = ?, description = ?, last_seen = ?
-                WHERE client_id = ?
-            '''
-            params = (name, description, datetime.now().isoformat(), client_id)
+        if existing:
+            # Verificar si el cliente esta marcado como desactivado manualmente
+            is_disabled = existing['manually_disabled'] == 1
+            
+            if is_disabled:
+                # Solo actualizar last_seen y name/description, pero mantener status=offline
+                query = '''
+                    UPDATE clients 
+                    SET name = ?, description = ?, last_seen = ?
+                    WHERE client_id = ?
+                '''
+                params = (name, description, datetime.now().isoformat(), client_id)
+            else:
+                # Actualizar todos los campos incluyendo estado=online
+                query = '''
+                    UPDATE clients 
+                    SET name = ?, description = ?, last_seen = ?, status = 'online'
+                    WHERE client_id = ?
+                '''
+                params = (name, description, datetime.now().isoformat(), client_id)
+                
+            await conn.execute(query, params)
         else:
-            # Actualizar todos los campos incluyendo estado=online
+            # Crear un nuevo cliente
             query = '''
-                UPDATE clients 
-                SET name = ?, description = ?, last_seen = ?, status = 'online'
-                WHERE client_id = ?
+                INSERT INTO clients (client_id, name, description, last_seen, status, created_at, manually_disabled)
+                VALUES (?, ?, ?, ?, 'online', ?, 0)
             '''
-            params = (name, description, datetime.now().isoformat(), client_id)
+            params = (client_id, name, description, datetime.now().isoformat(), datetime.now().isoformat())
+            await conn.execute(query, params)
             
-        await conn.execute(query, params)
-    else:
-        # Crear un nuevo cliente
-        query = '''
-            INSERT INTO clients (client_id, name, description, last_seen, status, created_at, manually_disabled)
-            VALUES (?, ?, ?, ?, 'online', ?, 0)
-        '''
-        params = (client_id, name, description, datetime.now().isoformat(), datetime.now().isoformat())
-        await conn.execute(query, params)
+            # Crear configuracion inicial para el nuevo cliente
+            await initialize_client_config(conn, client_id)
         
-        # Crear configuracion inicial para el nuevo cliente
-        await initialize_client_config(conn, client_id)
+        await touch_last_seen(conn, client_id, datetime.now().isoformat())
+        return existing is None
     
-    await conn.commit()
-    await conn.close()
+    created = await writer.run(operation)
+    publish(CLIENT_REGISTERED, client_id, created=created)
     return True
 
 # Inicializar configuracion para un nuevo cliente
@@ -85,41 +91,35 @@ async def initialize_client_config(conn, client_id):
         INSERT INTO app_state (client_id, mode, timestamp)
         VALUES (?, 'automatico', ?)
     ''', (client_id, datetime.now().isoformat()))
+    
+    # Estado actual del cliente para el panel de la flota
+    await refresh_latest_actuators(conn, client_id)
+    await set_latest_mode(conn, client_id, 'automatico')
 
 # Actualizar el estado de un cliente
 async def update_client_status(client_id, status='online'):
-    # Si se esta desactivando manualmente, marcar la bandera
-    if status == 'offline':
-        query = '''
-            UPDATE clients
-            SET status = ?, last_seen = ?, manually_disabled = 1
-            WHERE client_id = ?
-        '''
-    else:
-        # Verificar si el cliente esta manualmente desactivado
-        is_disabled = await is_manually_disabled(client_id)
-        if is_disabled:
-            # Si esta manualmente desactivado, solo actualizar last_seen pero mantener offline
-            query = '''
-                UPDATE clients
-                SET last_seen = ?
-                WHERE client_id = ?
-            '''
-            params = (datetime.now().isoformat(), client_id)
-        else:
-            # De lo contrario, actualizar a online normalmente
-            query = '''
-                UPDATE clients
-                SET status = ?, last_seen = ?, manually_disabled = 0
-                WHERE client_id = ?
-            '''
-            params = (status, datetime.now().isoformat(), client_id)
-        
-        await execute_write_query_with_retry(query, params)
+    if status != 'offline':
+        # Cliente visto: se guarda con los demas en la siguiente escritura de last_seen
+        # (un cliente desactivado manualmente sigue offline)
+        await mark_clients_seen({client_id: time.time()})
         return
     
+    # Si se esta desactivando manualmente, marcar la bandera
+    query = '''
+        UPDATE clients
+        SET status = ?, last_seen = ?, manually_disabled = 1
+        WHERE client_id = ?
+    '''
     params = (status, datetime.now().isoformat(), client_id)
-    await execute_write_query_with_retry(query, params)
+    await _update_client_seen(client_id, query, params)
+    publish(CLIENT_DISABLED, client_id, disabled=True)
+
+# Actualizar el cliente y su ultima conexion en client_latest en la misma transaccion
+async def _update_client_seen(client_id, query, params):
+    async def operation(conn):
+        await conn.execute(query, params)
+        await touch_last_seen(conn, client_id, datetime.now().isoformat())
+    await writer.run(operation)
 
 # Reactivar un cliente manualmente
 async def enable_client(client_id):
@@ -129,7 +129,8 @@ async def enable_client(client_id):
         WHERE client_id = ?
     '''
     params = (client_id,)
-    await execute_write_query_with_retry(query, params)
+    await execute_write_query(query, params)
+    publish(CLIENT_DISABLED, client_id, disabled=False)
 
 # Obtener todos los clientes registrados
 async def get_all_clients():
@@ -159,18 +160,22 @@ async def update_client_info(client_id, name, description=""):
         WHERE client_id = ?
     '''
     params = (name, description, client_id)
-    await execute_write_query_with_retry(query, params)
+    await execute_write_query(query, params)
     return True
 
 # Eliminar un cliente y todos sus datos relacionados
 async def delete_client(client_id):
-    conn = await get_db_connection()
-    try:
-        # Iniciar transaccion
-        await conn.execute('BEGIN TRANSACTION')
-        
+    # Guardar antes los eventos pendientes para que no queden huerfanos
+    await flush_events()
+    
+    async def operation(conn):
+        # El escritor ejecuta todo dentro de una misma transaccion
         # Eliminar datos de sensores SHT3x
-        await conn.execute('DELETE FROM sht3x_data WHERE client_id = ?', (client_id,))
+        await delete_client_readings(conn, client_id)
+        
+        # Eliminar agregados de sensores
+        for table, _ in ROLLUP_RESOLUTIONS.values():
+            await conn.execute(f'DELETE FROM {table} WHERE client_id = ?', (client_id,))
         
         # Eliminar eventos
         await conn.execute('DELETE FROM events WHERE client_id = ?', (client_id,))
@@ -184,16 +189,26 @@ async def delete_client(client_id):
         # Eliminar estados de la aplicacion
         await conn.execute('DELETE FROM app_state WHERE client_id = ?', (client_id,))
         
+        # Eliminar el estado actual del cliente
+        await conn.execute('DELETE FROM client_latest WHERE client_id = ?', (client_id,))
+        
+        # Eliminar las secuencias de ingesta recientes
+        await conn.execute('DELETE FROM ingest_sequences WHERE client_id = ?', (client_id,))
+        
+        # Eliminar politicas de retencion propias del cliente
+        await conn.execute('DELETE FROM retention_policies WHERE client_id = ?', (client_id,))
+        
         # Finalmente, eliminar el cliente
         await conn.execute('DELETE FROM clients WHERE client_id = ?', (client_id,))
-        
-        # Confirmar transaccion
-        await conn.execute('COMMIT')
+    
+    try:
+        await get_layout()
+        await writer.run(operation)
+        # Ventanas en memoria, secuencias, estado de control y caches del cliente
+        publish(CLIENT_DELETED, client_id)
+        await asyncio.to_thread(delete_client_archive, client_id)
         return True
     except Exception as e:
-        # Revertir cambios en caso de error
-        await conn.execute('ROLLBACK')
+        # El escritor ya revirtio los cambios de esta operacion
         print(f"Error al eliminar cliente: {e}")
         raise e
-    finally:
-        await conn.close()
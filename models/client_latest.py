@@ -0,0 +1,85 @@
+import json
+from .db_pool import pool
+
+# Ultima lectura por cliente: solo avanza si la lectura es igual o mas reciente que la guardada
+UPSERT_READING = '''
+    INSERT INTO client_latest (client_id, timestamp, temperature, humidity, last_seen)
+    VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT(client_id) DO UPDATE SET
+        timestamp = excluded.timestamp,
+        temperature = excluded.temperature,
+        humidity = excluded.humidity,
+        last_seen = MAX(COALESCE(client_latest.last_seen, ''), excluded.last_seen)
+    WHERE client_latest.timestamp IS NULL OR excluded.timestamp >= client_latest.timestamp
+'''
+
+# Actualizar la ultima lectura de cada cliente de un lote (dentro de la operacion del escritor)
+async def upsert_latest_readings(conn, data_list):
+    newest = {}
+    for reading in data_list:
+        current = newest.get(reading[0])
+        if current is None or reading[1] >= current[1]:
+            newest[reading[0]] = reading
+    await conn.executemany(UPSERT_READING, [
+        (client_id, timestamp, temperature, humidity, timestamp)
+        for client_id, timestamp, temperature, humidity in newest.values()
+    ])
+
+TOUCH_LAST_SEEN = '''
+    INSERT INTO client_latest (client_id, last_seen) VALUES (?, ?)
+    ON CONFLICT(client_id) DO UPDATE SET
+        last_seen = MAX(COALESCE(client_latest.last_seen, ''), excluded.last_seen)
+'''
+
+# Registrar la ultima vez que se vio al cliente (dentro de una operacion del escritor)
+async def touch_last_seen(conn, client_id, last_seen):
+    await conn.execute(TOUCH_LAST_SEEN, (client_id, last_seen))
+
+# Lo mismo para varios clientes [(client_id, last_seen)] con un unico executemany
+async def touch_last_seen_many(conn, rows):
+    await conn.executemany(TOUCH_LAST_SEEN, rows)
+
+# Recalcular el estado de los actuadores del cliente (dentro de una operacion del escritor)
+async def refresh_latest_actuators(conn, client_id):
+    await conn.execute('''
+        INSERT INTO client_latest (client_id, actuators)
+        VALUES (?, (SELECT json_group_object(name, state)
+                    FROM (SELECT name, state FROM actuators WHERE client_id = ? ORDER BY id)))
+        ON CONFLICT(client_id) DO UPDATE SET actuators = excluded.actuators
+    ''', (client_id, client_id))
+
+# Guardar el modo actual del cliente (dentro de una operacion del escritor)
+async def set_latest_mode(conn, client_id, mode):
+    await conn.execute('''
+        INSERT INTO client_latest (client_id, mode) VALUES (?, ?)
+        ON CONFLICT(client_id) DO UPDATE SET mode = excluded.mode
+    ''', (client_id, mode))
+
+# Obtener el estado actual de todos los clientes con una sola consulta
+async def get_fleet_latest():
+    async with pool.reader() as conn:
+        async with conn.execute('''
+            SELECT c.client_id, c.name, c.status, c.manually_disabled,
+                   l.last_seen, l.timestamp, l.temperature, l.humidity, l.actuators, l.mode
+            FROM clients c
+            LEFT JOIN client_latest l ON l.client_id = c.client_id
+            ORDER BY c.client_id
+        ''') as cursor:
+            rows = await cursor.fetchall()
+    return [
+        {
+            'client_id': row['client_id'],
+            'name': row['name'],
+            'status': row['status'],
+            'manually_disabled': row['manually_disabled'] == 1,
+            'last_seen': row['last_seen'],
+            'reading': {
+                'timestamp': row['timestamp'],
+                'temperature': row['temperature'],
+                'humidity': row['humidity'],
+            } if row['timestamp'] is not None else None,
+            'actuators': json.loads(row['actuators']) if row['actuators'] else {},
+            'mode': row['mode'],
+        }
+        for row in rows
+    ]
@@ -0,0 +1,136 @@
+import threading
+from .cache import MISSING, BoundedCache
+from .change_bus import (
+    ACTUATOR_ADDED, ACTUATOR_STATE_CHANGED, CLIENT_DELETED, CLIENT_DISABLED, CLIENT_REGISTERED,
+    MODE_CHANGED, THRESHOLDS_CHANGED, subscribe
+)
+from .db_pool import pool
+
+# Clientes en memoria como maximo (los menos usados se descartan y se recargan al volver)
+RUNTIME_MAX_SIZE = 4096
+
+_lock = threading.Lock()
+_runtimes = BoundedCache('client_runtime', RUNTIME_MAX_SIZE)  # Sin caducidad: el bus lo mantiene al dia
+_versions = {}  # Cambios por cliente: una carga que se cruza con una escritura no se guarda
+_stats = {
+    'loads': 0,  # Cargas de un cliente (primera lectura, cliente nuevo o recarga)
+    'bulk_loads': 0,
+    'write_through': 0,  # Cambios del bus aplicados en memoria
+}
+
+
+class ClientRuntime:
+    """
+    Estado de control de un cliente en memoria: umbrales ideales, modo,
+    actuadores (id por nombre y estado por id) y bandera de desactivacion
+    manual. Las reglas de la ingesta se evaluan sobre este objeto sin leer
+    SQLite; se actualiza con los cambios que publican los modelos al escribir.
+    """
+
+    __slots__ = ('client_id', 'exists', 'thresholds', 'mode', 'actuator_ids', 'actuator_states',
+                 'manually_disabled')
+
+    def __init__(self, client_id):
+        self.client_id = client_id
+        self.exists = False  # False para clientes no registrados (tambien se guardan, sin datos)
+        self.thresholds = {}  # param_type -> (min_value, max_value)
+        self.mode = None
+        self.actuator_ids = {}  # nombre -> id del primer actuador con ese nombre
+        self.actuator_states = {}  # id -> estado
+        self.manually_disabled = False
+
+
+async def _fetch(client_id=None):
+    # Las mismas consultas para todos los clientes o para uno: cuatro lecturas en total
+    where = ' WHERE client_id = ?' if client_id is not None else ''
+    params = (client_id,) if client_id is not None else ()
+    runtimes = {}
+    async with pool.reader() as conn:
+        async with conn.execute(f'SELECT client_id, manually_disabled FROM clients{where}', params) as cursor:
+            for row in await cursor.fetchall():
+                runtime = runtimes[row['client_id']] = ClientRuntime(row['client_id'])
+                runtime.exists = True
+                runtime.manually_disabled = row['manually_disabled'] == 1
+        # En orden de timestamp: el ultimo de cada cliente es el vigente
+        async with conn.execute(f'''
+            SELECT client_id, param_type, min_value, max_value FROM ideal_params{where} ORDER BY timestamp
+        ''', params) as cursor:
+            for row in await cursor.fetchall():
+                if row['client_id'] in runtimes:
+                    runtimes[row['client_id']].thresholds[row['param_type']] = (row['min_value'], row['max_value'])
+        async with conn.execute(f'SELECT client_id, mode FROM app_state{where} ORDER BY timestamp', params) as cursor:
+            for row in await cursor.fetchall():
+                if row['client_id'] in runtimes:
+                    runtimes[row['client_id']].mode = row['mode']
+        async with conn.execute(f'SELECT id, client_id, name, state FROM actuators{where} ORDER BY id', params) as cursor:
+            for row in await cursor.fetchall():
+                runtime = runtimes.get(row['client_id'])
+                if runtime is not None:
+                    runtime.actuator_ids.setdefault(row['name'], row['id'])
+                    runtime.actuator_states[row['id']] = row['state']
+    return runtimes
+
+# Cargar el estado de todos los clientes de una vez (al arrancar)
+async def load_client_runtimes():
+    with _lock:
+        versions = dict(_versions)
+    runtimes = await _fetch()
+    with _lock:
+        for client_id, runtime in runtimes.items():
+            if _versions.get(client_id) == versions.get(client_id):
+                _runtimes.set(client_id, runtime)
+        _stats['bulk_loads'] += 1
+    return len(runtimes)
+
+# Estado en memoria de un cliente; solo lee SQLite la primera vez (o si es un cliente nuevo)
+async def get_client_runtime(client_id):
+    runtime = _runtimes.get(client_id)
+    if runtime is not MISSING:
+        return runtime
+
+    with _lock:
+        version = _versions.get(client_id)
+    loaded = (await _fetch(client_id)).get(client_id) or ClientRuntime(client_id)
+    with _lock:
+        _stats['loads'] += 1
+        if _versions.get(client_id) == version:
+            _runtimes.set(client_id, loaded)
+    return loaded
+
+# Aplicar un cambio confirmado por los modelos (escrituras de la API y de la ingesta)
+def _on_change(change):
+    with _lock:
+        client_id = change.client_id
+        _versions[client_id] = _versions.get(client_id, 0) + 1
+        if change.kind in (CLIENT_REGISTERED, CLIENT_DELETED, ACTUATOR_ADDED):
+            # Alta, baja o nuevo actuador: recargar el cliente al usarlo
+            _runtimes.pop(client_id)
+            return
+        runtime = _runtimes.peek(client_id)
+        if runtime is MISSING:
+            return
+        data = change.data
+        if change.kind == THRESHOLDS_CHANGED:
+            runtime.thresholds[data['param_type']] = (data['min_value'], data['max_value'])
+        elif change.kind == MODE_CHANGED:
+            runtime.mode = data['mode']
+        elif change.kind == ACTUATOR_STATE_CHANGED:
+            if data['actuator_id'] in runtime.actuator_states:
+                runtime.actuator_states[data['actuator_id']] = data['state']
+        elif change.kind == CLIENT_DISABLED:
+            runtime.manually_disabled = data['disabled']
+        _stats['write_through'] += 1
+
+subscribe(None, _on_change)
+
+# Obtener los contadores del estado en memoria de los clientes
+def get_client_runtime_metrics():
+    with _lock:
+        cache = _runtimes.get_metrics()
+        return {
+            'clients': cache['size'],
+            'hits': cache['hits'],
+            **_stats,
+            'invalidations': cache['invalidations'],  # Clientes descartados por un cambio (se recargan al usarse)
+            'evictions': cache['evictions'],
+        }
@@ -0,0 +1,262 @@
+import calendar
+from datetime import datetime, timezone
+from .db_pool import pool
+from .db_writer import writer
+from .backfills import enqueue_backfill, get_backfills, register_backfill, resume_backfills
+
+# Distribuciones de almacenamiento de las lecturas sht3x (guardadas en storage_meta)
+LAYOUT_CLASSIC = 'classic'  # Tabla sht3x_data original
+LAYOUT_MIGRATING = 'migrating'  # Copiando sht3x_data a sht3x_compact en segundo plano
+LAYOUT_COMPACT = 'compact'  # sht3x_compact + vista de compatibilidad sht3x_data
+
+_layout = None
+
+# Tablas compactas: clave entera por cliente, epoch en ms y centesimas de grado / porcentaje
+COMPACT_TABLES = [
+    '''
+    CREATE TABLE IF NOT EXISTS telemetry_clients (
+        client_key INTEGER PRIMARY KEY,
+        client_id TEXT UNIQUE NOT NULL
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS sht3x_compact (
+        client_key INTEGER NOT NULL,
+        ts INTEGER NOT NULL,
+        temperature_cc INTEGER NOT NULL,
+        humidity_cp INTEGER NOT NULL,
+        PRIMARY KEY (client_key, ts)
+    ) WITHOUT ROWID
+    ''',
+]
+
+# Vista con las mismas columnas que la tabla original; el id es el epoch en ms (unico por cliente)
+COMPATIBILITY_VIEW = [
+    '''
+    CREATE VIEW sht3x_data AS
+    SELECT c.ts AS id,
+           k.client_id AS client_id,
+           strftime('%Y-%m-%dT%H:%M:%S', c.ts / 1000, 'unixepoch') || printf('.%06d', c.ts % 1000 * 1000) AS timestamp,
+           c.temperature_cc / 100.0 AS temperature,
+           c.humidity_cp / 100.0 AS humidity
+    FROM sht3x_compact c
+    JOIN telemetry_clients k ON k.client_key = c.client_key
+    ''',
+    '''
+    CREATE TRIGGER sht3x_data_insert INSTEAD OF INSERT ON sht3x_data
+    BEGIN
+        INSERT OR IGNORE INTO telemetry_clients (client_id) VALUES (NEW.client_id);
+        INSERT OR IGNORE INTO sht3x_compact (client_key, ts, temperature_cc, humidity_cp)
+        VALUES ((SELECT client_key FROM telemetry_clients WHERE client_id = NEW.client_id),
+                CAST(ROUND((julianday(NEW.timestamp) - 2440587.5) * 86400000) AS INTEGER),
+                CAST(ROUND(NEW.temperature * 100) AS INTEGER),
+                CAST(ROUND(NEW.humidity * 100) AS INTEGER));
+    END
+    ''',
+    '''
+    CREATE TRIGGER sht3x_data_delete INSTEAD OF DELETE ON sht3x_data
+    BEGIN
+        DELETE FROM sht3x_compact
+        WHERE client_key = (SELECT client_key FROM telemetry_clients WHERE client_id = OLD.client_id)
+          AND ts = OLD.id;
+    END
+    ''',
+]
+
+INSERT_COMPACT = '''
+    INSERT INTO sht3x_compact (client_key, ts, temperature_cc, humidity_cp)
+    VALUES ((SELECT client_key FROM telemetry_clients WHERE client_id = ?), ?, ?, ?)
+'''
+
+# Convertir un timestamp ISO-8601 a epoch en milisegundos (las horas sin zona se guardan tal cual)
+def to_epoch_ms(timestamp):
+    dt = datetime.fromisoformat(timestamp)
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(timezone.utc)
+    return calendar.timegm(dt.timetuple()) * 1000 + dt.microsecond // 1000
+
+# Convertir epoch en milisegundos al mismo formato ISO-8601 que devuelve la vista de compatibilidad
+def from_epoch_ms(ts):
+    return datetime.fromtimestamp(ts // 1000, timezone.utc).strftime('%Y-%m-%dT%H:%M:%S') + f'.{ts % 1000 * 1000:06d}'
+
+# Convertir grados o porcentaje a centesimas enteras
+def to_centi(value):
+    return int(round(value * 100))
+
+async def _fetch_meta(conn, key):
+    async with conn.execute('SELECT value FROM storage_meta WHERE key = ?', (key,)) as cursor:
+        row = await cursor.fetchone()
+    return row[0] if row else None
+
+async def _set_meta(conn, key, value):
+    await conn.execute('INSERT OR REPLACE INTO storage_meta (key, value) VALUES (?, ?)', (key, str(value)))
+
+# Obtener la distribucion actual de las lecturas (se mantiene en memoria; durante la migracion se relee)
+async def get_layout():
+    global _layout
+    if _layout is None or _layout == LAYOUT_MIGRATING:
+        async with pool.reader() as conn:
+            _layout = await _fetch_meta(conn, 'sht3x_layout') or LAYOUT_CLASSIC
+    return _layout
+
+async def _taken_epochs(conn, client_id, low, high):
+    async with conn.execute('''
+        SELECT c.ts FROM sht3x_compact c JOIN telemetry_clients k ON k.client_key = c.client_key
+        WHERE k.client_id = ? AND c.ts BETWEEN ? AND ?
+    ''', (client_id, low, high)) as cursor:
+        return {row[0] for row in await cursor.fetchall()}
+
+# Insertar lecturas (client_id, timestamp, temperature, humidity) en la tabla compacta y devolver el epoch
+# en ms guardado de cada una. La clave primaria es (client_key, ts): una lectura cuyo milisegundo ya esta
+# ocupado por otra del mismo cliente se guarda en el siguiente milisegundo libre en lugar de perderse
+async def insert_compact(conn, data_list):
+    client_ids = {(client_id,) for client_id, _, _, _ in data_list}
+    await conn.executemany('INSERT OR IGNORE INTO telemetry_clients (client_id) VALUES (?)', client_ids)
+
+    epochs = [to_epoch_ms(timestamp) for _, timestamp, _, _ in data_list]
+    ranges = {}
+    for (client_id, _, _, _), ts in zip(data_list, epochs):
+        low, high, count = ranges.get(client_id, (ts, ts, 0))
+        ranges[client_id] = (min(low, ts), max(high, ts), count + 1)
+    # Epochs ocupados en el rango del lote (ampliado con el hueco para desplazar cada lectura)
+    taken = {client_id: (await _taken_epochs(conn, client_id, low, high + count), high + count)
+             for client_id, (low, high, count) in ranges.items()}
+
+    rows = []
+    for (client_id, _, temperature, humidity), ts in zip(data_list, epochs):
+        used, checked_to = taken[client_id]
+        while ts in used or (ts > checked_to and await _taken_epochs(conn, client_id, ts, ts)):
+            ts += 1
+        used.add(ts)
+        rows.append((client_id, ts, to_centi(temperature), to_centi(humidity)))
+    await conn.executemany(INSERT_COMPACT, rows)
+    return [row[1] for row in rows]
+
+# Insertar lecturas en la distribucion activa (dentro de una operacion del escritor).
+# Devuelve los ids asignados, o None durante la migracion
+async def insert_readings(conn, data_list):
+    layout = _layout
+    if layout == LAYOUT_MIGRATING:
+        # La vista puede haber sustituido ya a la tabla en esta misma serie de transacciones del escritor
+        layout = await _fetch_meta(conn, 'sht3x_layout') or LAYOUT_CLASSIC
+    if layout == LAYOUT_COMPACT:
+        return await insert_compact(conn, data_list)
+    # Durante la migracion se sigue escribiendo en la tabla original y la copia las alcanza
+    await conn.executemany(
+        'INSERT INTO sht3x_data (client_id, timestamp, temperature, humidity) VALUES (?, ?, ?, ?)',
+        data_list
+    )
+    if layout != LAYOUT_CLASSIC:
+        return None
+    # AUTOINCREMENT asigna ids consecutivos dentro de la transaccion del escritor unico
+    async with conn.execute('SELECT last_insert_rowid()') as cursor:
+        last_id = (await cursor.fetchone())[0]
+    return list(range(last_id - len(data_list) + 1, last_id + 1))
+
+# Eliminar todas las lecturas de un cliente (dentro de una operacion del escritor)
+async def delete_client_readings(conn, client_id):
+    if _layout != LAYOUT_COMPACT:
+        await conn.execute('DELETE FROM sht3x_data WHERE client_id = ?', (client_id,))
+    if _layout != LAYOUT_CLASSIC:
+        # Tambien las filas ya copiadas o las de la distribucion compacta
+        await conn.execute('''
+            DELETE FROM sht3x_compact
+            WHERE client_key IN (SELECT client_key FROM telemetry_clients WHERE client_id = ?)
+        ''', (client_id,))
+
+# Clientes con lecturas guardadas, registrados o no (la ingesta guarda tambien las de clientes sin registrar)
+async def reading_client_ids(conn):
+    client_ids = set()
+    if _layout != LAYOUT_COMPACT:
+        async with conn.execute('SELECT DISTINCT client_id FROM sht3x_data') as cursor:
+            client_ids.update(row[0] for row in await cursor.fetchall())
+    if _layout != LAYOUT_CLASSIC:
+        async with conn.execute('SELECT client_id FROM telemetry_clients') as cursor:
+            client_ids.update(row[0] for row in await cursor.fetchall())
+    return sorted(client_ids)
+
+# Eliminar un lote de lecturas de un cliente anteriores a `cutoff` (ISO); devuelve las filas borradas
+async def delete_readings_before(conn, client_id, cutoff, limit):
+    deleted = 0
+    if _layout != LAYOUT_COMPACT:
+        cursor = await conn.execute('''
+            DELETE FROM sht3x_data
+            WHERE id IN (SELECT id FROM sht3x_data WHERE client_id = ? AND timestamp < ? ORDER BY timestamp LIMIT ?)
+        ''', (client_id, cutoff, limit))
+        deleted += cursor.rowcount
+        await cursor.close()
+    if _layout != LAYOUT_CLASSIC:
+        cursor = await conn.execute('''
+            DELETE FROM sht3x_compact
+            WHERE client_key = (SELECT client_key FROM telemetry_clients WHERE client_id = ?)
+              AND ts IN (SELECT c.ts FROM sht3x_compact c JOIN telemetry_clients k ON k.client_key = c.client_key
+                         WHERE k.client_id = ? AND c.ts < ? ORDER BY c.ts LIMIT ?)
+        ''', (client_id, client_id, to_epoch_ms(cutoff), limit))
+        deleted += cursor.rowcount
+        await cursor.close()
+    return deleted
+
+# --- Migracion en linea por lotes (backfills reanudables) ---
+
+async def _begin_migration(conn):
+    layout = await _fetch_meta(conn, 'sht3x_layout') or LAYOUT_CLASSIC
+    if layout != LAYOUT_CLASSIC:
+        return layout
+    for statement in COMPACT_TABLES:
+        await conn.execute(statement)
+    await _set_meta(conn, 'sht3x_layout', LAYOUT_MIGRATING)
+    await enqueue_backfill(conn, 'sht3x_compact_copy')
+    return LAYOUT_MIGRATING
+
+async def _copy_chunk(conn, last_id, limit):
+    # Copiar el siguiente lote por id mientras la ingesta sigue escribiendo en la tabla original
+    async with conn.execute('''
+        SELECT id, client_id, timestamp, temperature, humidity FROM sht3x_data
+        WHERE id > ? ORDER BY id LIMIT ?
+    ''', (last_id, limit)) as cursor:
+        rows = await cursor.fetchall()
+    if not rows:
+        return 0, last_id
+    await insert_compact(conn, [(row[1], row[2], row[3], row[4]) for row in rows])
+    return len(rows), rows[-1][0]
+
+async def _cutover(conn, last_id):
+    # El ultimo lote incompleto ya copio todo en esta misma transaccion: sustituir la tabla por la vista.
+    # Hasta que get_layout lea el cambio, las escrituras a sht3x_data pasan por los triggers de la vista
+    await conn.execute('DROP INDEX IF EXISTS idx_sht3x_client_timestamp')
+    await conn.execute('ALTER TABLE sht3x_data RENAME TO sht3x_data_legacy')
+    for statement in COMPATIBILITY_VIEW:
+        await conn.execute(statement)
+    await _set_meta(conn, 'sht3x_layout', LAYOUT_COMPACT)
+    await enqueue_backfill(conn, 'sht3x_legacy_purge')
+
+async def _purge_chunk(conn, last_key, limit):
+    # Vaciar la tabla original por lotes sin bloquear al escritor mucho tiempo
+    cursor = await conn.execute('''
+        DELETE FROM sht3x_data_legacy
+        WHERE id IN (SELECT id FROM sht3x_data_legacy ORDER BY id LIMIT ?)
+    ''', (limit,))
+    purged = cursor.rowcount
+    await cursor.close()
+    return purged, last_key
+
+async def _drop_legacy(conn, last_key):
+    await conn.execute('DROP TABLE IF EXISTS sht3x_data_legacy')
+
+register_backfill('sht3x_compact_copy', _copy_chunk, _cutover)
+register_backfill('sht3x_legacy_purge', _purge_chunk, _drop_legacy)
+
+# Activar la distribucion compacta e iniciar la migracion en linea
+async def start_compact_migration():
+    global _layout
+    _layout = await writer.run(_begin_migration)
+    resume_backfills()
+    return await get_migration_status()
+
+# Obtener la distribucion actual y el progreso de la copia y de la purga de la tabla original
+async def get_migration_status():
+    return {
+        'layout': await get_layout(),
+        'backfills': [backfill for backfill in await get_backfills()
+                      if backfill['name'] in ('sht3x_compact_copy', 'sht3x_legacy_purge')],
+    }
@@ -0,0 +1,278 @@
+import aiosqlite
+import asyncio
+import os
+import pathlib
+import threading
+import time
+from contextlib import asynccontextmanager
+
+# Ruta de la base de datos (raiz del proyecto)
+DB_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'sensor_data.db')
+
+# Configuracion del pool
+READER_POOL_SIZE = 3  # Conexiones de lectura simultaneas (una por nucleo libre en una Pi 4)
+WRITER_POOL_SIZE = 1  # SQLite solo admite un escritor a la vez
+ACQUIRE_TIMEOUT = 30  # Segundos maximos esperando una conexion libre
+HEALTH_CHECK_INTERVAL = 30  # Segundos de inactividad tras los que se verifica una conexion
+
+# Ajustes de las conexiones de solo lectura (consultas de la API y reportes)
+READER_CACHE_KB = 16384  # Cache de paginas por lector (16 MB)
+READER_MMAP_SIZE = 268435456  # Lectura de la base de datos por mmap (hasta 256 MB de espacio virtual)
+# Checkpoint automatico del escritor cuando el WAL supera estas paginas. Es solo una red de seguridad:
+# con el mantenimiento de MSAD en marcha se pone a 0 y los checkpoints se hacen fuera de la ingesta
+WRITER_AUTOCHECKPOINT = 10000
+
+
+class ConnectionPool:
+    """
+    Pool acotado de conexiones aiosqlite persistentes: un escritor y N lectores.
+
+    Los lectores forman un pool separado de solo lectura (`mode=ro`, `query_only`)
+    con mas cache y mmap: en WAL nunca toman el bloqueo de escritura, asi que las
+    consultas largas de la API no frenan la ingesta. Cada pool tiene sus metricas.
+
+    El pool pertenece a un bucle de eventos propio que corre en el hilo 'db-loop'.
+    Las corrutinas de cualquier otro bucle (peticiones Flask, cliente MQTT) adquieren
+    y liberan conexiones a traves de ese bucle, por lo que las colas internas nunca
+    se comparten entre bucles distintos.
+    """
+
+    def __init__(self, db_path=DB_PATH, readers=READER_POOL_SIZE, writers=WRITER_POOL_SIZE):
+        self.db_path = db_path
+        self.writer_autocheckpoint = WRITER_AUTOCHECKPOINT  # Valor vigente (se aplica tambien al reconectar)
+        self._loop = None
+        self._loop_thread = None
+        self._loop_lock = threading.Lock()
+        self._slots = {
+            'reader': self._new_slot(readers),
+            'writer': self._new_slot(writers),
+        }
+        self._closed = False
+
+    @staticmethod
+    def _new_slot(size):
+        return {
+            'size': size,
+            'idle': None,  # asyncio.Queue creada dentro del bucle del pool
+            'created': 0,
+            'in_use': 0,
+            'last_used': {},
+            'acquisitions': 0,
+            'wait_total': 0.0,
+            'wait_max': 0.0,
+            'timeouts': 0,
+            'health_checks': 0,
+            'health_failures': 0,
+            'reconnects': 0,
+        }
+
+    # --- Bucle de eventos propietario ---
+
+    @property
+    def loop(self):
+        """Bucle de eventos que posee las conexiones (se inicia bajo demanda)"""
+        with self._loop_lock:
+            if self._loop is None or self._loop.is_closed():
+                loop = asyncio.new_event_loop()
+                ready = threading.Event()
+
+                def run_loop():
+                    asyncio.set_event_loop(loop)
+                    loop.call_soon(ready.set)
+                    loop.run_forever()
+
+                self._loop_thread = threading.Thread(target=run_loop, name='db-loop', daemon=True)
+                self._loop_thread.start()
+                ready.wait()
+                self._loop = loop
+                self._closed = False
+            return self._loop
+
+    async def run(self, coro):
+        """Ejecutar una corrutina en el bucle del pool y esperar su resultado desde cualquier bucle"""
+        loop = self.loop
+        if asyncio.get_running_loop() is loop:
+            return await coro
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, loop))
+
+    # --- Gestion de conexiones (siempre dentro del bucle del pool) ---
+
+    async def _open(self, kind):
+        if kind == 'reader':
+            # Abrir en solo lectura: SQLite rechaza cualquier escritura desde estas conexiones
+            uri = pathlib.Path(self.db_path).resolve().as_uri() + '?mode=ro'
+            conn = aiosqlite.connect(uri, uri=True, timeout=30)
+        else:
+            conn = aiosqlite.connect(self.db_path, timeout=30)
+        conn.daemon = True  # El hilo de la conexion no debe impedir la salida del proceso
+        await conn
+        if kind == 'reader':
+            await conn.execute('PRAGMA query_only=1;')
+            await conn.execute(f'PRAGMA cache_size=-{READER_CACHE_KB};')
+            await conn.execute(f'PRAGMA mmap_size={READER_MMAP_SIZE};')
+        else:
+            await conn.execute('PRAGMA journal_mode=WAL;')
+            await conn.execute('PRAGMA synchronous=NORMAL;')
+            await conn.execute(f'PRAGMA wal_autocheckpoint={self.writer_autocheckpoint};')
+            await conn.commit()
+        conn.row_factory = aiosqlite.Row
+        return conn
+
+    async def _close_quietly(self, conn):
+        try:
+            await conn.close()
+        except Exception as e:
+            print(f"Error al cerrar conexion del pool: {e}")
+
+    async def _check(self, kind, slot, conn):
+        # Verificar solo las conexiones que llevan un tiempo sin usarse
+        idle_for = time.monotonic() - slot['last_used'].get(id(conn), 0)
+        if idle_for < HEALTH_CHECK_INTERVAL:
+            return conn
+
+        slot['health_checks'] += 1
+        try:
+            async with conn.execute('SELECT 1') as cursor:
+                await cursor.fetchone()
+            return conn
+        except Exception as e:
+            print(f"Conexion del pool no valida, reconectando: {e}")
+            slot['health_failures'] += 1
+            slot['last_used'].pop(id(conn), None)
+            await self._close_quietly(conn)
+            conn = await self._open(kind)
+            slot['reconnects'] += 1
+            return conn
+
+    async def _acquire(self, kind):
+        if self._closed:
+            raise RuntimeError("El pool de conexiones esta cerrado")
+
+        slot = self._slots[kind]
+        if slot['idle'] is None:
+            slot['idle'] = asyncio.Queue(maxsize=slot['size'])
+
+        start = time.monotonic()
+        if slot['idle'].empty() and slot['created'] < slot['size']:
+            # Abrir una conexion nueva mientras no se alcance el limite
+            slot['created'] += 1
+            try:
+                conn = await self._open(kind)
+            except Exception:
+                slot['created'] -= 1
+                raise
+        else:
+            try:
+                conn = await asyncio.wait_for(slot['idle'].get(), ACQUIRE_TIMEOUT)
+            except asyncio.TimeoutError:
+                slot['timeouts'] += 1
+                raise
+            conn = await self._check(kind, slot, conn)
+
+        waited = time.monotonic() - start
+        slot['acquisitions'] += 1
+        slot['wait_total'] += waited
+        slot['wait_max'] = max(slot['wait_max'], waited)
+        slot['in_use'] += 1
+        return conn
+
+    async def _release(self, kind, conn):
+        slot = self._slots[kind]
+        slot['in_use'] -= 1
+
+        # No devolver al pool conexiones con una transaccion a medias
+        try:
+            if conn.in_transaction:
+                await conn.rollback()
+        except Exception as e:
+            print(f"Error al revertir transaccion pendiente: {e}")
+
+        if self._closed:
+            slot['created'] -= 1
+            await self._close_quietly(conn)
+            return
+
+        slot['last_used'][id(conn)] = time.monotonic()
+        slot['idle'].put_nowait(conn)
+
+    @asynccontextmanager
+    async def _connection(self, kind):
+        conn = await self.run(self._acquire(kind))
+        try:
+            yield conn
+        finally:
+            await self.run(self._release(kind, conn))
+
+    def reader(self):
+        """Adquirir una conexion de solo lectura: `async with pool.reader() as conn`"""
+        return self._connection('reader')
+
+    def writer(self):
+        """Adquirir la conexion de escritura (reservada al escritor unico de db_writer)"""
+        return self._connection('writer')
+
+    # --- Salud y metricas ---
+
+    async def health_check(self):
+        """Verificar que tanto el escritor como un lector responden"""
+        result = {}
+        for kind in ('writer', 'reader'):
+            start = time.monotonic()
+            try:
+                async with self._connection(kind) as conn:
+                    async with conn.execute('SELECT 1') as cursor:
+                        await cursor.fetchone()
+                result[kind] = {'healthy': True, 'latency_ms': round((time.monotonic() - start) * 1000, 2)}
+            except Exception as e:
+                result[kind] = {'healthy': False, 'error': str(e)}
+        result['healthy'] = all(result[kind]['healthy'] for kind in ('writer', 'reader'))
+        return result
+
+    def get_metrics(self):
+        """Obtener una instantanea de las metricas del pool"""
+        metrics = {}
+        for kind, slot in self._slots.items():
+            acquisitions = slot['acquisitions']
+            metrics[kind] = {
+                'mode': 'ro' if kind == 'reader' else 'rw',
+                'size': slot['size'],
+                'open': slot['created'],
+                'in_use': slot['in_use'],
+                'idle': slot['idle'].qsize() if slot['idle'] is not None else 0,
+                'acquisitions': acquisitions,
+                'avg_wait_ms': round(slot['wait_total'] / acquisitions * 1000, 3) if acquisitions else 0.0,
+                'max_wait_ms': round(slot['wait_max'] * 1000, 3),
+                'timeouts': slot['timeouts'],
+                'health_checks': slot['health_checks'],
+                'health_failures': slot['health_failures'],
+                'reconnects': slot['reconnects'],
+            }
+        return metrics
+
+    # --- Cierre ---
+
+    async def _close(self):
+        self._closed = True
+        for slot in self._slots.values():
+            idle = slot['idle']
+            while idle is not None and not idle.empty():
+                conn = idle.get_nowait()
+                slot['created'] -= 1
+                await self._close_quietly(conn)
+            slot['last_used'].clear()
+
+    async def close(self):
+        """Cerrar las conexiones inactivas y detener el bucle del pool"""
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            return
+        await self.run(self._close())
+        loop.call_soon_threadsafe(loop.stop)
+        if threading.current_thread() is not self._loop_thread:
+            self._loop_thread.join(timeout=5)
+            loop.close()
+            self._loop = None
+
+
+# Pool compartido por todos los modelos
+pool = ConnectionPool()
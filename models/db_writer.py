@@ -0,0 +1,177 @@
+import asyncio
+import concurrent.futures
+import time
+from .db_pool import pool
+
+# Configuracion del escritor
+WRITER_MAX_BATCH = 500  # Operaciones maximas agrupadas en una misma transaccion
+
+
+class DatabaseWriter:
+    """
+    Tarea unica que serializa todas las escrituras en la base de datos.
+
+    Los llamadores encolan operaciones desde cualquier hilo o bucle y reciben un
+    future con el resultado. La tarea, que corre en el bucle del pool, toma todas
+    las operaciones pendientes en cada vuelta y las confirma en una sola
+    transaccion; cada operacion va dentro de su propio SAVEPOINT para que un fallo
+    aislado no revierta las demas.
+    """
+
+    def __init__(self, db_pool):
+        self._pool = db_pool
+        self._queue = None
+        self._task = None
+        self._closing = False
+        self._busy = False
+        self._metrics = {
+            'submitted': 0,
+            'completed': 0,
+            'failed': 0,
+            'transactions': 0,
+            'max_batch': 0,
+            'commit_time_total': 0.0,
+            'commit_time_max': 0.0,
+        }
+
+    # --- Encolado (desde cualquier hilo) ---
+
+    def _enqueue(self, job):
+        # Se ejecuta siempre dentro del bucle del pool
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+        self._queue.put_nowait(job)
+        self._metrics['submitted'] += 1
+
+    def submit(self, operation):
+        """
+        Encolar una operacion `async def operation(conn)` y devolver un
+        concurrent.futures.Future con su resultado
+        """
+        if self._closing:
+            raise RuntimeError("El escritor de la base de datos se esta cerrando")
+
+        future = concurrent.futures.Future()
+        job = (operation, future)
+        loop = self._pool.loop
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+
+        if running is loop:
+            self._enqueue(job)
+        else:
+            loop.call_soon_threadsafe(self._enqueue, job)
+        return future
+
+    async def run(self, operation):
+        """Encolar una operacion y esperar su resultado"""
+        return await asyncio.wrap_future(self.submit(operation))
+
+    async def execute(self, query, params=()):
+        """Encolar una sentencia de escritura y esperar a que se confirme"""
+        async def operation(conn):
+            cursor = await conn.execute(query, params)
+            rowcount = cursor.rowcount
+            await cursor.close()
+            return rowcount
+        return await self.run(operation)
+
+    async def executemany(self, query, params_list):
+        """Encolar una escritura masiva (executemany) y esperar a que se confirme"""
+        async def operation(conn):
+            await conn.executemany(query, params_list)
+        return await self.run(operation)
+
+    # --- Tarea de escritura (bucle del pool) ---
+
+    async def _run(self):
+        while True:
+            job = await self._queue.get()
+            self._busy = True
+            batch = [job]
+            while len(batch) < WRITER_MAX_BATCH and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            try:
+                await self._commit_batch(batch)
+            except Exception as e:
+                print(f"Error en el escritor de la base de datos: {e}")
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+            finally:
+                self._busy = False
+
+    async def _commit_batch(self, batch):
+        start = time.monotonic()
+        outcomes = []
+        async with self._pool.writer() as conn:
+            await conn.execute('BEGIN IMMEDIATE')
+            try:
+                for operation, future in batch:
+                    await conn.execute('SAVEPOINT write_op')
+                    try:
+                        result = await operation(conn)
+                        await conn.execute('RELEASE SAVEPOINT write_op')
+                        outcomes.append((future, result, None))
+                    except Exception as e:
+                        await conn.execute('ROLLBACK TO SAVEPOINT write_op')
+                        await conn.execute('RELEASE SAVEPOINT write_op')
+                        outcomes.append((future, None, e))
+                await conn.commit()
+            except Exception:
+                await conn.rollback()
+                raise
+
+        elapsed = time.monotonic() - start
+        self._metrics['transactions'] += 1
+        self._metrics['max_batch'] = max(self._metrics['max_batch'], len(batch))
+        self._metrics['commit_time_total'] += elapsed
+        self._metrics['commit_time_max'] = max(self._metrics['commit_time_max'], elapsed)
+
+        for future, result, error in outcomes:
+            if future.cancelled():
+                continue
+            if error is not None:
+                self._metrics['failed'] += 1
+                future.set_exception(error)
+            else:
+                self._metrics['completed'] += 1
+                future.set_result(result)
+
+    # --- Metricas y cierre ---
+
+    def get_metrics(self):
+        """Obtener una instantanea de las metricas del escritor"""
+        transactions = self._metrics['transactions']
+        return {
+            'pending': self._queue.qsize() if self._queue is not None else 0,
+            'submitted': self._metrics['submitted'],
+            'completed': self._metrics['completed'],
+            'failed': self._metrics['failed'],
+            'transactions': transactions,
+            'avg_batch': round((self._metrics['completed'] + self._metrics['failed']) / transactions, 2) if transactions else 0.0,
+            'max_batch': self._metrics['max_batch'],
+            'avg_commit_ms': round(self._metrics['commit_time_total'] / transactions * 1000, 3) if transactions else 0.0,
+            'max_commit_ms': round(self._metrics['commit_time_max'] * 1000, 3),
+        }
+
+    async def _drain(self):
+        # Esperar a que se vacie la cola y termine la transaccion en curso
+        while self._busy or (self._queue is not None and not self._queue.empty()):
+            await asyncio.sleep(0.01)
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def close(self):
+        """Dejar de aceptar escrituras y esperar a que se confirmen las pendientes"""
+        self._closing = True
+        await self._pool.run(self._drain())
+
+
+# Escritor compartido por todos los modelos
+writer = DatabaseWriter(pool)
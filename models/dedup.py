@@ -0,0 +1,160 @@
+import threading
+import time
+from collections import OrderedDict
+from .change_bus import CLIENT_DELETED, subscribe
+from .db_pool import pool
+
+# Configuracion de la deduplicacion de lecturas por numero de secuencia
+DEDUP_WINDOW_SIZE = 256  # Secuencias recientes recordadas en memoria por cliente
+DEDUP_TTL = 3600  # Segundos durante los que una secuencia repetida se considera una reentrega
+DEDUP_PRUNE_INTERVAL = 300  # Segundos entre limpiezas de ingest_sequences
+
+# Las ventanas se consultan desde el bucle MQTT y se liberan desde el del escritor
+_lock = threading.Lock()
+_windows = {}
+_last_prune = 0.0
+_stats = {
+    'checked': 0,  # Lecturas con secuencia recibidas
+    'duplicates': 0,  # Duplicados descartados en total
+    'window_duplicates': 0,  # ... por la ventana en memoria, antes de llegar al buffer
+    'db_duplicates': 0,  # ... por el indice unico de ingest_sequences (p. ej. tras un reinicio)
+    'window_loads': 0,
+}
+
+
+# Convertir el campo opcional del payload en la secuencia: entero (contador del dispositivo
+# o epoch en ms) o epoch en segundos con decimales. Devuelve None si no es valido
+def parse_sequence(value):
+    value = value.strip()
+    if not value:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        pass
+    try:
+        return int(float(value) * 1000)
+    except (ValueError, OverflowError):
+        return None
+
+class RecentSequences:
+    """
+    Ultimas secuencias vistas de un cliente con el instante en que llegaron.
+    Una secuencia cuenta como duplicada solo durante DEDUP_TTL, de modo que un
+    dispositivo que reinicia su contador no pierde lecturas pasado ese tiempo.
+    """
+
+    def __init__(self, size=DEDUP_WINDOW_SIZE):
+        self.size = size
+        self.seen = OrderedDict()
+
+    def contains(self, seq, now):
+        received = self.seen.get(seq)
+        return received is not None and now - received < DEDUP_TTL
+
+    def add(self, seq, now):
+        self.seen[seq] = now
+        self.seen.move_to_end(seq)
+        while len(self.seen) > self.size:
+            self.seen.popitem(last=False)
+
+async def _load(client_id):
+    # Sembrar la ventana con las secuencias guardadas (tras un reinicio no se pierden las recientes)
+    async with pool.reader() as conn:
+        async with conn.execute('''
+            SELECT seq, received_at FROM ingest_sequences
+            WHERE client_id = ? AND received_at >= ?
+            ORDER BY received_at DESC LIMIT ?
+        ''', (client_id, time.time() - DEDUP_TTL, DEDUP_WINDOW_SIZE)) as cursor:
+            rows = await cursor.fetchall()
+    with _lock:
+        if client_id in _windows:
+            return
+        window = RecentSequences()
+        for seq, received_at in reversed(rows):
+            window.add(seq, received_at)
+        _windows[client_id] = window
+        _stats['window_loads'] += 1
+
+# Comprobar una lectura con secuencia y reservarla si es nueva. Devuelve True si es una reentrega
+async def is_duplicate(client_id, seq):
+    if client_id not in _windows:
+        await _load(client_id)
+    now = time.time()
+    with _lock:
+        _stats['checked'] += 1
+        window = _windows.setdefault(client_id, RecentSequences())
+        if window.contains(seq, now):
+            _stats['duplicates'] += 1
+            _stats['window_duplicates'] += 1
+            return True
+        window.add(seq, now)
+        return False
+
+# Liberar secuencias reservadas cuya lectura no se llego a guardar (fallo del escritor)
+def release(client_id_seqs):
+    with _lock:
+        for client_id, seq in client_id_seqs:
+            window = _windows.get(client_id)
+            if window is not None:
+                window.seen.pop(seq, None)
+
+# Registrar las secuencias de un lote en ingest_sequences (dentro de la operacion del escritor).
+# Devuelve las lecturas nuevas y las duplicadas que ya estaban guardadas
+async def record_sequences(conn, data_list, seqs):
+    global _last_prune
+    now = time.time()
+    by_client = {}
+    for reading, seq in zip(data_list, seqs):
+        if seq is not None:
+            by_client.setdefault(reading[0], []).append(seq)
+
+    stored = set()
+    for client_id, client_seqs in by_client.items():
+        placeholders = ', '.join('?' * len(client_seqs))
+        async with conn.execute(f'''
+            SELECT seq FROM ingest_sequences
+            WHERE client_id = ? AND seq IN ({placeholders}) AND received_at >= ?
+        ''', (client_id, *client_seqs, now - DEDUP_TTL)) as cursor:
+            stored.update((client_id, row[0]) for row in await cursor.fetchall())
+
+    readings, duplicates, new_seqs = [], [], []
+    for reading, seq in zip(data_list, seqs):
+        if seq is not None and (reading[0], seq) in stored:
+            duplicates.append(reading)
+            continue
+        readings.append(reading)
+        if seq is not None:
+            new_seqs.append((reading[0], seq, now))
+    # Una secuencia mas antigua que DEDUP_TTL se reutiliza (contador reiniciado en el dispositivo)
+    await conn.executemany('''
+        INSERT INTO ingest_sequences (client_id, seq, received_at) VALUES (?, ?, ?)
+        ON CONFLICT(client_id, seq) DO UPDATE SET received_at = excluded.received_at
+    ''', new_seqs)
+
+    if now - _last_prune > DEDUP_PRUNE_INTERVAL:
+        _last_prune = now
+        await conn.execute('DELETE FROM ingest_sequences WHERE received_at < ?', (now - DEDUP_TTL,))
+
+    if duplicates:
+        with _lock:
+            _stats['duplicates'] += len(duplicates)
+            _stats['db_duplicates'] += len(duplicates)
+    return readings, duplicates
+
+# Olvidar las secuencias de un cliente eliminado
+def drop(client_id):
+    with _lock:
+        _windows.pop(client_id, None)
+
+subscribe((CLIENT_DELETED,), lambda change: drop(change.client_id))
+
+# Obtener los contadores de la deduplicacion
+def get_dedup_metrics():
+    with _lock:
+        return {
+            'window_size': DEDUP_WINDOW_SIZE,
+            'ttl': DEDUP_TTL,
+            'clients': len(_windows),
+            **_stats,
+        }
@@ -1,44 +1,180 @@
 import aiosqlite
+import asyncio
+import threading
+import time
 from datetime import datetime
-from .sensor_data import get_db_connection
+from typing import List, Tuple
+from .db_pool import pool
+from .db_writer import writer
+from .pagination import decode_cursor
 
-# Guardar evento en la base de datos
+# Buffer para acumular eventos antes de insercion
+_event_buffer: List[Tuple[str, str, str, str]] = []
+_event_buffer_lock = threading.Lock()  # save_event se llama desde el bucle MQTT y desde Flask
+_event_flush_timer = None
+_event_flush_failing = False  # Tras un vaciado fallido solo se reintenta por tiempo
+MAX_EVENT_BUFFER_SIZE = 50
+MAX_EVENT_BUFFER_TIME = 2  # segundos
+MAX_EVENT_BACKLOG = 5000  # Eventos retenidos como maximo si los vaciados fallan (se descartan los mas antiguos)
+
+# Contadores de vaciado del buffer
+_event_flush_stats = {
+    'flushes': 0,
+    'size_flushes': 0,
+    'time_flushes': 0,
+    'manual_flushes': 0,
+    'failed_flushes': 0,
+    'events_flushed': 0,
+    'events_dropped': 0,
+    'last_batch_size': 0,
+    'max_batch_size': 0,
+    'last_latency': 0.0,
+    'total_latency': 0.0,
+    'max_latency': 0.0,
+}
+
+# Programar un vaciado por tiempo (se ejecuta en el bucle del pool)
+def _schedule_time_flush():
+    global _event_flush_timer
+    if _event_flush_timer is None:
+        loop = asyncio.get_running_loop()
+        _event_flush_timer = loop.call_later(MAX_EVENT_BUFFER_TIME, _on_flush_timer)
+
+def _on_flush_timer():
+    global _event_flush_timer
+    _event_flush_timer = None
+    asyncio.get_running_loop().create_task(_timed_flush())
+
+async def _timed_flush():
+    try:
+        await flush_events('time')
+    except Exception:
+        pass  # El error ya se registro y los eventos siguen en el buffer
+
+# Descartar los eventos mas antiguos por encima de MAX_EVENT_BACKLOG (con _event_buffer_lock)
+def _trim_backlog():
+    dropped = len(_event_buffer) - MAX_EVENT_BACKLOG
+    if dropped > 0:
+        del _event_buffer[:dropped]
+        _event_flush_stats['events_dropped'] += dropped
+
+# Vaciar el buffer de eventos con un unico executemany
+async def flush_events(reason='manual'):
+    global _event_buffer, _event_flush_failing
+    with _event_buffer_lock:
+        if not _event_buffer:
+            return 0
+        batch = _event_buffer
+        _event_buffer = []
+
+    start = time.monotonic()
+    try:
+        await writer.executemany(
+            'INSERT INTO events (client_id, timestamp, message, topic) VALUES (?, ?, ?, ?)',
+            batch
+        )
+    except Exception as e:
+        print(f"Error al guardar eventos en lote: {e}")
+        _event_flush_stats['failed_flushes'] += 1
+        _event_flush_failing = True
+        # Devolver los eventos al buffer para reintentarlo en el siguiente vaciado, sin superar
+        # MAX_EVENT_BACKLOG aunque el error persista (disco lleno, evento que no se puede guardar...)
+        with _event_buffer_lock:
+            _event_buffer = batch + _event_buffer
+            _trim_backlog()
+        pool.loop.call_soon_threadsafe(_schedule_time_flush)
+        raise
+
+    latency = time.monotonic() - start
+    _event_flush_failing = False
+    _event_flush_stats['flushes'] += 1
+    _event_flush_stats[f'{reason}_flushes'] += 1
+    _event_flush_stats['events_flushed'] += len(batch)
+    _event_flush_stats['last_batch_size'] = len(batch)
+    _event_flush_stats['max_batch_size'] = max(_event_flush_stats['max_batch_size'], len(batch))
+    _event_flush_stats['last_latency'] = latency
+    _event_flush_stats['total_latency'] += latency
+    _event_flush_stats['max_latency'] = max(_event_flush_stats['max_latency'], latency)
+    return len(batch)
+
+# Guardar evento en la base de datos (con buffer)
 async def save_event(client_id, message, topic):
-    conn = await get_db_connection()
-    await conn.execute('INSERT INTO events (client_id, timestamp, message, topic) VALUES (?, ?, ?, ?)',
-                       (client_id, datetime.now().isoformat(), message, topic))
-    await conn.commit()
-    await conn.close()
+    with _event_buffer_lock:
+        _event_buffer.append((client_id, datetime.now().isoformat(), message, topic))
+        _trim_backlog()
+        buffered = len(_event_buffer)
+
+    if buffered >= MAX_EVENT_BUFFER_SIZE and not _event_flush_failing:
+        try:
+            await flush_events('size')
+        except Exception:
+            pass  # El evento queda en el buffer; el error ya se registro y se reintenta por tiempo
+    elif buffered == 1:
+        # Primer evento del lote: garantizar que se vacie aunque no lleguen mas
+        pool.loop.call_soon_threadsafe(_schedule_time_flush)
+
+# Obtener los contadores del buffer de eventos
+def get_event_buffer_metrics():
+    flushes = _event_flush_stats['flushes']
+    return {
+        'buffered': len(_event_buffer),
+        'max_buffer_size': MAX_EVENT_BUFFER_SIZE,
+        'max_buffer_time': MAX_EVENT_BUFFER_TIME,
+        'flushes': flushes,
+        'size_flushes': _event_flush_stats['size_flushes'],
+        'time_flushes': _event_flush_stats['time_flushes'],
+        'manual_flushes': _event_flush_stats['manual_flushes'],
+        'failed_flushes': _event_flush_stats['failed_flushes'],
+        'events_flushed': _event_flush_stats['events_flushed'],
+        'events_dropped': _event_flush_stats['events_dropped'],
+        'max_backlog': MAX_EVENT_BACKLOG,
+        'last_batch_size': _event_flush_stats['last_batch_size'],
+        'avg_batch_size': round(_event_flush_stats['events_flushed'] / flushes, 2) if flushes else 0.0,
+        'max_batch_size': _event_flush_stats['max_batch_size'],
+        'last_flush_ms': round(_event_flush_stats['last_latency'] * 1000, 3),
+        'avg_flush_ms': round(_event_flush_stats['total_latency'] / flushes * 1000, 3) if flushes else 0.0,
+        'max_flush_ms': round(_event_flush_stats['max_latency'] * 1000, 3),
+    }
 
 # Obtener todos los eventos desde la base de datos con paginacion
 async def get_all_events(client_id, page, page_size):
-    conn = await get_db_connection()
-    async with conn.execute('SELECT * FROM events WHERE client_id = ? ORDER BY timestamp DESC LIMIT ? OFFSET ?',
-                            (client_id, page_size, (page - 1) * page_size)) as cursor:
-        data = await cursor.fetchall()
-    await conn.close()
+    async with pool.reader() as conn:
+        async with conn.execute('SELECT * FROM events WHERE client_id = ? ORDER BY timestamp DESC LIMIT ? OFFSET ?',
+                                (client_id, page_size, (page - 1) * page_size)) as cursor:
+            data = await cursor.fetchall()
     return data
 
 # Obtener eventos filtrados por tema
 async def get_events_by_topic(client_id, topic, page, page_size):
-    conn = await get_db_connection()
-    async with conn.execute('SELECT * FROM events WHERE client_id = ? AND topic = ? ORDER BY timestamp DESC LIMIT ? OFFSET ?',
-                            (client_id, topic, page_size, (page - 1) * page_size)) as cursor:
-        data = await cursor.fetchall()
-    await conn.close()
+    async with pool.reader() as conn:
+        async with conn.execute('SELECT * FROM events WHERE client_id = ? AND topic = ? ORDER BY timestamp DESC LIMIT ? OFFSET ?',
+                                (client_id, topic, page_size, (page - 1) * page_size)) as cursor:
+            data = await cursor.fetchall()
+    return data
+
+# Obtener eventos con paginacion por cursor, opcionalmente filtrados por tema
+async def get_events_after(client_id, after, page_size, topic=None):
+    conditions = ['client_id = ?']
+    params = [client_id]
+    if topic:
+        conditions.append('topic = ?')
+        params.append(topic)
+    if after:
+        timestamp, row_id = decode_cursor(after)
+        conditions.append('(timestamp, id) < (?, ?)')
+        params.extend([timestamp, row_id])
+    params.append(page_size)
+    query = f'SELECT * FROM events WHERE {" AND ".join(conditions)} ORDER BY timestamp DESC, id DESC LIMIT ?'
+    async with pool.reader() as conn:
+        async with conn.execute(query, params) as cursor:
+            data = await cursor.fetchall()
     return data
 
 # Actualizar un evento en la base de datos
 async def update_event(client_id, id, message, topic):
-    conn = await get_db_connection()
-    await conn.execute('UPDATE events SET message = ?, timestamp = ?, topic = ? WHERE id = ? AND client_id = ?',
-                       (message, datetime.now().isoformat(), topic, id, client_id))
-    await conn.commit()
-    await conn.close()
+    await writer.execute('UPDATE events SET message = ?, timestamp = ?, topic = ? WHERE id = ? AND client_id = ?',
+                         (message, datetime.now().isoformat(), topic, id, client_id))
 
 # Eliminar un evento en la base de datos
 async def delete_event(client_id, id):
-    conn = await get_db_connection()
-    await conn.execute('DELETE FROM events WHERE id = ? AND client_id = ?', (id, client_id))
-    await conn.commit()
-    await conn.close()
+    await writer.execute('DELETE FROM events WHERE id = ? AND client_id = ?', (id, client_id))
@@ -0,0 +1,114 @@
+import asyncio
+import csv
+import io
+import json
+import zlib
+from .db_pool import pool
+from .archive import iter_archived_rows
+from .compact_storage import LAYOUT_COMPACT, get_layout, to_epoch_ms
+
+# Configuracion de la exportacion por streaming
+EXPORT_CHUNK_SIZE = 1000  # Filas leidas por consulta y escritas por bloque de la respuesta
+EXPORT_FORMATS = ('ndjson', 'csv')
+
+# Columnas exportadas de cada conjunto de datos
+EXPORT_DATASETS = {
+    'sht3x': ('id', 'client_id', 'timestamp', 'temperature', 'humidity'),
+    'events': ('id', 'client_id', 'timestamp', 'topic', 'message'),
+}
+_TABLES = {
+    'sht3x': 'sht3x_data',
+    'events': 'events',
+}
+
+# Limite superior inclusivo de un prefijo ISO ('~' ordena despues de cualquier digito, 'T' o ':')
+def end_bound(end):
+    return end + '~' if end else None
+
+# Siguiente bloque de filas de un cliente despues de `after` (ultima fila del bloque anterior), por keyset.
+# Cada bloque es una consulta corta por indice: no deja una transaccion de lectura abierta entre bloques
+async def fetch_chunk(dataset, client_id, after, start=None, end=None, limit=EXPORT_CHUNK_SIZE):
+    columns = ', '.join(EXPORT_DATASETS[dataset])
+    if dataset == 'sht3x' and await get_layout() == LAYOUT_COMPACT:
+        # El id es el epoch en ms y recorre la clave (client_key, ts); el final del rango se corta al leer
+        lower = after['id'] if after else (to_epoch_ms(start) - 1 if start else -1)
+        query = f'SELECT {columns} FROM sht3x_data WHERE client_id = ? AND id > ? ORDER BY id LIMIT ?'
+        params = (client_id, lower, limit)
+    else:
+        conditions = ['client_id = ?']
+        params = [client_id]
+        if after:
+            conditions.append('(timestamp, id) > (?, ?)')
+            params += [after['timestamp'], after['id']]
+        elif start:
+            conditions.append('timestamp >= ?')
+            params.append(start)
+        if end:
+            conditions.append('timestamp <= ?')
+            params.append(end_bound(end))
+        query = f'''
+            SELECT {columns} FROM {_TABLES[dataset]}
+            WHERE {' AND '.join(conditions)}
+            ORDER BY timestamp, id
+            LIMIT ?
+        '''
+        params = (*params, limit)
+    async with pool.reader() as conn:
+        async with conn.execute(query, params) as cursor:
+            return [dict(row) for row in await cursor.fetchall()]
+
+def _run(coro):
+    # El generador de la respuesta es sincrono y corre en el hilo del servidor: consultar en el bucle del pool
+    return asyncio.run_coroutine_threadsafe(coro, pool.loop).result()
+
+# Recorrer las filas de los clientes en orden (cliente, timestamp) sin cargarlas en memoria
+def iter_rows(dataset, client_ids, start=None, end=None):
+    upper = end_bound(end)
+    for client_id in client_ids:
+        if dataset == 'sht3x':
+            # Primero el archivo frio, cuyas lecturas son anteriores a todas las de SQLite
+            yield from iter_archived_rows(client_id, start, upper)
+        after = None
+        while True:
+            rows = _run(fetch_chunk(dataset, client_id, after, start, end))
+            for row in rows:
+                if upper and row['timestamp'] > upper:
+                    break
+                yield row
+            else:
+                if len(rows) == EXPORT_CHUNK_SIZE:
+                    after = rows[-1]
+                    continue
+            break
+
+# Serializar las filas en bloques de bytes (NDJSON o CSV con cabecera), opcionalmente comprimidos con gzip
+def iter_encoded(rows, fmt, columns, compress=False):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n') if fmt == 'csv' else None
+    if writer is not None:
+        writer.writerow(columns)
+    pending = 0
+
+    def take():
+        data = buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+        return compressor.compress(data) if compressor is not None else data
+
+    for row in rows:
+        if writer is not None:
+            writer.writerow([row[column] for column in columns])
+        else:
+            buffer.write(json.dumps({column: row[column] for column in columns}) + '\n')
+        pending += 1
+        if pending >= EXPORT_CHUNK_SIZE:
+            pending = 0
+            data = take()
+            if data:
+                yield data
+    data = take()
+    if compressor is not None:
+        data += compressor.flush()
+    if data:
+        yield data
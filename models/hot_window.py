@@ -0,0 +1,195 @@
+import threading
+from array import array
+from .db_pool import pool
+from .compact_storage import LAYOUT_COMPACT, LAYOUT_MIGRATING, from_epoch_ms, get_layout, to_centi, to_epoch_ms
+from .change_bus import CLIENT_DELETED, subscribe
+from .pagination import MAX_ROW_ID
+
+# Configuracion de la ventana de lecturas recientes
+HOT_WINDOW_SIZE = 200  # Ultimas lecturas por cliente servidas desde memoria
+PENDING_ID = 0  # Lectura aun sin guardar en SQLite (todavia sin id)
+
+# Las ventanas se actualizan desde el bucle MQTT, el del pool y los de las peticiones Flask
+_lock = threading.Lock()
+_windows = {}
+_stats = {
+    'hits': 0,
+    'loads': 0,
+    'bypassed': 0,
+}
+
+
+class HotWindow:
+    """
+    Ring buffer columnar (arrays de tamano fijo) con las ultimas lecturas de un cliente.
+
+    Contiene siempre todas las lecturas del cliente mas recientes que la mas
+    antigua que guarda, por lo que sirve las primeras paginas sin consultar SQLite.
+    """
+
+    def __init__(self, size=HOT_WINDOW_SIZE):
+        self.size = size
+        self.ids = array('q', bytes(8 * size))
+        self.temperatures = array('d', bytes(8 * size))
+        self.humidities = array('d', bytes(8 * size))
+        self.timestamps = [None] * size
+        self.start = 0  # Posicion de la lectura mas antigua
+        self.count = 0
+        self.layout = None  # Distribucion con la que se cargo desde SQLite (None = sin cargar)
+
+    def _slot(self, index):
+        return (self.start + index) % self.size
+
+    def entries(self):
+        """Lecturas (id, timestamp, temperatura, humedad) de la mas antigua a la mas reciente"""
+        slots = [self._slot(index) for index in range(self.count)]
+        return [(self.ids[s], self.timestamps[s], self.temperatures[s], self.humidities[s]) for s in slots]
+
+    def append(self, row_id, timestamp, temperature, humidity):
+        if self.count < self.size:
+            slot = self._slot(self.count)
+            self.count += 1
+        else:
+            # Llena: sobrescribir la mas antigua
+            slot = self.start
+            self.start = (self.start + 1) % self.size
+        self.ids[slot] = row_id
+        self.timestamps[slot] = timestamp
+        self.temperatures[slot] = temperature
+        self.humidities[slot] = humidity
+
+    def replace(self, entries):
+        """Sustituir el contenido por `entries` ordenadas, conservando las mas recientes"""
+        self.start = 0
+        self.count = 0
+        for entry in entries[-self.size:]:
+            self.append(*entry)
+
+    def newest(self):
+        return self.entries()[-1] if self.count else None
+
+    def oldest(self):
+        return self.entries()[0] if self.count else None
+
+
+# Mismo orden que las consultas (timestamp, id); las pendientes van detras de las guardadas
+def _key(entry):
+    return (entry[1], entry[0] or MAX_ROW_ID)
+
+def _normalize(layout, row_id, timestamp, temperature, humidity):
+    # En la distribucion compacta el id es el epoch en ms guardado (posterior al timestamp recibido si
+    # ese milisegundo ya estaba ocupado) y los valores se guardan en centesimas
+    if layout != LAYOUT_COMPACT:
+        return (row_id, timestamp, temperature, humidity)
+    ts = row_id if row_id != PENDING_ID else to_epoch_ms(timestamp)
+    return (ts, from_epoch_ms(ts), to_centi(temperature) / 100.0, to_centi(humidity) / 100.0)
+
+def _add(window, entry):
+    entry = _normalize(window.layout, *entry)
+    newest = window.newest()
+    if newest is None or _key(entry) > _key(newest):
+        window.append(*entry)
+        return
+    if window.layout == LAYOUT_COMPACT and entry[0] == newest[0]:
+        return  # Misma lectura (mismo epoch guardado) que ya esta en la ventana
+    if window.count == window.size and _key(entry) < _key(window.oldest()):
+        return  # Mas antigua que la ventana: solo se vera en SQLite
+    # Llegada fuera de orden (poco frecuente): reordenar
+    window.replace(_merge(window.layout, window.entries(), [entry]))
+
+def _merge(layout, entries, rows):
+    # Unir sin duplicados: por id si ya lo tienen (epoch en ms en la distribucion compacta)
+    merged = {}
+    for entry in entries + rows:
+        entry = _normalize(layout, *entry)
+        merged[entry[0] or ('pending', entry[1], entry[2], entry[3])] = entry
+    return sorted(merged.values(), key=_key)
+
+# Registrar lecturas insertadas, despues de que el escritor confirme la transaccion.
+# `ids` es None si no se conocen (durante la migracion compacta)
+def record_inserted(data_list, ids):
+    with _lock:
+        for index, (client_id, timestamp, temperature, humidity) in enumerate(data_list):
+            window = _windows.get(client_id)
+            if window is None:
+                continue  # Nadie la ha consultado: se cargara desde SQLite
+            entry = _normalize(window.layout, ids[index] if ids is not None else PENDING_ID,
+                               timestamp, temperature, humidity)
+            for slot in map(window._slot, reversed(range(window.count))):
+                if (window.ids[slot] == PENDING_ID and window.timestamps[slot] == entry[1]) or \
+                        window.ids[slot] == entry[0] != PENDING_ID:
+                    window.ids[slot] = entry[0]
+                    break
+            else:
+                _add(window, entry)
+
+# Quitar las lecturas anteriores a `cutoff` (ISO) que la retencion o el archivo sacan de SQLite
+def trim_before(client_id, cutoff):
+    with _lock:
+        window = _windows.get(client_id)
+        if window is not None and window.count and window.oldest()[1] < cutoff:
+            window.replace([entry for entry in window.entries() if entry[1] >= cutoff])
+
+# Olvidar la ventana de un cliente eliminado
+def drop(client_id):
+    with _lock:
+        _windows.pop(client_id, None)
+
+subscribe((CLIENT_DELETED,), lambda change: drop(change.client_id))
+
+async def _load(client_id, layout):
+    with _lock:
+        # Crear la ventana antes de leer para no perder las inserciones que ocurran mientras tanto
+        window = _windows.setdefault(client_id, HotWindow())
+    order = 'id DESC' if layout == LAYOUT_COMPACT else 'timestamp DESC, id DESC'
+    async with pool.reader() as conn:
+        async with conn.execute(f'''
+            SELECT id, timestamp, temperature, humidity FROM sht3x_data
+            WHERE client_id = ? ORDER BY {order} LIMIT ?
+        ''', (client_id, window.size)) as cursor:
+            rows = [tuple(row) for row in await cursor.fetchall()]
+    with _lock:
+        entries = window.entries()
+        if window.layout is not None and window.layout != layout:
+            # Tras la migracion compacta los ids cambian: se recargan desde SQLite
+            entries = [entry for entry in entries if entry[0] == PENDING_ID]
+        window.layout = layout
+        window.replace(_merge(layout, entries, rows))
+        _stats['loads'] += 1
+    return window
+
+# Lecturas de la ventana de un cliente, de la mas reciente a la mas antigua.
+# Devuelve None mientras no se puede usar (migracion compacta en curso)
+async def get_recent(client_id):
+    layout = await get_layout()
+    if layout == LAYOUT_MIGRATING:
+        _stats['bypassed'] += 1
+        return None
+    window = _windows.get(client_id)
+    if window is None or window.layout != layout:
+        window = await _load(client_id, layout)
+    else:
+        _stats['hits'] += 1
+    with _lock:
+        entries = window.entries()
+    return [
+        {
+            'id': row_id or None,
+            'client_id': client_id,
+            'timestamp': timestamp,
+            'temperature': temperature,
+            'humidity': humidity,
+        }
+        for row_id, timestamp, temperature, humidity in reversed(entries)
+    ]
+
+# Obtener los contadores de la ventana de lecturas recientes
+def get_hot_window_metrics():
+    with _lock:
+        windows = list(_windows.values())
+        return {
+            'size': HOT_WINDOW_SIZE,
+            'clients': len(windows),
+            'readings': sum(window.count for window in windows),
+            **_stats,
+        }
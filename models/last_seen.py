@@ -0,0 +1,124 @@
+import asyncio
+import threading
+import time
+from datetime import datetime
+from .change_bus import CLIENT_DELETED, subscribe
+from .client_latest import touch_last_seen_many
+from .db_pool import pool
+from .db_writer import writer
+
+# Ultima vez que se vio a cada cliente, pendiente de guardar (client_id -> epoch en segundos)
+_pending = {}
+_lock = threading.Lock()  # Se marca desde el bucle MQTT (o las llamadas de los workers) y desde Flask
+_flush_timer = None
+LAST_SEEN_FLUSH_INTERVAL = 15  # Segundos entre escrituras de la ultima conexion de los clientes
+
+# Un cliente desactivado manualmente se sigue viendo pero no vuelve a estar online. La bandera se
+# comprueba en la propia sentencia, con el valor confirmado en la base de datos
+UPDATE_SEEN = '''
+    UPDATE clients SET
+        status = CASE WHEN manually_disabled = 0 THEN 'online' ELSE status END,
+        last_seen = MAX(COALESCE(last_seen, ''), ?)
+    WHERE client_id = ?
+'''
+
+_stats = {
+    'marked': 0,  # Clientes marcados como vistos (antes de agrupar)
+    'flushes': 0,
+    'failed_flushes': 0,
+    'clients_flushed': 0,
+    'last_batch_size': 0,
+    'max_batch_size': 0,
+    'last_latency': 0.0,
+    'total_latency': 0.0,
+}
+
+# Programar una escritura por tiempo (se ejecuta en el bucle del pool)
+def _schedule_flush():
+    global _flush_timer
+    if _flush_timer is None:
+        loop = asyncio.get_running_loop()
+        _flush_timer = loop.call_later(LAST_SEEN_FLUSH_INTERVAL, _on_flush_timer)
+
+def _on_flush_timer():
+    global _flush_timer
+    _flush_timer = None
+    asyncio.get_running_loop().create_task(_timed_flush())
+
+async def _timed_flush():
+    try:
+        await flush_last_seen()
+    except Exception:
+        pass  # El error ya se registro y los clientes siguen pendientes
+
+# Marcar clientes como vistos ({client_id: epoch}); se guardan todos juntos en la siguiente escritura
+async def mark_clients_seen(seen):
+    with _lock:
+        first = not _pending
+        for client_id, received in seen.items():
+            if received > _pending.get(client_id, 0):
+                _pending[client_id] = received
+        _stats['marked'] += len(seen)
+    if first and seen:
+        pool.loop.call_soon_threadsafe(_schedule_flush)
+
+# Guardar la ultima conexion de todos los clientes pendientes en una sola transaccion
+async def flush_last_seen():
+    global _pending
+    with _lock:
+        if not _pending:
+            return 0
+        batch = _pending
+        _pending = {}
+
+    rows = [(datetime.fromtimestamp(received).isoformat(), client_id) for client_id, received in batch.items()]
+
+    async def operation(conn):
+        await conn.executemany(UPDATE_SEEN, rows)
+        await touch_last_seen_many(conn, [(client_id, last_seen) for last_seen, client_id in rows])
+
+    start = time.monotonic()
+    try:
+        await writer.run(operation)
+    except Exception as e:
+        print(f"Error al guardar la ultima conexion de los clientes: {e}")
+        _stats['failed_flushes'] += 1
+        # Devolver los clientes pendientes (salvo los que se hayan vuelto a ver despues)
+        with _lock:
+            for client_id, received in batch.items():
+                if received > _pending.get(client_id, 0):
+                    _pending[client_id] = received
+        pool.loop.call_soon_threadsafe(_schedule_flush)
+        raise
+
+    latency = time.monotonic() - start
+    _stats['flushes'] += 1
+    _stats['clients_flushed'] += len(batch)
+    _stats['last_batch_size'] = len(batch)
+    _stats['max_batch_size'] = max(_stats['max_batch_size'], len(batch))
+    _stats['last_latency'] = latency
+    _stats['total_latency'] += latency
+    return len(batch)
+
+# No guardar la ultima conexion de un cliente eliminado
+def _forget_client(change):
+    with _lock:
+        _pending.pop(change.client_id, None)
+
+subscribe((CLIENT_DELETED,), _forget_client)
+
+# Obtener los contadores de la escritura de la ultima conexion
+def get_last_seen_metrics():
+    flushes = _stats['flushes']
+    return {
+        'pending': len(_pending),
+        'flush_interval': LAST_SEEN_FLUSH_INTERVAL,
+        'marked': _stats['marked'],
+        'flushes': flushes,
+        'failed_flushes': _stats['failed_flushes'],
+        'clients_flushed': _stats['clients_flushed'],
+        'last_batch_size': _stats['last_batch_size'],
+        'max_batch_size': _stats['max_batch_size'],
+        'last_flush_ms': round(_stats['last_latency'] * 1000, 3),
+        'avg_flush_ms': round(_stats['total_latency'] / flushes * 1000, 3) if flushes else 0.0,
+    }
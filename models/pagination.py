@@ -0,0 +1,25 @@
+import base64
+
+# Id mayor que cualquier fila: las lecturas aun sin guardar se ordenan detras de las guardadas
+MAX_ROW_ID = 2 ** 63 - 1
+
+# Codificar un cursor opaco (timestamp + id) a partir de la ultima fila de una pagina
+def encode_cursor(timestamp, row_id):
+    raw = f"{timestamp}|{row_id}".encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+# Decodificar un cursor; lanza ValueError si no es valido
+def decode_cursor(token):
+    padded = token + '=' * (-len(token) % 4)
+    try:
+        timestamp, row_id = base64.urlsafe_b64decode(padded.encode('ascii')).decode('utf-8').rsplit('|', 1)
+        return timestamp, int(row_id)
+    except Exception:
+        raise ValueError("Cursor de paginacion invalido")
+
+# Cursor para pedir la pagina siguiente, o None si ya no hay mas filas
+def next_cursor(rows, page_size):
+    if not rows or len(rows) < page_size:
+        return None
+    last = rows[-1]
+    return encode_cursor(last['timestamp'], last['id'] if last['id'] is not None else MAX_ROW_ID)
@@ -0,0 +1,228 @@
+import asyncio
+import time
+from datetime import datetime, timedelta
+from .db_pool import pool
+from .db_writer import writer
+from .archive import get_archived_clients, prune_archived_before, run_archive
+from .compact_storage import delete_readings_before, get_layout, reading_client_ids
+from .hot_window import trim_before
+
+# Dias de retencion por defecto de cada tabla (None = conservar siempre)
+ARCHIVE_TABLE = 'sht3x_archive'  # Lecturas del archivo frio (ficheros por cliente y mes, no una tabla)
+RETENTION_DEFAULTS = {
+    'sht3x_data': 30,
+    ARCHIVE_TABLE: None,  # El archivo conserva el historico que ya ha salido de SQLite
+    'events': 90,
+    'sht3x_rollup_1m': 90,
+    'sht3x_rollup_1h': 730,
+    'sht3x_rollup_1d': 730,
+}
+
+# Configuracion de la tarea de retencion
+RETENTION_INTERVAL = 3600  # Segundos entre pasadas
+RETENTION_BATCH_SIZE = 500  # Filas borradas por transaccion para no retener el bloqueo de escritura
+RETENTION_PAUSE = 0.05  # Segundos entre lotes para dejar paso a la ingesta
+VACUUM_BATCH_PAGES = 256  # Paginas (1 MB con 4 KB) devueltas al sistema por transaccion
+
+_retention_task = None
+_last_report = None
+_retention_totals = {
+    'runs': 0,
+    'rows_deleted': 0,
+    'bytes_reclaimed': 0,
+}
+
+# Fecha de corte (inicio del dia) para conservar `days` dias; alinear al dia evita agregados parciales
+def cutoff_for(days):
+    return (datetime.now() - timedelta(days=days)).date().isoformat()
+
+# Obtener las politicas: valores por defecto y excepciones globales ('') o por cliente
+async def get_policies():
+    async with pool.reader() as conn:
+        async with conn.execute('SELECT table_name, client_id, retention_days FROM retention_policies') as cursor:
+            rows = await cursor.fetchall()
+    overrides = {(row['table_name'], row['client_id']): row['retention_days'] for row in rows}
+    policies = []
+    for table, default_days in RETENTION_DEFAULTS.items():
+        policies.append({
+            'table': table,
+            'client_id': None,
+            'retention_days': overrides.pop((table, ''), default_days),
+        })
+    for (table, client_id), days in sorted(overrides.items()):
+        policies.append({'table': table, 'client_id': client_id, 'retention_days': days})
+    return policies
+
+# Guardar una politica de retencion (days=None conserva los datos indefinidamente)
+async def set_policy(table, days, client_id=None):
+    if table not in RETENTION_DEFAULTS:
+        raise ValueError(f"Tabla sin politica de retencion: {table}")
+    if days is not None and (not isinstance(days, int) or days < 1):
+        raise ValueError("retention_days debe ser un entero positivo o null")
+    await writer.execute(
+        'INSERT OR REPLACE INTO retention_policies (table_name, client_id, retention_days) VALUES (?, ?, ?)',
+        (table, client_id or '', days)
+    )
+
+# Eliminar una excepcion y volver a la politica global o por defecto
+async def delete_policy(table, client_id=None):
+    return await writer.execute(
+        'DELETE FROM retention_policies WHERE table_name = ? AND client_id = ?',
+        (table, client_id or '')
+    ) > 0
+
+def _delete_batch(table, client_id, cutoff):
+    # Operacion del escritor que borra un lote de filas anteriores a la fecha de corte
+    async def operation(conn):
+        if table == 'sht3x_data':
+            deleted = await delete_readings_before(conn, client_id, cutoff, RETENTION_BATCH_SIZE)
+            trim_before(client_id, cutoff)
+            return deleted
+        if table == 'events':
+            query = '''
+                DELETE FROM events
+                WHERE id IN (SELECT id FROM events WHERE client_id = ? AND timestamp < ? ORDER BY timestamp LIMIT ?)
+            '''
+            params = (client_id, cutoff, RETENTION_BATCH_SIZE)
+        else:
+            # Los intervalos de los agregados son prefijos ISO y se comparan igual que los timestamps
+            query = f'''
+                DELETE FROM {table}
+                WHERE client_id = ? AND bucket IN (
+                    SELECT bucket FROM {table} WHERE client_id = ? AND bucket < ? ORDER BY bucket LIMIT ?)
+            '''
+            params = (client_id, client_id, cutoff, RETENTION_BATCH_SIZE)
+        cursor = await conn.execute(query, params)
+        deleted = cursor.rowcount
+        await cursor.close()
+        return deleted
+    return operation
+
+async def _pragma_value(conn, name):
+    async with conn.execute(f'PRAGMA {name}') as cursor:
+        row = await cursor.fetchone()
+    return row[0]
+
+async def incremental_vacuum(conn):
+    # Devolver un lote de paginas libres al sistema de archivos; devuelve las paginas liberadas.
+    # El modulo sqlite3 ejecuta un unico paso de la sentencia y cada paso libera una sola pagina
+    before = await _pragma_value(conn, 'page_count')
+    pages = min(VACUUM_BATCH_PAGES, await _pragma_value(conn, 'freelist_count'))
+    for _ in range(pages):
+        await conn.execute('PRAGMA incremental_vacuum')
+    return before - await _pragma_value(conn, 'page_count')
+
+# Aplicar las politicas de retencion y recuperar el espacio liberado
+async def run_retention():
+    global _last_report
+    start = time.monotonic()
+    report = {
+        'started_at': datetime.now().isoformat(),
+        'rows_deleted': {table: 0 for table in RETENTION_DEFAULTS if table != ARCHIVE_TABLE},
+        'archive_pruned': {'months_deleted': 0, 'rows_deleted': 0},
+        'pages_freed': 0,
+        'bytes_reclaimed': 0,
+    }
+
+    # Archivar primero: las lecturas que pasan al archivo frio no deben llegar a borrarse
+    try:
+        report['archive'] = await run_archive()
+    except Exception as e:
+        print(f"Error al archivar lecturas: {e}")
+        report['archive'] = {'error': str(e)}
+
+    policies = await get_policies()
+    global_days = {p['table']: p['retention_days'] for p in policies if p['client_id'] is None}
+    client_days = {(p['table'], p['client_id']): p['retention_days'] for p in policies if p['client_id'] is not None}
+    await get_layout()
+    async with pool.reader() as conn:
+        # Clientes con filas en cada tabla, tambien los que nunca se registraron
+        clients = {}
+        for table in RETENTION_DEFAULTS:
+            if table == ARCHIVE_TABLE:
+                clients[table] = await get_archived_clients()
+            elif table == 'sht3x_data':
+                clients[table] = await reading_client_ids(conn)
+            else:
+                async with conn.execute(f'SELECT DISTINCT client_id FROM {table}') as cursor:
+                    clients[table] = [row[0] for row in await cursor.fetchall()]
+        auto_vacuum = await _pragma_value(conn, 'auto_vacuum')
+        page_size = await _pragma_value(conn, 'page_size')
+
+    for table in RETENTION_DEFAULTS:
+        if table == 'sht3x_data' and 'error' in report['archive']:
+            continue
+        for client_id in clients[table]:
+            days = client_days.get((table, client_id), global_days[table])
+            if days is None:
+                continue
+            cutoff = cutoff_for(days)
+            if table == ARCHIVE_TABLE:
+                months, rows = await prune_archived_before(client_id, cutoff)
+                report['archive_pruned']['months_deleted'] += months
+                report['archive_pruned']['rows_deleted'] += rows
+                continue
+            while True:
+                deleted = await writer.run(_delete_batch(table, client_id, cutoff))
+                report['rows_deleted'][table] += deleted
+                if deleted < RETENTION_BATCH_SIZE:
+                    break
+                await asyncio.sleep(RETENTION_PAUSE)
+
+    # incremental_vacuum solo tiene efecto con auto_vacuum=INCREMENTAL (2); si no, las paginas se reutilizan
+    report['incremental_vacuum'] = auto_vacuum == 2
+    if auto_vacuum == 2:
+        while True:
+            freed = await writer.run(incremental_vacuum)
+            report['pages_freed'] += freed
+            if freed < VACUUM_BATCH_PAGES:
+                break
+            await asyncio.sleep(RETENTION_PAUSE)
+    report['bytes_reclaimed'] = report['pages_freed'] * page_size
+    report['finished_at'] = datetime.now().isoformat()
+    report['duration_ms'] = round((time.monotonic() - start) * 1000, 3)
+
+    _retention_totals['runs'] += 1
+    _retention_totals['rows_deleted'] += sum(report['rows_deleted'].values()) + report['archive_pruned']['rows_deleted']
+    _retention_totals['bytes_reclaimed'] += report['bytes_reclaimed']
+    _last_report = report
+    return report
+
+async def _retention_loop():
+    while True:
+        await asyncio.sleep(RETENTION_INTERVAL)
+        try:
+            report = await run_retention()
+            print(f"Retencion aplicada: {sum(report['rows_deleted'].values())} filas, {report['bytes_reclaimed']} bytes recuperados")
+        except Exception as e:
+            print(f"Error al aplicar la retencion: {e}")
+
+def _ensure_retention_task():
+    # Se ejecuta siempre dentro del bucle del pool
+    global _retention_task
+    if _retention_task is None or _retention_task.done():
+        _retention_task = asyncio.get_running_loop().create_task(_retention_loop())
+
+# Iniciar la tarea periodica de retencion en el bucle del pool
+def start_retention_task():
+    pool.loop.call_soon_threadsafe(_ensure_retention_task)
+
+async def _cancel_retention_task():
+    global _retention_task
+    if _retention_task is not None:
+        _retention_task.cancel()
+        _retention_task = None
+
+# Detener la tarea periodica de retencion
+async def stop_retention_task():
+    await pool.run(_cancel_retention_task())
+
+# Obtener el ultimo informe y los totales acumulados de la retencion
+def get_retention_status():
+    return {
+        'interval': RETENTION_INTERVAL,
+        'batch_size': RETENTION_BATCH_SIZE,
+        'running': _retention_task is not None and not _retention_task.done(),
+        'totals': dict(_retention_totals),
+        'last_run': _last_report,
+    }
@@ -0,0 +1,176 @@
+from .db_pool import pool
+from .db_writer import writer
+from .archive import get_archived_rows
+from .backfills import register_backfill
+
+# Resoluciones disponibles: tabla y longitud del prefijo ISO-8601 que define el intervalo
+# ('2024-05-01T13:45' para 1m, '2024-05-01T13' para 1h, '2024-05-01' para 1d)
+ROLLUP_RESOLUTIONS = {
+    '1m': ('sht3x_rollup_1m', 16),
+    '1h': ('sht3x_rollup_1h', 13),
+    '1d': ('sht3x_rollup_1d', 10),
+}
+
+ROLLUP_COLUMNS = (
+    'client_id, bucket, count, '
+    'temperature_min, temperature_max, temperature_sum, '
+    'humidity_min, humidity_max, humidity_sum'
+)
+
+# Agregar un lote de lecturas (client_id, timestamp, temperature, humidity) por intervalo
+def aggregate_readings(readings, prefix_len):
+    buckets = {}
+    for client_id, timestamp, temperature, humidity in readings:
+        key = (client_id, timestamp[:prefix_len])
+        agg = buckets.get(key)
+        if agg is None:
+            buckets[key] = [1, temperature, temperature, temperature, humidity, humidity, humidity]
+        else:
+            agg[0] += 1
+            agg[1] = min(agg[1], temperature)
+            agg[2] = max(agg[2], temperature)
+            agg[3] += temperature
+            agg[4] = min(agg[4], humidity)
+            agg[5] = max(agg[5], humidity)
+            agg[6] += humidity
+    return [(client_id, bucket, *agg) for (client_id, bucket), agg in buckets.items()]
+
+# Sentencia de actualizacion incremental de una tabla de agregados
+def upsert_statement(table):
+    return f'''
+        INSERT INTO {table} ({ROLLUP_COLUMNS})
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(client_id, bucket) DO UPDATE SET
+            count = count + excluded.count,
+            temperature_min = MIN(temperature_min, excluded.temperature_min),
+            temperature_max = MAX(temperature_max, excluded.temperature_max),
+            temperature_sum = temperature_sum + excluded.temperature_sum,
+            humidity_min = MIN(humidity_min, excluded.humidity_min),
+            humidity_max = MAX(humidity_max, excluded.humidity_max),
+            humidity_sum = humidity_sum + excluded.humidity_sum
+    '''
+
+# Sentencias para reconstruir los agregados desde los datos crudos (todos los clientes o uno).
+# Solo se reemplazan los intervalos posteriores al de la lectura cruda mas antigua de cada cliente:
+# el archivo y la retencion sacan de SQLite las lecturas anteriores a un corte, asi que ese intervalo
+# puede tener parte de sus lecturas fuera y los anteriores ya no tienen ninguna. Todos ellos
+# conservan el agregado calculado en la ingesta
+def rebuild_statements(client_id=None):
+    where = 'WHERE client_id = ?' if client_id else ''
+    params = (client_id, client_id) if client_id else ()
+    statements = []
+    for table, prefix_len in ROLLUP_RESOLUTIONS.values():
+        # '~' ordena despues de cualquier digito, 'T' o ':': los timestamps mayores estan en intervalos posteriores
+        statements.append((f'''
+            INSERT OR REPLACE INTO {table} ({ROLLUP_COLUMNS})
+            SELECT d.client_id, substr(d.timestamp, 1, {prefix_len}), COUNT(*),
+                   MIN(d.temperature), MAX(d.temperature), SUM(d.temperature),
+                   MIN(d.humidity), MAX(d.humidity), SUM(d.humidity)
+            FROM sht3x_data d
+            JOIN (SELECT client_id, MIN(timestamp) AS oldest FROM sht3x_data {where} GROUP BY client_id) o
+              ON o.client_id = d.client_id
+            WHERE d.timestamp > substr(o.oldest, 1, {prefix_len}) || '~'{' AND d.client_id = ?' if client_id else ''}
+            GROUP BY d.client_id, substr(d.timestamp, 1, {prefix_len})
+        ''', params))
+    return statements
+
+# Actualizar los agregados dentro de la transaccion en curso del escritor
+async def apply_rollups(conn, readings):
+    for table, prefix_len in ROLLUP_RESOLUTIONS.values():
+        await conn.executemany(upsert_statement(table), aggregate_readings(readings, prefix_len))
+
+# Reconstruir los agregados desde sht3x_data
+async def rebuild_rollups(client_id=None):
+    async def operation(conn):
+        for query, params in rebuild_statements(client_id):
+            await conn.execute(query, params)
+    await writer.run(operation)
+
+async def _rebuild_chunk(conn, last_id, limit):
+    # Recalcular los intervalos de las siguientes lecturas por id: minutos y horas desde los datos crudos
+    # (por el indice client_id, timestamp) y dias desde las horas. Cada intervalo se reemplaza entero
+    # con lo que hay en ese momento, asi que las lecturas que la ingesta guarda a la vez no se cuentan dos veces
+    async with conn.execute('''
+        SELECT id, client_id, timestamp FROM sht3x_data WHERE id > ? ORDER BY id LIMIT ?
+    ''', (last_id, limit)) as cursor:
+        rows = await cursor.fetchall()
+    if not rows:
+        return 0, last_id
+    for resolution in ('1m', '1h'):
+        table, prefix_len = ROLLUP_RESOLUTIONS[resolution]
+        buckets = {(row[1], row[2][:prefix_len]) for row in rows}
+        await conn.executemany(f'''
+            INSERT OR REPLACE INTO {table} ({ROLLUP_COLUMNS})
+            SELECT client_id, substr(timestamp, 1, {prefix_len}), COUNT(*),
+                   MIN(temperature), MAX(temperature), SUM(temperature),
+                   MIN(humidity), MAX(humidity), SUM(humidity)
+            FROM sht3x_data WHERE client_id = ? AND timestamp >= ? AND timestamp < ?
+            GROUP BY client_id, substr(timestamp, 1, {prefix_len})
+        ''', [(client_id, bucket, bucket + '~') for client_id, bucket in buckets])
+    days = {(row[1], row[2][:10]) for row in rows}
+    await conn.executemany(f'''
+        INSERT OR REPLACE INTO sht3x_rollup_1d ({ROLLUP_COLUMNS})
+        SELECT client_id, substr(bucket, 1, 10), SUM(count),
+               MIN(temperature_min), MAX(temperature_max), SUM(temperature_sum),
+               MIN(humidity_min), MAX(humidity_max), SUM(humidity_sum)
+        FROM sht3x_rollup_1h WHERE client_id = ? AND bucket >= ? AND bucket < ?
+        GROUP BY client_id, substr(bucket, 1, 10)
+    ''', [(client_id, day, day + '~') for client_id, day in days])
+    return len(rows), rows[-1][0]
+
+# Calculo inicial de los agregados de una base con lecturas anteriores a las tablas de agregados
+register_backfill('sht3x_rollup_rebuild', _rebuild_chunk)
+
+# Obtener los agregados de un cliente para una resolucion y un rango de fechas (prefijos ISO)
+async def get_rollups(client_id, resolution, start=None, end=None):
+    table, prefix_len = ROLLUP_RESOLUTIONS[resolution]
+    conditions = ['client_id = ?']
+    params = [client_id]
+    if start:
+        conditions.append('bucket >= ?')
+        params.append(start)
+    if end:
+        # '~' ordena despues de cualquier digito, 'T' o ':' y hace el limite superior inclusivo
+        conditions.append('bucket <= ?')
+        params.append(end + '~')
+    query = f'''
+        SELECT bucket, count,
+               temperature_min, temperature_max, temperature_sum / count AS temperature_avg,
+               humidity_min, humidity_max, humidity_sum / count AS humidity_avg
+        FROM {table}
+        WHERE {' AND '.join(conditions)}
+        ORDER BY bucket
+    '''
+    async with pool.reader() as conn:
+        async with conn.execute(query, params) as cursor:
+            data = await cursor.fetchall()
+        async with conn.execute(f'SELECT MIN(bucket) FROM {table} WHERE client_id = ?', (client_id,)) as cursor:
+            first_bucket = (await cursor.fetchone())[0]
+
+    # Los intervalos anteriores al primer agregado guardado (ya borrado por la retencion) se calculan
+    # desde el archivo frio
+    archive_end = end + '~' if end else None
+    if first_bucket is not None and (archive_end is None or archive_end >= first_bucket):
+        archive_end = first_bucket
+    archived = await get_archived_rows(client_id, start, archive_end, newest_first=False)
+    archived_buckets = [
+        row for row in aggregate_readings(
+            [(client_id, r['timestamp'], r['temperature'], r['humidity']) for r in archived], prefix_len)
+        if first_bucket is None or row[1] < first_bucket
+    ]
+    if not archived_buckets:
+        return data
+    return [
+        {
+            'bucket': bucket,
+            'count': count,
+            'temperature_min': temperature_min,
+            'temperature_max': temperature_max,
+            'temperature_avg': temperature_sum / count,
+            'humidity_min': humidity_min,
+            'humidity_max': humidity_max,
+            'humidity_avg': humidity_sum / count,
+        }
+        for _, bucket, count, temperature_min, temperature_max, temperature_sum,
+            humidity_min, humidity_max, humidity_sum in archived_buckets
+    ] + list(data)
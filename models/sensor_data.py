@@ -1,34 +1,35 @@
 import aiosqlite
-import os
 from datetime import datetime
-import time
 import asyncio
 import functools
-from typing import Dict, Any, Optional, List, Tuple
+from .db_pool import pool
+from .db_writer import writer
+from .archive import get_archived_page
+from .cache import MISSING, BoundedCache
+from .compact_storage import LAYOUT_COMPACT, get_layout, insert_readings, to_epoch_ms
+from .event import flush_events
+from .client_latest import upsert_latest_readings
+from .change_bus import CLIENT_DELETED, CLIENT_REGISTERED, THRESHOLDS_CHANGED, publish, subscribe
+from .dedup import is_duplicate, record_sequences, release
+from .hot_window import get_recent, record_inserted
+from .last_seen import flush_last_seen
+from .pagination import MAX_ROW_ID, decode_cursor, encode_cursor
+from .retention import stop_retention_task
+from .rollups import apply_rollups
 
 # Cach� para par�metros ideales
-_ideal_params_cache: Dict[Tuple[str, str], Dict[str, Any]] = {}
-_cache_expiry: Dict[Tuple[str, str], float] = {}
-CACHE_DURATION = 60  # Duraci�n de la cach� en segundos
-
-# Conectar a la base de datos
-async def get_db_connection():
-    db_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'sensor_data.db')
-    conn = await aiosqlite.connect(db_path, timeout=30)
-    await conn.execute('PRAGMA journal_mode=WAL;')
-    await conn.execute('PRAGMA synchronous=NORMAL;')
-    conn.row_factory = aiosqlite.Row
-    await conn.commit()
-    return conn
+CACHE_DURATION = 3600  # Duraci�n de la cach� en segundos (los cambios llegan por el bus de cambios)
+CACHE_NEGATIVE_DURATION = 60  # Segundos que se recuerda que un cliente no tiene par�metros de un tipo
+CACHE_MAX_SIZE = 1024  # Entradas (cliente, tipo) como m�ximo
+_ideal_params_cache = BoundedCache('ideal_params', CACHE_MAX_SIZE, ttl=CACHE_DURATION,
+                                   negative_ttl=CACHE_NEGATIVE_DURATION)
 
 async def execute_query_with_retry(query, params=(), retries=5, delay=1):
     for attempt in range(retries):
         try:
-            conn = await get_db_connection()
-            async with conn.execute(query, params) as cursor:
-                result = await cursor.fetchall()
-            await conn.commit()
-            await conn.close()
+            async with pool.reader() as conn:
+                async with conn.execute(query, params) as cursor:
+                    result = await cursor.fetchall()
             return result
         except aiosqlite.OperationalError as e:
             if "database is locked" in str(e) and attempt < retries - 1:
@@ -36,80 +37,175 @@ async def execute_query_with_retry(query, params=(), retries=5, delay=1):
             else:
                 raise
 
-async def execute_write_query_with_retry(query, params=(), retries=5, delay=1):
-    for attempt in range(retries):
-        try:
-            conn = await get_db_connection()
-            await conn.execute(query, params)
-            await conn.commit()
-            await conn.close()
-            return
-        except aiosqlite.OperationalError as e:
-            if "database is locked" in str(e) and attempt < retries - 1:
-                await asyncio.sleep(delay)
-            else:
-                raise
+# Las escrituras pasan por el escritor unico, que las agrupa en transacciones
+async def execute_write_query(query, params=()):
+    return await writer.execute(query, params)
 
 # Funci�n para agrupar m�ltiples inserciones
-async def batch_insert_sht3x_data(data_list):
+# `seqs` (opcional) trae la secuencia del dispositivo de cada lectura, o None si no la tiene.
+# Devuelve las lecturas guardadas (sin las reentregas descartadas)
+async def batch_insert_sht3x_data(data_list, seqs=None):
     if not data_list:
-        return
+        return []
+    if seqs is not None and all(seq is None for seq in seqs):
+        seqs = None
     
-    conn = await get_db_connection()
-    try:
-        await conn.executemany(
-            'INSERT INTO sht3x_data (client_id, timestamp, temperature, humidity) VALUES (?, ?, ?, ?)',
-            data_list
-        )
-        await conn.commit()
-    finally:
-        await conn.close()
-
-# Buffer para acumular datos antes de inserci�n
-_sht3x_buffer: List[Tuple[str, str, float, float]] = []
-_last_flush_time = time.time()
-MAX_BUFFER_SIZE = 10
-MAX_BUFFER_TIME = 5  # segundos
-
-# Guardar datos del sht3x en la base de datos (con buffer)
-async def save_sht3x_data(client_id, temperature, humidity):
-    global _sht3x_buffer, _last_flush_time
-    
-    timestamp = datetime.now().isoformat()
-    _sht3x_buffer.append((client_id, timestamp, temperature, humidity))
-    
-    current_time = time.time()
-    should_flush = (
-        len(_sht3x_buffer) >= MAX_BUFFER_SIZE or 
-        current_time - _last_flush_time > MAX_BUFFER_TIME
-    )
+    # Insertar las lecturas y actualizar los agregados y el estado actual en la misma transaccion
+    async def operation(conn):
+        readings = data_list
+        if seqs is not None:
+            # El indice unico de ingest_sequences descarta las reentregas que no estaban en memoria
+            readings, _ = await record_sequences(conn, data_list, seqs)
+            if not readings:
+                return readings, None
+        ids = await insert_readings(conn, readings)
+        await apply_rollups(conn, readings)
+        await upsert_latest_readings(conn, readings)
+        return readings, ids
     
-    if should_flush:
-        buffer_copy = _sht3x_buffer.copy()
-        _sht3x_buffer = []
-        _last_flush_time = current_time
-        await batch_insert_sht3x_data(buffer_copy)
+    await get_layout()
+    try:
+        readings, ids = await writer.run(operation)
+    except Exception:
+        if seqs is not None:
+            release([(reading[0], seq) for reading, seq in zip(data_list, seqs) if seq is not None])
+        raise
+    # La ventana en memoria solo recibe lecturas ya confirmadas: un commit fallido no deja filas fantasma
+    record_inserted(readings, ids)
+    return readings
+
+# Guardar un micro-lote de la ingesta MQTT en una sola operacion del escritor.
+# `readings` son tuplas (client_id, timestamp, temperatura, humedad, secuencia o None);
+# descarta las reentregas ya vistas y devuelve las lecturas guardadas
+async def save_sht3x_batch(readings):
+    data_list, seqs = [], []
+    for client_id, timestamp, temperature, humidity, seq in readings:
+        if seq is not None and await is_duplicate(client_id, seq):
+            continue
+        data_list.append((client_id, timestamp, temperature, humidity))
+        seqs.append(seq)
+    return await batch_insert_sht3x_data(data_list, seqs)
+
+# Condicion para seguir en SQLite por debajo de una fila de la ventana en memoria
+def _older_than(row, compact):
+    if row is None:
+        return '', ()
+    if compact:
+        return ' AND id < ?', (row['id'],)
+    return ' AND (timestamp, id) < (?, ?)', (row['timestamp'], row['id'] or MAX_ROW_ID)
 
-# Obtener todos los datos de sht3x desde la base de datos
+# Obtener todos los datos de sht3x (las paginas recientes salen de la ventana en memoria)
 async def get_all_sht3x_data(client_id, page, page_size):
-    query = '''
+    offset = (page - 1) * page_size
+    recent = await get_recent(client_id) or []
+    result = recent[offset:offset + page_size]
+    if len(result) == page_size:
+        return result
+
+    # Continuar en SQLite por debajo de la lectura mas antigua de la ventana.
+    # En la distribucion compacta el id es el epoch en ms y recorre la clave primaria en orden
+    compact = await get_layout() == LAYOUT_COMPACT
+    order = 'id DESC' if compact else 'timestamp DESC, id DESC'
+    where, params = _older_than(recent[-1] if recent else None, compact)
+    query = f'''
         SELECT * FROM sht3x_data 
-        WHERE client_id = ? 
-        ORDER BY timestamp DESC 
+        WHERE client_id = ?{where} 
+        ORDER BY {order} 
         LIMIT ? OFFSET ?
     '''
-    params = (client_id, page_size, (page - 1) * page_size)
+    skip = max(offset - len(recent), 0)
+    result = result + list(await execute_query_with_retry(query, (client_id, *params, page_size - len(result), skip)))
+    if len(result) < page_size:
+        # Completar con el archivo frio, cuyas lecturas son anteriores a todas las de SQLite
+        if result:
+            hot_count = offset + len(result)
+        else:
+            count = await execute_query_with_retry(f'SELECT COUNT(*) FROM sht3x_data WHERE client_id = ?{where}',
+                                                   (client_id, *params))
+            hot_count = len(recent) + count[0][0]
+        result = result + await get_archived_page(client_id, max(offset - hot_count, 0), page_size - len(result))
+    return result
+
+# Obtener datos de sht3x con paginacion por cursor (ventana en memoria y despues el indice client_id, timestamp)
+async def get_sht3x_data_after(client_id, after, page_size):
+    result = []
+    recent = await get_recent(client_id)
+    if recent:
+        if after:
+            timestamp, row_id = decode_cursor(after)
+            if await get_layout() == LAYOUT_COMPACT:
+                recent = [row for row in recent if row['id'] < row_id]
+            else:
+                recent = [row for row in recent if (row['timestamp'], row['id'] or MAX_ROW_ID) < (timestamp, row_id)]
+        result = recent[:page_size]
+    if len(result) < page_size:
+        # Seguir en SQLite a partir de la lectura mas antigua servida desde memoria
+        hot_after = after
+        if result:
+            hot_after = encode_cursor(result[-1]['timestamp'], result[-1]['id'] or MAX_ROW_ID)
+        result = result + list(await _get_hot_sht3x_data_after(client_id, hot_after, page_size - len(result)))
+    if len(result) < page_size:
+        # Seguir por el archivo frio a partir del cursor (o desde su lectura mas reciente)
+        before = None
+        if after:
+            timestamp, _ = decode_cursor(after)
+            before = to_epoch_ms(timestamp)
+        result = result + await get_archived_page(client_id, 0, page_size - len(result), before)
+    return result
+
+async def _get_hot_sht3x_data_after(client_id, after, page_size):
+    if await get_layout() == LAYOUT_COMPACT:
+        return await _get_compact_sht3x_data_after(client_id, after, page_size)
+    if after:
+        timestamp, row_id = decode_cursor(after)
+        query = '''
+            SELECT * FROM sht3x_data 
+            WHERE client_id = ? AND (timestamp, id) < (?, ?) 
+            ORDER BY timestamp DESC, id DESC 
+            LIMIT ?
+        '''
+        params = (client_id, timestamp, row_id, page_size)
+    else:
+        query = '''
+            SELECT * FROM sht3x_data 
+            WHERE client_id = ? 
+            ORDER BY timestamp DESC, id DESC 
+            LIMIT ?
+        '''
+        params = (client_id, page_size)
+    result = await execute_query_with_retry(query, params)
+    return result
+
+# En la distribucion compacta basta con buscar por id (epoch en ms) sobre la clave (client_key, ts)
+async def _get_compact_sht3x_data_after(client_id, after, page_size):
+    if after:
+        _, row_id = decode_cursor(after)
+        query = '''
+            SELECT * FROM sht3x_data 
+            WHERE client_id = ? AND id < ? 
+            ORDER BY id DESC 
+            LIMIT ?
+        '''
+        params = (client_id, row_id, page_size)
+    else:
+        query = '''
+            SELECT * FROM sht3x_data 
+            WHERE client_id = ? 
+            ORDER BY id DESC 
+            LIMIT ?
+        '''
+        params = (client_id, page_size)
     result = await execute_query_with_retry(query, params)
     return result
 
 # Obtener parametros ideales desde la base de datos (con cach�)
 async def get_ideal_params(client_id, param_type):
     cache_key = (client_id, param_type)
-    current_time = time.time()
     
-    # Verificar si los datos est�n en cach� y son v�lidos
-    if cache_key in _ideal_params_cache and current_time < _cache_expiry.get(cache_key, 0):
-        return _ideal_params_cache[cache_key]
+    # Verificar si los datos est�n en cach� y son v�lidos (tambi�n si se sabe que no existen)
+    cached = _ideal_params_cache.get(cache_key)
+    if cached is not MISSING:
+        return cached
     
     # Consultar la base de datos
     query = '''
@@ -120,12 +216,8 @@ async def get_ideal_params(client_id, param_type):
     params = (client_id, param_type)
     result = await execute_query_with_retry(query, params)
     
-    if result:
-        # Guardar en cach� 
-        _ideal_params_cache[cache_key] = dict(result[0])
-        _cache_expiry[cache_key] = current_time + CACHE_DURATION
-        return _ideal_params_cache[cache_key]
-    return None
+    # Guardar en cach� (None como resultado negativo)
+    return _ideal_params_cache.set(cache_key, dict(result[0]) if result else None)
 
 # Actualizar parametros ideales en la base de datos (y cach�)
 async def update_ideal_params(client_id, param_type, min_value, max_value):
@@ -137,21 +229,31 @@ async def update_ideal_params(client_id, param_type, min_value, max_value):
     '''
     timestamp = datetime.now().isoformat()
     params = (min_value, max_value, timestamp, client_id, param_type)
-    await execute_write_query_with_retry(query, params)
-    
-    # Actualizar cach� 
-    cache_key = (client_id, param_type)
-    _ideal_params_cache[cache_key] = {
-        'client_id': client_id,
-        'param_type': param_type,
-        'min_value': min_value,
-        'max_value': max_value,
-        'timestamp': timestamp
-    }
-    _cache_expiry[cache_key] = time.time() + CACHE_DURATION
+    await execute_write_query(query, params)
+    publish(THRESHOLDS_CHANGED, client_id, param_type=param_type, min_value=min_value,
+            max_value=max_value, timestamp=timestamp)
+
+# Mantener la cach� de par�metros ideales al d�a con los cambios confirmados
+def _on_change(change):
+    if change.kind == THRESHOLDS_CHANGED:
+        cache_key = (change.client_id, change.data['param_type'])
+        _ideal_params_cache.set(cache_key, {
+            'client_id': change.client_id,
+            'param_type': change.data['param_type'],
+            'min_value': change.data['min_value'],
+            'max_value': change.data['max_value'],
+            'timestamp': change.data['timestamp']
+        })
+    else:
+        # Cliente nuevo (par�metros por defecto) o eliminado
+        _ideal_params_cache.discard_where(lambda key: key[0] == change.client_id)
+
+subscribe((THRESHOLDS_CHANGED, CLIENT_REGISTERED, CLIENT_DELETED), _on_change)
 
 # Limpiar buffer y cerrar conexiones antes de salir
 async def cleanup():
-    if _sht3x_buffer:
-        await batch_insert_sht3x_data(_sht3x_buffer.copy())
-        _sht3x_buffer.clear()
+    await flush_events()
+    await flush_last_seen()
+    await stop_retention_task()
+    await writer.close()
+    await pool.close()
@@ -1,29 +1,58 @@
 import paho.mqtt.client as mqtt
-from models.sensor_data import save_sht3x_data, get_ideal_params
+from models.sensor_data import save_sht3x_batch
 from models.event import save_event
-from models.client import update_client_status, register_client, client_exists
+from models.client import register_client, client_exists
 import time
-from models.actuator import update_actuator_state, get_actuator_state, get_actuator_by_name
-from models.app_state import get_app_state
+from models.actuator import update_actuator_state
+from models.cache import MISSING, BoundedCache
+from models.change_bus import CLIENT_DELETED, subscribe
+from models.client_runtime import get_client_runtime, load_client_runtimes
+from models.last_seen import mark_clients_seen
 import asyncio
 import re
 from collections import defaultdict
 from functools import lru_cache
 import threading
+from ingest import IngestConsumer, IngestQueue
+from ingest_workers import INGEST_WORKERS, IngestWorkerPool, shard_of
+from payloads import PayloadError, parse_registration, parse_sht3x_binary, parse_sht3x_text
+from topic_router import TopicHandler, TopicRouter
 
 client = None
-client_last_events = {}  # Diccionario para rastrear el �ltimo evento por cliente y tipo
-client_actuator_cache = {}  # Cach� de actuadores por cliente
-client_status_update_time = {}  # �ltimo momento en que se actualiz� el estado de un cliente
 
-# L�mite de tiempo para actualizar el estado del cliente (segundos)
-CLIENT_STATUS_UPDATE_INTERVAL = 60
+# L�mite de tiempo entre eventos de un mismo tipo para un cliente (segundos)
+CLIENT_EVENT_INTERVAL = 60
+# Clientes recordados como m�ximo para el throttling (los menos activos se olvidan)
+CLIENT_THROTTLE_MAX_SIZE = 4096
+
+# Throttling por cliente: una entrada dura lo que su intervalo, despu�s se vuelve a escribir
+client_last_events = BoundedCache('client_last_events', 2 * CLIENT_THROTTLE_MAX_SIZE,
+                                  ttl=CLIENT_EVENT_INTERVAL)  # (cliente, tipo) -> �ltimo evento
+
+# Olvidar el throttling de eventos de un cliente eliminado
+def _forget_client(change):
+    client_last_events.discard_where(lambda key: key[0] == change.client_id)
+
+subscribe((CLIENT_DELETED,), _forget_client)
 
 # Bucle de eventos para operaciones asincronas
 loop = None
 loop_thread = None
 loop_ready = threading.Event()
 
+# Particion (indice, total) que procesa este proceso cuando es un worker de ingesta; None en el servidor
+shard = None
+# Workers de ingesta lanzados por el servidor en modo multiproceso (INGEST_WORKERS > 0)
+worker_pool = None
+
+# Mensajes que la politica latest_per_client puede sustituir por uno mas reciente del mismo topico
+def _reading_key(item):
+    route = router.match(item[0])
+    return item[0] if route is not None and route[1].coalesce else None
+
+# Cola acotada de mensajes crudos y su consumidor por micro-lotes
+ingest_queue = IngestQueue(coalesce_key=_reading_key)
+
 # Extraer client_id del t�pico con regex compilado para mayor eficiencia
 _client_id_pattern = re.compile(r'clients/([^/]+)/')
 
@@ -33,134 +62,184 @@ def extract_client_id(topic):
         return match.group(1)
     return None
 
-# Funcion para ejecutar corrutinas en el bucle de eventos
-def run_coroutine(coro):
-    global loop
-    if loop and loop.is_running():
-        asyncio.run_coroutine_threadsafe(coro, loop)
-    else:
-        print("Error: El bucle de eventos no esta en ejecucion")
-
-# Manejo de mensajes optimizado
+# El callback de paho solo encola el mensaje crudo: el analisis, las escrituras y las
+# reglas de control se hacen por micro-lotes en el consumidor de la ingesta
 def on_message(client, userdata, msg):
-    try:
-        # Extraer el client_id del t�pico
+    if shard is not None:
+        # Worker de ingesta: solo los clientes de su particion
         client_id = extract_client_id(msg.topic)
-        if not client_id:
-            print(f"No se pudo extraer client_id del topico: {msg.topic}")
+        if client_id is None or shard_of(client_id, shard[1]) != shard[0]:
             return
-        
-        # Actualizar estado del cliente con throttling
-        current_time = time.time()
-        if (client_id not in client_status_update_time or 
-            current_time - client_status_update_time.get(client_id, 0) > CLIENT_STATUS_UPDATE_INTERVAL):
-            run_coroutine(update_client_status(client_id))
-            client_status_update_time[client_id] = current_time
-        
-        # Procesar el mensaje seg�n el t�pico
-        if msg.topic == f'clients/{client_id}/sensor/sht3x':
-            data = msg.payload.decode('utf-8', errors='ignore').split(',')
-            if len(data) == 2:
-                run_coroutine(handle_sht3x_message(client_id, data))
-        elif msg.topic == f'clients/{client_id}/register':
-            data = msg.payload.decode('utf-8', errors='ignore').split(',')
-            if len(data) >= 2:
-                name = data[0]
-                description = data[1] if len(data) > 1 else ""
-                run_coroutine(register_client(client_id, name, description))
-        else:
-            print(f"Topico no reconocido: {msg.topic}")
+    ingest_queue.put((msg.topic, msg.payload, time.time()))
+
+# Ejecutar un micro-lote en el bucle de eventos y esperar a que termine (desde el hilo consumidor)
+def run_ingest_batch(coro):
+    if loop and loop.is_running():
+        return asyncio.run_coroutine_threadsafe(coro, loop).result()
+    coro.close()
+    raise RuntimeError("El bucle de eventos no esta en ejecucion")
+
+class IngestWrites:
+    """
+    Escrituras de la ingesta. En un worker de ingesta se sustituyen por
+    RemoteWrites (ingest_workers.py), que las ejecuta en el proceso del servidor.
+    """
+    OPERATIONS = ('save_sht3x_batch', 'register_client', 'mark_clients_seen',
+                  'save_event', 'update_actuator_state')
+    save_sht3x_batch = staticmethod(save_sht3x_batch)
+    register_client = staticmethod(register_client)
+    mark_clients_seen = staticmethod(mark_clients_seen)
+    save_event = staticmethod(save_event)
+    update_actuator_state = staticmethod(update_actuator_state)
+
+writes = IngestWrites()
+
+# Convertir este proceso en el worker `index` de `workers`: solo procesa los clientes de su
+# particion y envia las escrituras al servidor con `remote_writes`
+def configure_worker(index, workers, remote_writes):
+    global shard, writes
+    shard = (index, workers)
+    writes = remote_writes
+
+# Procesar un micro-lote de mensajes: cada mensaje se analiza con el parser de su manejador,
+# cada sink guarda de una vez todo lo del lote y se actualiza el estado de los clientes
+async def process_ingest_batch(batch):
+    pending = defaultdict(list)
+    clients = {}
+    for topic, payload, received in batch:
+        route = router.match(topic)
+        if route is None:
+            print(f"Topico no reconocido: {topic}")
+            continue
+        client_id, handler = route
+        clients[client_id] = received
+        try:
+            pending[handler.sink].extend(handler.parse(client_id, payload, received))
+        except PayloadError as e:
+            print(f"Payload {handler.name} no valido de {client_id}: {e}")
+        except Exception as e:
+            # Un mensaje que no se puede interpretar no debe hacer fallar el lote de los demas clientes
+            print(f"Error al interpretar el payload {handler.name} de {client_id}: {e}")
+    
+    # En orden de registro de los manejadores: los clientes nuevos se registran antes que sus lecturas
+    for sink in router.sinks:
+        if pending.get(sink):
+            await sink(pending[sink])
+    
+    # Ultima conexion de los clientes del lote: se guarda en memoria y se escribe
+    # para todos los clientes a la vez cada LAST_SEEN_FLUSH_INTERVAL segundos
+    try:
+        await writes.mark_clients_seen(clients)
     except Exception as e:
-        print(f'Error al procesar el mensaje: {e}')
+        print(f"Error procesando lote de ingesta: {e}")
+
+# Sink de los registros de clientes
+async def store_registrations(registrations):
+    for client_id, name, description in registrations:
+        try:
+            await writes.register_client(client_id, name, description)
+        except Exception as e:
+            print(f"Error al registrar el cliente {client_id}: {e}")
+
+# Sink de las lecturas SHT3x: una sola operacion del escritor para todo el lote (sin reentregas)
+# y las reglas de control una vez por cliente
+async def store_sht3x_readings(readings):
+    saved = await writes.save_sht3x_batch(readings)
+    by_client = defaultdict(list)
+    for client_id, _, temperatura, humedad in saved:
+        by_client[client_id].append((temperatura, humedad))
+    await asyncio.gather(*(evaluate_client_rules(client_id, values) for client_id, values in by_client.items()))
 
-async def handle_sht3x_message(client_id, data):
+# Reglas de control de un cliente para las lecturas (temperatura, humedad) de un lote, en orden
+async def evaluate_client_rules(client_id, values):
     try:
-        temperatura, humedad = float(data[0]), float(data[1])
-        
-        # Guardar datos en la base (ahora con buffer)
-        await save_sht3x_data(client_id, temperatura, humedad)
-        
         # Verificar eventos con throttling
         current_time = time.time()
         
-        # Inicializar entradas para este cliente si no existen
-        if client_id not in client_last_events:
-            client_last_events[client_id] = {'temp': 0, 'hum': 0}
-        
-        # Obtener par�metros ideales (ahora con cach�)
-        ideal_temp_params = await get_ideal_params(client_id, 'temperatura')
-        ideal_humidity_params = await get_ideal_params(client_id, 'humedad')
-        
-        if not ideal_temp_params or not ideal_humidity_params:
+        # Umbrales, modo y actuadores del cliente en memoria (sin consultas a SQLite)
+        runtime = await get_client_runtime(client_id)
+        if 'temperatura' not in runtime.thresholds or 'humedad' not in runtime.thresholds:
             return
         
-        min_temp = ideal_temp_params['min_value']
-        max_temp = ideal_temp_params['max_value']
-        min_humidity = ideal_humidity_params['min_value']
-        max_humidity = ideal_humidity_params['max_value']
+        min_temp, max_temp = runtime.thresholds['temperatura']
+        min_humidity, max_humidity = runtime.thresholds['humedad']
         
-        # Verificar temperatura con throttling
-        if not (min_temp <= temperatura <= max_temp):
-            if current_time - client_last_events[client_id]['temp'] > 60:
-                await save_event(
+        # Verificar temperatura con throttling (primera lectura del lote fuera de rango)
+        temperatura = next((t for t, _ in values if not (min_temp <= t <= max_temp)), None)
+        if temperatura is not None:
+            if client_last_events.get((client_id, 'temp')) is MISSING:
+                await writes.save_event(
                     client_id, 
                     f"Advertencia! Temperatura fuera de rango: {temperatura} C (Ideal: {min_temp}-{max_temp} C)", 
                     "temperatura"
                 )
-                client_last_events[client_id]['temp'] = current_time
+                client_last_events.set((client_id, 'temp'), current_time)
         
-        # Verificar humedad con throttling
-        if not (min_humidity <= humedad <= max_humidity):
-            if current_time - client_last_events[client_id]['hum'] > 60:
-                await save_event(
+        # Verificar humedad con throttling (primera lectura del lote fuera de rango)
+        humedad = next((h for _, h in values if not (min_humidity <= h <= max_humidity)), None)
+        if humedad is not None:
+            if client_last_events.get((client_id, 'hum')) is MISSING:
+                await writes.save_event(
                     client_id, 
                     f"Advertencia! Humedad fuera de rango: {humedad} % (Ideal: {min_humidity}-{max_humidity} %)", 
                     "humedad"
                 )
-                client_last_events[client_id]['hum'] = current_time
+                client_last_events.set((client_id, 'hum'), current_time)
         
-        # Verificar modo autom�tico y actualizar actuadores
-        app_state = await get_app_state(client_id)
-        if app_state == 'automatico':
-            await update_actuators(client_id, temperatura, humedad)
+        # Verificar modo autom�tico y actualizar actuadores con la lectura mas reciente
+        if runtime.mode == 'automatico':
+            await update_actuators(runtime, *values[-1])
     except Exception as e:
         print(f"Error procesando mensaje SHT3x: {e}")
 
-# Funci�n para obtener y almacenar en cach� los actuadores
-async def get_cached_actuator(client_id, name):
-    # Usar cach� si est� disponible
-    cache_key = f"{client_id}_{name}"
-    if cache_key in client_actuator_cache:
-        return client_actuator_cache[cache_key]
-    
-    # Obtener de la base de datos
-    actuator = await get_actuator_by_name(client_id, name)
-    if actuator:
-        client_actuator_cache[cache_key] = actuator
-    
-    return actuator
+# Manejadores de los topicos de los clientes. Un nuevo tipo de sensor solo necesita
+# registrar aqui su parser y su sink
+router = TopicRouter()
+router.register(TopicHandler('registro', 'register', parse_registration, store_registrations))
+router.register(TopicHandler('SHT3x', 'sensor/sht3x', parse_sht3x_text, store_sht3x_readings, coalesce=True))
+router.register(TopicHandler('SHT3x binario', 'sensor/sht3x/bin', parse_sht3x_binary, store_sht3x_readings))
+
+# Consumidor de la cola de ingesta (se inicia con el cliente MQTT)
+ingest_consumer = IngestConsumer(ingest_queue, process_ingest_batch, run_ingest_batch)
 
-async def update_actuators(client_id, temperature, humidity):
+# Obtener los contadores de la cola de ingesta y de sus micro-lotes
+def get_ingest_queue_metrics():
+    if worker_pool is not None:
+        return worker_pool.get_metrics()
+    return ingest_consumer.get_metrics()
+
+# Senal de salud de la ingesta ('ok', 'degraded' o 'shedding')
+def get_ingest_health():
+    if worker_pool is not None:
+        return worker_pool.get_health()
+    return ingest_queue.get_health()
+
+# Contadores de las caches de cada worker de ingesta (None si la ingesta es de este proceso)
+def get_worker_cache_metrics():
+    if worker_pool is not None:
+        return worker_pool.get_cache_metrics()
+    return None
+
+# Cambiar la politica con la cola llena (block, drop_oldest o latest_per_client); ValueError si no es valida
+def set_ingest_policy(policy):
+    ingest_queue.set_policy(policy)
+    if worker_pool is not None:
+        worker_pool.set_policy(policy)
+    print(f"Politica de la cola de ingesta: {policy}")
+
+async def update_actuators(runtime, temperature, humidity):
     try:
-        # Obtener par�metros ideales (cach�)
-        ideal_temp_params = await get_ideal_params(client_id, 'temperatura')
-        ideal_humidity_params = await get_ideal_params(client_id, 'humedad')
-        
-        if not ideal_temp_params or not ideal_humidity_params:
-            return
-        
-        min_temp = ideal_temp_params['min_value']
-        max_temp = ideal_temp_params['max_value']
-        min_humidity = ideal_humidity_params['min_value']
-        max_humidity = ideal_humidity_params['max_value']
+        client_id = runtime.client_id
+        min_temp, max_temp = runtime.thresholds['temperatura']
+        min_humidity, max_humidity = runtime.thresholds['humedad']
         
-        # Obtener actuadores con cach�
-        light_actuator = await get_cached_actuator(client_id, "Iluminacion")
-        fan_actuator = await get_cached_actuator(client_id, "Ventilacion")
-        humidifier_actuator = await get_cached_actuator(client_id, "Humidificador")
-        motor_actuator = await get_cached_actuator(client_id, "Motor")
+        # Actuadores del cliente en memoria
+        light_actuator = runtime.actuator_ids.get("Iluminacion")
+        fan_actuator = runtime.actuator_ids.get("Ventilacion")
+        humidifier_actuator = runtime.actuator_ids.get("Humidificador")
+        motor_actuator = runtime.actuator_ids.get("Motor")
         
-        if not all([light_actuator, fan_actuator, humidifier_actuator, motor_actuator]):
+        if None in (light_actuator, fan_actuator, humidifier_actuator, motor_actuator):
             return
         
         # Lista para todas las tareas de actualizaci�n
@@ -169,62 +248,44 @@ async def update_actuators(client_id, temperature, humidity):
         # Acciones para temperatura
         if temperature < min_temp:
             # Temperatura baja: encender luz
-            all_tasks.append(update_actuator_and_log(client_id, light_actuator['id'], 'true', "Temperatura baja, encendiendo luz", f'clients/{client_id}/light'))
-            all_tasks.append(update_actuator_and_log(client_id, fan_actuator['id'], 'false', "Ventilador apagado", f'clients/{client_id}/fan'))
+            all_tasks.append(update_actuator_and_log(runtime, light_actuator, 'true', "Temperatura baja, encendiendo luz", f'clients/{client_id}/light'))
+            all_tasks.append(update_actuator_and_log(runtime, fan_actuator, 'false', "Ventilador apagado", f'clients/{client_id}/fan'))
         elif temperature > max_temp:
             # Temperatura alta: encender ventilador
-            all_tasks.append(update_actuator_and_log(client_id, light_actuator['id'], 'false', "Luz apagada", f'clients/{client_id}/light'))
-            all_tasks.append(update_actuator_and_log(client_id, fan_actuator['id'], 'true', "Temperatura alta, encendiendo ventilador", f'clients/{client_id}/fan'))
+            all_tasks.append(update_actuator_and_log(runtime, light_actuator, 'false', "Luz apagada", f'clients/{client_id}/light'))
+            all_tasks.append(update_actuator_and_log(runtime, fan_actuator, 'true', "Temperatura alta, encendiendo ventilador", f'clients/{client_id}/fan'))
         else:
             # Temperatura normal: apagar ambos
-            all_tasks.append(update_actuator_and_log(client_id, light_actuator['id'], 'false', "Temperatura normal, luz apagada", f'clients/{client_id}/light'))
-            all_tasks.append(update_actuator_and_log(client_id, fan_actuator['id'], 'false', "Temperatura normal, ventilador apagado", f'clients/{client_id}/fan'))
+            all_tasks.append(update_actuator_and_log(runtime, light_actuator, 'false', "Temperatura normal, luz apagada", f'clients/{client_id}/light'))
+            all_tasks.append(update_actuator_and_log(runtime, fan_actuator, 'false', "Temperatura normal, ventilador apagado", f'clients/{client_id}/fan'))
         
         # Acciones para humedad
         if humidity < min_humidity:
             # Humedad baja: encender humidificador
-            all_tasks.append(update_actuator_and_log(client_id, humidifier_actuator['id'], 'true', "Humedad baja, encendiendo humidificador", f'clients/{client_id}/humidifier'))
-            all_tasks.append(update_actuator_and_log(client_id, motor_actuator['id'], 'false', "Motor apagado", f'clients/{client_id}/motor'))
+            all_tasks.append(update_actuator_and_log(runtime, humidifier_actuator, 'true', "Humedad baja, encendiendo humidificador", f'clients/{client_id}/humidifier'))
+            all_tasks.append(update_actuator_and_log(runtime, motor_actuator, 'false', "Motor apagado", f'clients/{client_id}/motor'))
         elif humidity > max_humidity:
             # Humedad alta: encender motor
-            all_tasks.append(update_actuator_and_log(client_id, humidifier_actuator['id'], 'false', "Humidificador apagado", f'clients/{client_id}/humidifier'))
-            all_tasks.append(update_actuator_and_log(client_id, motor_actuator['id'], 'true', "Humedad alta, encendiendo motor", f'clients/{client_id}/motor'))
+            all_tasks.append(update_actuator_and_log(runtime, humidifier_actuator, 'false', "Humidificador apagado", f'clients/{client_id}/humidifier'))
+            all_tasks.append(update_actuator_and_log(runtime, motor_actuator, 'true', "Humedad alta, encendiendo motor", f'clients/{client_id}/motor'))
         else:
             # Humedad normal: apagar ambos
-            all_tasks.append(update_actuator_and_log(client_id, humidifier_actuator['id'], 'false', "Humedad normal, humidificador apagado", f'clients/{client_id}/humidifier'))
-            all_tasks.append(update_actuator_and_log(client_id, motor_actuator['id'], 'false', "Humedad normal, motor apagado", f'clients/{client_id}/motor'))
+            all_tasks.append(update_actuator_and_log(runtime, humidifier_actuator, 'false', "Humedad normal, humidificador apagado", f'clients/{client_id}/humidifier'))
+            all_tasks.append(update_actuator_and_log(runtime, motor_actuator, 'false', "Humedad normal, motor apagado", f'clients/{client_id}/motor'))
         
         # Ejecutar todas las tareas en paralelo
         await asyncio.gather(*all_tasks)
     except Exception as e:
         print(f"Error actualizando actuadores: {e}")
 
-# Cach� para el estado del actuador
-_actuator_state_cache = {}
-_actuator_last_update = {}
-ACTUATOR_CACHE_DURATION = 5  # Segundos
-
-async def update_actuator_and_log(client_id, actuator_id, state, description, topic):
+async def update_actuator_and_log(runtime, actuator_id, state, description, topic):
     try:
-        # Verificar si el cambio es necesario usando cach�
-        cache_key = f"{client_id}_{actuator_id}"
-        current_time = time.time()
+        client_id = runtime.client_id
         
-        # Si el estado est� en cach� y es reciente, usarlo
-        if (cache_key in _actuator_state_cache and
-            current_time - _actuator_last_update.get(cache_key, 0) < ACTUATOR_CACHE_DURATION):
-            current_state = _actuator_state_cache[cache_key]
-        else:
-            # Obtener de la base de datos
-            current_state = await get_actuator_state(client_id, actuator_id)
-            # Actualizar cach�
-            _actuator_state_cache[cache_key] = current_state
-            _actuator_last_update[cache_key] = current_time
-        
-        # Actualizar s�lo si es necesario
-        if current_state != state:
+        # Actualizar s�lo si es necesario (estado en memoria)
+        if runtime.actuator_states.get(actuator_id) != state:
             # Primero actualizar la base de datos
-            await update_actuator_state(client_id, actuator_id, state)
+            await writes.update_actuator_state(client_id, actuator_id, state)
             
             # Luego publicar el mensaje MQTT inmediatamente
             message = str(state).lower()
@@ -232,12 +293,11 @@ async def update_actuator_and_log(client_id, actuator_id, state, description, to
                 client.publish(topic, message, qos=1)  # QoS 1 para asegurar al menos una entrega
                 print(f"Publicando mensaje MQTT - Topico: {topic}, Mensaje: {message}")
             
-            # Actualizar cach�
-            _actuator_state_cache[cache_key] = state
-            _actuator_last_update[cache_key] = current_time
+            # En un worker de ingesta la escritura se hace en el servidor: actualizar tambien aqui
+            runtime.actuator_states[actuator_id] = state
             
             # Guardar evento
-            await save_event(client_id, description, "actuador")
+            await writes.save_event(client_id, description, "actuador")
     except Exception as e:
         print(f"Error en update_actuator_and_log: {e}")
 
@@ -289,16 +349,34 @@ def run_event_loop():
 
 # Configuraci�n del cliente MQTT
 def connect_mqtt():
-    global client, loop, loop_thread
+    global client, loop, loop_thread, worker_pool
     
     # Iniciar bucle de eventos asincrono en un hilo separado
-    loop = asyncio.new_event_loop()
-    loop_thread = threading.Thread(target=run_event_loop, daemon=True)
-    loop_thread.start()
+    if loop is None:
+        loop = asyncio.new_event_loop()
+        loop_thread = threading.Thread(target=run_event_loop, daemon=True)
+        loop_thread.start()
     
     # Esperar a que el bucle este listo
     loop_ready.wait()
     
+    # Cargar de una vez el estado de control de todos los clientes
+    try:
+        count = asyncio.run_coroutine_threadsafe(load_client_runtimes(), loop).result()
+        print(f"Estado de control cargado para {count} clientes")
+    except Exception as e:
+        print(f"Error cargando el estado de los clientes (se cargara bajo demanda): {e}")
+    
+    if shard is None and INGEST_WORKERS > 0:
+        # Modo multiproceso: los workers reciben y procesan los mensajes y este proceso hace sus escrituras
+        if worker_pool is None:
+            worker_pool = IngestWorkerPool(INGEST_WORKERS, IngestWrites(),
+                                           lambda coro: asyncio.run_coroutine_threadsafe(coro, loop))
+            worker_pool.start()
+    else:
+        # Iniciar el consumidor de la cola de ingesta
+        ingest_consumer.start()
+    
     # Configurar cliente MQTT
     client = mqtt.Client()
     client.on_message = on_message
@@ -309,9 +387,11 @@ def connect_mqtt():
     try:
         client.connect('localhost', 1883, 60)
         
-        # Suscribirse a todos los t�picos de clientes
-        client.subscribe('clients/+/sensor/sht3x')
-        client.subscribe('clients/+/register')
+        # Suscribirse a todos los t�picos de clientes (en modo multiproceso lo hacen los workers;
+        # este cliente solo publica los cambios de actuadores de la API)
+        if worker_pool is None:
+            for subscription in router.subscriptions():
+                client.subscribe(subscription)
         
         client.loop_start()
         print("Cliente MQTT inicializado y suscrito a topicos de multiples clientes")
@@ -325,10 +405,17 @@ def connect_mqtt():
 def cleanup():
     global client, loop
     
+    # Los workers vacian sus colas mientras este proceso sigue atendiendo sus escrituras
+    if worker_pool is not None:
+        worker_pool.stop()
+    
     if client:
         client.loop_stop()
         client.disconnect()
         
+    # Procesar los mensajes que quedan en la cola antes de detener el bucle
+    ingest_consumer.stop()
+    
     if loop:
         for task in asyncio.all_tasks(loop):
             task.cancel()
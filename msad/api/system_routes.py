@@ -1,7 +1,10 @@
 """
 System routes module for MSAD - Status and general system endpoints
 """
-from flask import Blueprint, jsonify
+from flask import Blueprint, jsonify, request
+from msad.core.system import (
+    logger, get_maintenance_status, set_maintenance_policy, run_maintenance_operation
+)
 
 def create_system_blueprint():
     """
@@ -19,4 +22,35 @@ def create_system_blueprint():
             "status": "running"
         })
 
+    @system_bp.route('/msad/maintenance', methods=['GET'])
+    def get_maintenance():
+        """Endpoint to get the database maintenance policy and operation timings"""
+        return jsonify({"success": True, **get_maintenance_status()})
+
+    @system_bp.route('/msad/maintenance', methods=['PUT'])
+    def update_maintenance():
+        """Endpoint to update the database maintenance policy"""
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            return jsonify({"success": False, "error": "Se esperaba un objeto JSON"}), 400
+        try:
+            policy = set_maintenance_policy(data)
+            return jsonify({"success": True, "policy": policy})
+        except ValueError as e:
+            return jsonify({"success": False, "error": str(e)}), 400
+        except Exception as e:
+            logger.error(f"Error updating maintenance policy: {str(e)}")
+            return jsonify({"success": False, "error": str(e)}), 500
+
+    @system_bp.route('/msad/maintenance/<operation>', methods=['POST'])
+    def run_maintenance(operation):
+        """Endpoint to run a maintenance operation immediately"""
+        try:
+            result = run_maintenance_operation(operation)
+            return jsonify({"success": True, **result})
+        except ValueError as e:
+            return jsonify({"success": False, "error": str(e)}), 404
+        except Exception as e:
+            return jsonify({"success": False, "error": str(e)}), 500
+
     return system_bp
\ No newline at end of file
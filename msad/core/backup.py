@@ -21,6 +21,18 @@ is_running = False
 interval_hours = 24  # Valor por defecto y global
 last_backup_time = None
 
+def _archive_module():
+    # El archivo frío de lecturas vive en models; MSAD puede ejecutarse sin él
+    try:
+        from models import archive
+        return archive
+    except ImportError:
+        return None
+
+def _archive_backup_path(backup_path):
+    """Ruta de la copia del archivo frío que acompaña a un backup de la base de datos"""
+    return backup_path[:-len(".db")] + ".archive.tar"
+
 def init_backup_system():
     """
     Inicializa el sistema de backups
@@ -88,6 +100,25 @@ def create_backup(manual=False):
                 "error": "Error al crear archivo de backup"
             }
         
+        # Copiar el archivo frío después de la base de datos: una lectura que se archive entre las dos
+        # copias queda en ambas (y el archivado no la duplica), pero nunca en ninguna
+        archive_filename = None
+        archive = _archive_module()
+        if archive is not None:
+            archive_path = _archive_backup_path(backup_path)
+            try:
+                archive.export_archive(archive_path)
+            except Exception as e:
+                logger.error(f"Error al copiar el archivo frío: {str(e)}")
+                for path in (backup_path, archive_path):
+                    if os.path.exists(path):
+                        os.remove(path)
+                return {
+                    "success": False,
+                    "error": f"Error al copiar el archivo frío: {str(e)}"
+                }
+            archive_filename = os.path.basename(archive_path)
+        
         # Obtener tamaño del backup
         backup_size = os.path.getsize(backup_path)
         
@@ -103,6 +134,7 @@ def create_backup(manual=False):
             "path": backup_path,
             "size": backup_size,
             "type": backup_type,
+            "archive": archive_filename,
             "created_at": datetime.datetime.now().isoformat(),
             "download_url": f"/api/msad/backups/download/{backup_filename}"
         }
@@ -246,6 +278,10 @@ def delete_backup(filename):
             
         os.remove(backup_path)
         
+        archive_path = _archive_backup_path(backup_path)
+        if os.path.exists(archive_path):
+            os.remove(archive_path)
+        
         logger.info(f"Backup eliminado: {backup_path}")
         
         return {
@@ -322,6 +358,14 @@ def restore_backup(filename):
         # Restaurar (copiar el backup sobre la base de datos actual)
         shutil.copy2(backup_path, db_path)
         
+        # Restaurar también el archivo frío con las lecturas que ya no están en la base de datos
+        archive = _archive_module()
+        archive_path = _archive_backup_path(backup_path)
+        if archive is not None and os.path.exists(archive_path):
+            archive.import_archive(archive_path)
+        elif archive is not None:
+            logger.warning(f"El backup {filename} no incluye el archivo frío; se conserva el actual")
+        
         logger.info(f"Backup {filename} restaurado correctamente")
         
         return {
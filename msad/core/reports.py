@@ -11,6 +11,25 @@ import schedule
 
 # --- Configuración global para el programador de reportes por cliente ---
 REPORT_SCHEDULERS = {}
+
+def _archived_sensor_rows(client_id, start_timestamp=None, end_timestamp=None):
+    """
+    Obtener las lecturas del cliente movidas al archivo columnar (storage/archive).
+    Devuelve una lista vacia si el modulo de archivo no esta disponible.
+    """
+    try:
+        from models.archive import read_archived_rows
+    except ImportError:
+        return []
+    return read_archived_rows(client_id, start_timestamp, end_timestamp)
+
+def _archived_sensor_count(client_id):
+    """Contar las lecturas archivadas del cliente (0 si el archivo no esta disponible)"""
+    try:
+        from models.archive import count_archived_rows
+    except ImportError:
+        return 0
+    return count_archived_rows(client_id)
 # Estructura de cada entrada:
 # {
 #   'thread': threading.Thread,
@@ -69,10 +88,17 @@ def generate_report(client_id, start_date, end_date, data_type="sensors", format
         except Exception as e:
             logger.error(f"Error al consultar la base de datos: {e}")
             return {"success": False, "error": "Error al consultar la base de datos"}
-        if not check_result or check_result[0]['count'] == 0:
+        total_count = check_result[0]['count'] if check_result else 0
+        if data_type == "sensors":
+            # Las lecturas antiguas pueden estar en el archivo columnar en lugar de SQLite
+            try:
+                total_count += _archived_sensor_count(client_id)
+            except Exception as e:
+                logger.error(f"Error al consultar el archivo de lecturas: {e}")
+        if total_count == 0:
             logger.warning(f"No se encontraron datos para el cliente {client_id} en la tabla {table}")
             return {"success": False, "error": f"No hay datos registrados para el cliente {client_id}"}
-        logger.info(f"Se encontraron {check_result[0]['count']} registros en total para el cliente {client_id}")
+        logger.info(f"Se encontraron {total_count} registros en total para el cliente {client_id}")
 
         # Consultar datos para el rango
         start_timestamp = start_dt.strftime("%Y-%m-%d %H:%M:%S")
@@ -85,6 +111,12 @@ def generate_report(client_id, start_date, end_date, data_type="sensors", format
             return {"success": False, "error": "Error al consultar la base de datos"}
         if data is None:
             return {"success": False, "error": "Error al consultar la base de datos"}
+        if data_type == "sensors":
+            try:
+                data.extend(_archived_sensor_rows(client_id, start_timestamp, end_timestamp))
+            except Exception as e:
+                logger.error(f"Error al leer el archivo de lecturas: {e}")
+                return {"success": False, "error": "Error al leer el archivo de lecturas"}
         if not data:
             logger.info(f"No se encontraron datos para el cliente {client_id} en el rango especificado")
             return {"success": False, "error": "No se encontraron datos para el rango especificado"}
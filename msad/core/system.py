@@ -4,7 +4,13 @@ Funciones básicas del sistema MSAD
 import os
 import logging
 import datetime
+import json
+import pathlib
+import queue
 import sqlite3
+import threading
+import time
+from contextlib import contextmanager
 
 # Configuración básica - cambiamos la ruta a una carpeta 'storage' en la raíz del proyecto
 project_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -32,6 +38,365 @@ def get_database_path():
     else:  # Linux
         return os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "sensor_data.db")
 
+# Configuración del pool de lectura de MSAD (reportes)
+READ_POOL_SIZE = 2  # Conexiones de solo lectura simultáneas
+READ_POOL_TIMEOUT = 30  # Segundos máximos esperando una conexión libre
+READ_CACHE_KB = 16384  # Caché de páginas por conexión (16 MB)
+READ_MMAP_SIZE = 268435456  # Lectura por mmap (hasta 256 MB de espacio virtual)
+
+class ReadOnlyPool:
+    """
+    Pool acotado de conexiones sqlite3 de solo lectura (`mode=ro`, `query_only`)
+    compartido por los hilos de MSAD, con sus propias métricas
+    """
+
+    def __init__(self, size=READ_POOL_SIZE):
+        self.size = size
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._created = 0
+        self._in_use = 0
+        self._acquisitions = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._timeouts = 0
+        self._errors = 0
+
+    def _open(self):
+        uri = pathlib.Path(get_database_path()).resolve().as_uri() + '?mode=ro'
+        conn = sqlite3.connect(uri, uri=True, timeout=30, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA query_only=1')
+        conn.execute(f'PRAGMA cache_size=-{READ_CACHE_KB}')
+        conn.execute(f'PRAGMA mmap_size={READ_MMAP_SIZE}')
+        return conn
+
+    @contextmanager
+    def connection(self):
+        """Adquirir una conexión de solo lectura: `with read_pool.connection() as conn`"""
+        start = time.monotonic()
+        conn = None
+        with self._lock:
+            create = self._idle.empty() and self._created < self.size
+            if create:
+                self._created += 1
+        if create:
+            try:
+                conn = self._open()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+        else:
+            try:
+                conn = self._idle.get(timeout=READ_POOL_TIMEOUT)
+            except queue.Empty:
+                with self._lock:
+                    self._timeouts += 1
+                raise TimeoutError("No hay conexiones de lectura libres")
+
+        waited = time.monotonic() - start
+        with self._lock:
+            self._acquisitions += 1
+            self._wait_total += waited
+            self._wait_max = max(self._wait_max, waited)
+            self._in_use += 1
+        try:
+            yield conn
+        except sqlite3.Error:
+            with self._lock:
+                self._errors += 1
+            raise
+        finally:
+            with self._lock:
+                self._in_use -= 1
+            self._idle.put(conn)
+
+    def get_metrics(self):
+        """Obtener una instantánea de las métricas del pool"""
+        with self._lock:
+            acquisitions = self._acquisitions
+            return {
+                'mode': 'ro',
+                'size': self.size,
+                'open': self._created,
+                'in_use': self._in_use,
+                'idle': self._idle.qsize(),
+                'acquisitions': acquisitions,
+                'avg_wait_ms': round(self._wait_total / acquisitions * 1000, 3) if acquisitions else 0.0,
+                'max_wait_ms': round(self._wait_max * 1000, 3),
+                'timeouts': self._timeouts,
+                'errors': self._errors,
+            }
+
+    def close(self):
+        """Cerrar las conexiones inactivas"""
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            with self._lock:
+                self._created -= 1
+            conn.close()
+
+# Pool de lectura compartido por las consultas de MSAD
+read_pool = ReadOnlyPool()
+
+def get_read_pool_metrics():
+    """Obtener las métricas del pool de lectura de MSAD"""
+    return read_pool.get_metrics()
+
+# Política de mantenimiento de la base de datos (intervalos en segundos; None desactiva la operación)
+MAINTENANCE_POLICY_FILE = os.path.join(STORAGE_PATH, "maintenance_policy.json")
+DEFAULT_MAINTENANCE_POLICY = {
+    "check_interval": 30,  # Segundos entre comprobaciones
+    "passive_checkpoint_interval": 60,  # Checkpoint PASSIVE: no bloquea al escritor, se hace siempre
+    "truncate_checkpoint_interval": 3600,  # Checkpoint TRUNCATE (vacía el WAL), solo en periodos tranquilos
+    "optimize_interval": 21600,  # PRAGMA optimize, solo en periodos tranquilos
+    "analyze_interval": 604800,  # ANALYZE acotado por analysis_limit, solo en periodos tranquilos
+    "vacuum_interval": 3600,  # incremental_vacuum de las páginas libres, solo en periodos tranquilos
+    "quiet_writes_per_minute": 30,  # Escrituras por minuto por debajo de las que el sistema está tranquilo
+    "analysis_limit": 1000,  # Filas examinadas por índice en ANALYZE
+}
+# El checkpoint PASSIVE no se puede desactivar: mientras el mantenimiento está en marcha el escritor
+# tiene wal_autocheckpoint=0
+MAINTENANCE_OPERATIONS = {
+    "passive_checkpoint": "passive_checkpoint_interval",
+    "truncate_checkpoint": "truncate_checkpoint_interval",
+    "optimize": "optimize_interval",
+    "analyze": "analyze_interval",
+    "incremental_vacuum": "vacuum_interval",
+}
+TRUNCATE_BUSY_TIMEOUT_MS = 1000  # Espera máxima del TRUNCATE a que terminen lectores y escritor
+
+maintenance_policy = dict(DEFAULT_MAINTENANCE_POLICY)
+_maintenance_thread = None
+_maintenance_stop = threading.Event()
+_maintenance_lock = threading.Lock()  # Una sola operación de mantenimiento a la vez
+_maintenance_stats = {}
+_maintenance_started = {}  # Instante (monotonic) de la última ejecución programada de cada operación
+_last_write_sample = None  # (instante, escrituras enviadas al escritor)
+_last_quiet = None
+
+def _load_maintenance_policy():
+    """Cargar la política guardada (si existe) sobre los valores por defecto"""
+    policy = dict(DEFAULT_MAINTENANCE_POLICY)
+    try:
+        if os.path.exists(MAINTENANCE_POLICY_FILE):
+            with open(MAINTENANCE_POLICY_FILE, "r") as f:
+                saved = json.load(f)
+            policy.update({key: value for key, value in saved.items() if key in DEFAULT_MAINTENANCE_POLICY})
+    except Exception as e:
+        logger.error(f"Error al cargar la política de mantenimiento: {str(e)}")
+    return policy
+
+def set_maintenance_policy(updates):
+    """
+    Actualizar la política de mantenimiento y guardarla; lanza ValueError si no es válida
+    """
+    for key, value in updates.items():
+        if key not in DEFAULT_MAINTENANCE_POLICY:
+            raise ValueError(f"Opción de mantenimiento desconocida: {key}")
+        optional = key.endswith("_interval") and key not in ("check_interval", "passive_checkpoint_interval")
+        if value is None and optional:
+            continue
+        if not isinstance(value, int) or isinstance(value, bool) or value < 1:
+            raise ValueError(f"{key} debe ser un entero positivo" + (" o null" if optional else ""))
+    maintenance_policy.update(updates)
+    os.makedirs(STORAGE_PATH, exist_ok=True)
+    with open(MAINTENANCE_POLICY_FILE, "w") as f:
+        json.dump(maintenance_policy, f, indent=2)
+    logger.info(f"Política de mantenimiento actualizada: {updates}")
+    return dict(maintenance_policy)
+
+def _writer():
+    # El escritor único vive en models; MSAD puede ejecutarse sin él
+    try:
+        from models.db_writer import writer
+        return writer
+    except ImportError:
+        return None
+
+def _is_quiet():
+    """Periodo tranquilo: cola del escritor vacía y pocas escrituras desde la última comprobación"""
+    global _last_write_sample
+    writer = _writer()
+    if writer is None:
+        return True
+    metrics = writer.get_metrics()
+    now = time.monotonic()
+    previous, _last_write_sample = _last_write_sample, (now, metrics["submitted"])
+    if previous is None or metrics["pending"] > 0:
+        return False
+    elapsed = now - previous[0]
+    rate = (metrics["submitted"] - previous[1]) / elapsed * 60 if elapsed > 0 else float("inf")
+    return rate < maintenance_policy["quiet_writes_per_minute"]
+
+def _checkpoint(mode):
+    # Conexión propia, fuera del escritor: PASSIVE copia el WAL sin tomar el bloqueo de escritura
+    conn = sqlite3.connect(get_database_path(), timeout=0, isolation_level=None)
+    try:
+        if mode == "TRUNCATE":
+            conn.execute(f"PRAGMA busy_timeout={TRUNCATE_BUSY_TIMEOUT_MS}")
+        busy, log_frames, checkpointed = conn.execute(f"PRAGMA wal_checkpoint({mode})").fetchone()
+    finally:
+        conn.close()
+    return {"busy": bool(busy), "wal_frames": log_frames, "checkpointed_frames": checkpointed}
+
+def _run_in_writer(statements):
+    # ANALYZE y optimize escriben en sqlite_stat1: se serializan con el resto de escrituras
+    writer = _writer()
+    if writer is None:
+        raise RuntimeError("El escritor de la base de datos no está disponible")
+
+    async def operation(conn):
+        for statement in statements:
+            await conn.execute(statement)
+    writer.submit(operation).result(timeout=300)
+    return {}
+
+def _set_writer_autocheckpoint(pages=None):
+    # 0 mientras el mantenimiento hace los checkpoints; None vuelve al valor por defecto del pool
+    writer = _writer()
+    if writer is None:
+        return
+    from models.db_pool import WRITER_AUTOCHECKPOINT, pool
+    if pages is None:
+        pages = WRITER_AUTOCHECKPOINT
+
+    async def operation(conn):
+        await conn.execute(f"PRAGMA wal_autocheckpoint={pages}")
+        pool.writer_autocheckpoint = pages
+    try:
+        writer.submit(operation).result(timeout=30)
+    except Exception as e:
+        logger.error(f"Error al cambiar el checkpoint automático del escritor: {str(e)}")
+
+def _incremental_vacuum():
+    writer = _writer()
+    if writer is None:
+        raise RuntimeError("El escritor de la base de datos no está disponible")
+    from models.retention import VACUUM_BATCH_PAGES, incremental_vacuum
+    pages = 0
+    while not _maintenance_stop.is_set():
+        freed = writer.submit(incremental_vacuum).result(timeout=300)
+        pages += freed
+        if freed < VACUUM_BATCH_PAGES:
+            break
+        time.sleep(0.05)
+    return {"pages_freed": pages}
+
+def _execute_maintenance(name):
+    if name == "passive_checkpoint":
+        return _checkpoint("PASSIVE")
+    if name == "truncate_checkpoint":
+        return _checkpoint("TRUNCATE")
+    if name == "optimize":
+        return _run_in_writer(["PRAGMA optimize"])
+    if name == "analyze":
+        return _run_in_writer([f"PRAGMA analysis_limit={maintenance_policy['analysis_limit']}", "ANALYZE"])
+    return _incremental_vacuum()
+
+def run_maintenance_operation(name):
+    """
+    Ejecutar una operación de mantenimiento y registrar su duración
+    """
+    if name not in MAINTENANCE_OPERATIONS:
+        raise ValueError(f"Operación de mantenimiento desconocida: {name}")
+    with _maintenance_lock:
+        stats = _maintenance_stats.setdefault(name, {
+            "runs": 0, "failures": 0, "total_ms": 0.0, "max_ms": 0.0,
+            "last_ms": None, "last_run": None, "last_result": None, "last_error": None,
+        })
+        start = time.monotonic()
+        stats["last_run"] = datetime.datetime.now().isoformat()
+        try:
+            result = _execute_maintenance(name)
+            stats["last_result"] = result
+            stats["last_error"] = None
+        except Exception as e:
+            stats["failures"] += 1
+            stats["last_error"] = str(e)
+            logger.error(f"Error en el mantenimiento {name}: {str(e)}")
+            raise
+        finally:
+            elapsed = round((time.monotonic() - start) * 1000, 3)
+            stats["runs"] += 1
+            stats["total_ms"] += elapsed
+            stats["max_ms"] = max(stats["max_ms"], elapsed)
+            stats["last_ms"] = elapsed
+    return {"operation": name, "duration_ms": elapsed, **result}
+
+def _maintenance_due(name, now):
+    interval = maintenance_policy[MAINTENANCE_OPERATIONS[name]]
+    if interval is None:
+        return False
+    last = _maintenance_started.get(name)
+    return last is None or now - last >= interval
+
+def _maintenance_loop():
+    global _last_quiet
+    # La primera pasada de las operaciones pesadas espera un intervalo completo desde el arranque
+    started = time.monotonic()
+    for name in MAINTENANCE_OPERATIONS:
+        if name != "passive_checkpoint":
+            _maintenance_started.setdefault(name, started)
+    while not _maintenance_stop.wait(maintenance_policy["check_interval"]):
+        quiet = _is_quiet()
+        _last_quiet = quiet
+        for name in MAINTENANCE_OPERATIONS:
+            now = time.monotonic()
+            if _maintenance_stop.is_set() or not _maintenance_due(name, now):
+                continue
+            if name != "passive_checkpoint" and not quiet:
+                continue
+            _maintenance_started[name] = now
+            try:
+                run_maintenance_operation(name)
+            except Exception:
+                pass  # Ya registrado; se reintenta en el siguiente intervalo
+
+def start_maintenance_scheduler():
+    """Iniciar el hilo de mantenimiento de la base de datos"""
+    global _maintenance_thread, maintenance_policy
+    if _maintenance_thread is not None and _maintenance_thread.is_alive():
+        return True
+    maintenance_policy = _load_maintenance_policy()
+    _maintenance_stop.clear()
+    _maintenance_thread = threading.Thread(target=_maintenance_loop, name="msad-maintenance", daemon=True)
+    _maintenance_thread.start()
+    # Solo con el mantenimiento en marcha se quitan los checkpoints automáticos del escritor
+    _set_writer_autocheckpoint(0)
+    logger.info("Mantenimiento de la base de datos iniciado")
+    return True
+
+def stop_maintenance_scheduler():
+    """Detener el hilo de mantenimiento (espera a que termine la operación en curso)"""
+    global _maintenance_thread
+    _maintenance_stop.set()
+    if _maintenance_thread is not None and _maintenance_thread.is_alive():
+        _maintenance_thread.join(timeout=10)
+    if _maintenance_thread is not None:
+        _set_writer_autocheckpoint()
+    _maintenance_thread = None
+
+def get_maintenance_status():
+    """Obtener la política, el estado del hilo y la duración de cada operación"""
+    operations = {}
+    for name in MAINTENANCE_OPERATIONS:
+        stats = dict(_maintenance_stats.get(name, {}))
+        if stats.get("runs"):
+            stats["avg_ms"] = round(stats["total_ms"] / stats["runs"], 3)
+            stats["total_ms"] = round(stats["total_ms"], 3)
+        operations[name] = stats
+    return {
+        "running": _maintenance_thread is not None and _maintenance_thread.is_alive(),
+        "quiet": _last_quiet,
+        "policy": dict(maintenance_policy),
+        "operations": operations,
+    }
+
 def ensure_directories():
     """Crear estructura de directorios necesaria"""
     # Directorio base
@@ -79,6 +444,9 @@ def init_msad(auto_backup=False, backup_interval_hours=24):
             else:
                 logger.warning("No se pudo iniciar el sistema de backups automáticos")
         
+        # Mantenimiento de la base de datos (checkpoints, ANALYZE/optimize, vacuum incremental)
+        start_maintenance_scheduler()
+
         logger.info("MSAD iniciado correctamente")
         return {
             "success": True,
@@ -98,6 +466,12 @@ def shutdown_msad():
     logger.info("Deteniendo MSAD")
     
     try:
+        # Detener el mantenimiento antes de que se cierre el escritor
+        stop_maintenance_scheduler()
+
+        # Cerrar las conexiones de lectura
+        read_pool.close()
+
         # Detener programador de backups si está en ejecución
         try:
             from msad.core.backup import stop_backup_scheduler
@@ -123,33 +497,34 @@ def execute_query(query, params=(), fetchall=True):
     Ejecutar consulta en la base de datos
     """
     try:
+        logger.info(f"Ejecutando consulta: {query}")
+
+        if fetchall:
+            # Las lecturas usan el pool de solo lectura y nunca bloquean al escritor
+            try:
+                with read_pool.connection() as conn:
+                    results = conn.execute(query, params).fetchall()
+            except sqlite3.Error as sql_error:
+                logger.error(f"Error SQL específico: {str(sql_error)}, Consulta: {query}, Parámetros: {params}")
+                return None
+            processed_results = [dict(row) for row in results]
+            logger.info(f"Consulta exitosa, {len(processed_results)} resultados obtenidos")
+            return processed_results
+
         db_path = get_database_path()
         logger.info(f"Conectando a base de datos: {db_path}")
-        logger.info(f"Ejecutando consulta: {query}")
-        
         conn = sqlite3.connect(db_path)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        
         try:
-            cursor.execute(query, params)
-            
-            if fetchall:
-                results = cursor.fetchall()
-                processed_results = [dict(row) for row in results]
-                logger.info(f"Consulta exitosa, {len(processed_results)} resultados obtenidos")
-                conn.close()
-                return processed_results
-            else:
-                conn.commit()
-                logger.info("Consulta de escritura exitosa")
-                conn.close()
-                return True
+            conn.execute(query, params)
+            conn.commit()
+            logger.info("Consulta de escritura exitosa")
+            return True
         except sqlite3.Error as sql_error:
             logger.error(f"Error SQL específico: {str(sql_error)}, Consulta: {query}, Parámetros: {params}")
-            conn.close()
             return None
-            
+        finally:
+            conn.close()
+
     except Exception as e:
         logger.error(f"Error en consulta SQL: {str(e)}, Consulta: {query}, Parámetros: {params}")
         return None
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""
+Formatos de payload de las lecturas del sensor SHT3x.
+
+- Texto en `clients/<id>/sensor/sht3x`: "temperatura,humedad[,secuencia]", una lectura por mensaje.
+- Binario en `clients/<id>/sensor/sht3x/bin`: un lote de lecturas con su hora, empaquetadas
+  con struct (little-endian):
+
+    cabecera   <BBHQ   version (1), flags, numero de lecturas, epoch base en ms
+    lectura    <IhH    desplazamiento en ms sobre la base, temperatura y humedad en centesimas
+               <IhHI   ... y la secuencia del dispositivo, si flags tiene BINARY_FLAG_SEQ
+
+  Con epoch base 0 (dispositivo sin reloj) la ultima lectura toma la hora de recepcion
+  y las demas se colocan segun su desplazamiento.
+- Registro en `clients/<id>/register`: "nombre,descripcion".
+"""
+import struct
+from datetime import datetime
+from models.dedup import parse_sequence
+
+BINARY_VERSION = 1
+BINARY_FLAG_SEQ = 0x01  # Cada lectura lleva su secuencia (uint32)
+BINARY_MAX_READINGS = 65535
+
+_HEADER = struct.Struct('<BBHQ')
+_READING = struct.Struct('<IhH')
+_READING_SEQ = struct.Struct('<IhHI')
+
+
+class PayloadError(ValueError):
+    """Payload con formato no valido (el mensaje se descarta)"""
+
+
+# Payload de texto: una lectura (client_id, timestamp, temperatura, humedad, secuencia o None)
+def parse_sht3x_text(client_id, payload, received):
+    data = payload.decode('utf-8', errors='ignore').split(',')
+    if len(data) not in (2, 3):
+        raise PayloadError(f"se esperaban 2 o 3 campos: {data}")
+    try:
+        temperatura, humedad = float(data[0]), float(data[1])
+    except ValueError:
+        raise PayloadError(f"valores no validos: {data}")
+    seq = parse_sequence(data[2]) if len(data) > 2 else None
+    return [(client_id, datetime.fromtimestamp(received).isoformat(), temperatura, humedad, seq)]
+
+# Payload binario: todas las lecturas del lote, desempaquetadas de una vez con struct
+def parse_sht3x_binary(client_id, payload, received):
+    if len(payload) < _HEADER.size:
+        raise PayloadError("payload binario demasiado corto")
+    version, flags, count, base_ms = _HEADER.unpack_from(payload)
+    if version != BINARY_VERSION:
+        raise PayloadError(f"version de payload binario no soportada: {version}")
+    record = _READING_SEQ if flags & BINARY_FLAG_SEQ else _READING
+    body = memoryview(payload)[_HEADER.size:]
+    if len(body) != count * record.size:
+        raise PayloadError(f"se esperaban {count} lecturas de {record.size} bytes y hay {len(body)} bytes")
+    if not count:
+        return []
+
+    rows = list(record.iter_unpack(body))
+    if not base_ms:
+        base_ms = int(received * 1000) - max(row[0] for row in rows)
+    fromtimestamp = datetime.fromtimestamp
+    try:
+        if record is _READING_SEQ:
+            return [(client_id, fromtimestamp((base_ms + offset) / 1000).isoformat(), temp / 100, hum / 100, seq)
+                    for offset, temp, hum, seq in rows]
+        return [(client_id, fromtimestamp((base_ms + offset) / 1000).isoformat(), temp / 100, hum / 100, None)
+                for offset, temp, hum in rows]
+    except (ValueError, OverflowError, OSError) as e:
+        # Epoch base o desplazamiento fuera del rango de fechas representable
+        raise PayloadError(f"hora de lectura no valida (epoch base {base_ms} ms): {e}")
+
+# Payload de registro: (client_id, nombre, descripcion)
+def parse_registration(client_id, payload, received):
+    data = payload.decode('utf-8', errors='ignore').split(',')
+    if len(data) < 2:
+        raise PayloadError(f"se esperaba 'nombre,descripcion': {data}")
+    return [(client_id, data[0], data[1])]
+
+# Empaquetar lecturas (epoch en segundos, temperatura, humedad[, secuencia]) en el formato binario.
+# Lo usan los nodos cliente en Python; con `clock=False` se envian sin hora absoluta
+def encode_sht3x_binary(readings, clock=True):
+    if len(readings) > BINARY_MAX_READINGS:
+        raise ValueError(f"Como maximo {BINARY_MAX_READINGS} lecturas por mensaje")
+    with_seq = bool(readings) and len(readings[0]) > 3
+    first_ms = int(readings[0][0] * 1000) if readings else 0
+    record = _READING_SEQ if with_seq else _READING
+    parts = [_HEADER.pack(BINARY_VERSION, BINARY_FLAG_SEQ if with_seq else 0, len(readings),
+                          first_ms if clock else 0)]
+    for reading in readings:
+        values = (int(reading[0] * 1000) - first_ms, round(reading[1] * 100), round(reading[2] * 100))
+        parts.append(record.pack(*values, *reading[3:4]))
+    return b''.join(parts)
@@ -1,5 +1,6 @@
 from flask import Blueprint, request, jsonify
 from models.client import get_all_clients, get_client_by_id, register_client, update_client_status, enable_client, update_client_info, delete_client
+from models.client_latest import get_fleet_latest
 
 client_bp = Blueprint('client_bp', __name__)
 
@@ -12,6 +13,14 @@ async def list_clients():
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+# API para obtener el estado actual de todos los clientes (ultima lectura, actuadores y modo) en una consulta
+@client_bp.route('/fleet/latest', methods=['GET'])
+async def list_fleet_latest():
+    try:
+        return jsonify(await get_fleet_latest()), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
 # API para obtener un cliente especifico
 @client_bp.route('/clients/<client_id>', methods=['GET'])
 async def get_client(client_id):
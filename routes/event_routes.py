@@ -1,5 +1,6 @@
 from flask import Blueprint, request, jsonify
-from models.event import save_event, get_all_events, update_event, get_events_by_topic, delete_event
+from models.event import save_event, flush_events, get_all_events, update_event, get_events_by_topic, delete_event, get_events_after
+from models.pagination import next_cursor
 from models.client import client_exists
 
 event_bp = Blueprint('event_bp', __name__)
@@ -11,8 +12,16 @@ async def get_events(client_id):
     if not await client_exists(client_id):
         return jsonify({"error": "Cliente no encontrado"}), 404
         
-    page = int(request.args.get('page', 1))
     page_size = int(request.args.get('pageSize', 10))
+    # Paginacion por cursor si se envia 'after' (vacio para la primera pagina)
+    if 'after' in request.args:
+        try:
+            data = await get_events_after(client_id, request.args.get('after'), page_size)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        return jsonify({"data": [dict(row) for row in data], "next": next_cursor(data, page_size)})
+    
+    page = int(request.args.get('page', 1))
     data = await get_all_events(client_id, page, page_size)
     return jsonify([dict(row) for row in data])
 
@@ -28,6 +37,8 @@ async def add_event(client_id):
     topic = data.get('topic')
     if message and topic:
         await save_event(client_id, message, topic)
+        # Confirmar de inmediato los eventos creados desde la API
+        await flush_events()
         return jsonify({"message": "Evento guardado correctamente"}), 201
     else:
         return jsonify({"error": "Mensaje y topico del evento son requeridos"}), 400
@@ -42,7 +53,14 @@ async def get_events_by_topic_endpoint(client_id):
     topic = request.args.get('topic')
     page = int(request.args.get('page', 1))
     page_size = int(request.args.get('pageSize', 10))
-    if topic:
+    if topic and 'after' in request.args:
+        # Paginacion por cursor
+        try:
+            data = await get_events_after(client_id, request.args.get('after'), page_size, topic)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        return jsonify({"data": [dict(row) for row in data], "next": next_cursor(data, page_size)})
+    elif topic:
         data = await get_events_by_topic(client_id, topic, page, page_size)
         return jsonify([dict(row) for row in data])
     else:
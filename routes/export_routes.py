@@ -0,0 +1,52 @@
+from flask import Blueprint, Response, request, jsonify
+from datetime import datetime
+from models.client import client_exists
+from models.db_pool import pool
+from models.export import EXPORT_DATASETS, EXPORT_FORMATS, iter_encoded, iter_rows
+
+export_bp = Blueprint('export_bp', __name__)
+
+EXPORT_CONTENT_TYPES = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv; charset=utf-8',
+}
+
+async def _registered_clients():
+    async with pool.reader() as conn:
+        async with conn.execute('SELECT client_id FROM clients ORDER BY client_id') as cursor:
+            return [row[0] for row in await cursor.fetchall()]
+
+# API para exportar el historico (lecturas SHT3x o eventos) por streaming, en bloques y con memoria acotada.
+# Filtros opcionales: client_id, start y end (prefijos ISO, end inclusivo); format ndjson o csv; gzip=1
+@export_bp.route('/export/<dataset>', methods=['GET'])
+async def export_history(dataset):
+    if dataset not in EXPORT_DATASETS:
+        return jsonify({"error": f"Conjunto no valido. Opciones: {', '.join(EXPORT_DATASETS)}"}), 404
+    fmt = request.args.get('format', 'ndjson')
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({"error": f"Formato no valido. Opciones: {', '.join(EXPORT_FORMATS)}"}), 400
+    start = request.args.get('start')
+    end = request.args.get('end')
+    for value in (start, end):
+        if value:
+            try:
+                datetime.fromisoformat(value)
+            except ValueError:
+                return jsonify({"error": f"Fecha no valida: {value}"}), 400
+    compress = request.args.get('gzip', '').lower() in ('1', 'true')
+
+    client_id = request.args.get('client_id')
+    if client_id:
+        # Verificar que el cliente existe
+        if not await client_exists(client_id):
+            return jsonify({"error": "Cliente no encontrado"}), 404
+        client_ids = [client_id]
+    else:
+        client_ids = await _registered_clients()
+
+    # El cuerpo se genera mientras se envia: cada bloque de filas se lee, se serializa y se escribe
+    columns = EXPORT_DATASETS[dataset]
+    body = iter_encoded(iter_rows(dataset, client_ids, start, end), fmt, columns, compress)
+    filename = f"{dataset}_{client_id or 'all'}.{fmt}" + ('.gz' if compress else '')
+    return Response(body, mimetype='application/gzip' if compress else EXPORT_CONTENT_TYPES[fmt],
+                    headers={'Content-Disposition': f'attachment; filename="{filename}"'})
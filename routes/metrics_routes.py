@@ -0,0 +1,102 @@
+from flask import Blueprint, jsonify, request
+from models.db_pool import pool
+from models.cache import get_cache_metrics
+from models.change_bus import get_change_bus_metrics
+from models.client_runtime import get_client_runtime_metrics
+from models.db_writer import writer
+from models.dedup import get_dedup_metrics
+from models.event import get_event_buffer_metrics
+from models.hot_window import get_hot_window_metrics
+from models.last_seen import get_last_seen_metrics
+from msad.core.system import get_read_pool_metrics
+from mqtt_client import get_ingest_health, get_ingest_queue_metrics, get_worker_cache_metrics, set_ingest_policy
+
+metrics_bp = Blueprint('metrics_bp', __name__)
+
+# API para consultar las metricas de cada pool de conexiones y del escritor
+@metrics_bp.route('/metrics/db', methods=['GET'])
+async def get_db_metrics():
+    try:
+        metrics = pool.get_metrics()
+        metrics['report_reader'] = get_read_pool_metrics()
+        metrics['write_queue'] = writer.get_metrics()
+        return jsonify(metrics), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+# API para verificar la salud de las conexiones a la base de datos
+@metrics_bp.route('/metrics/db/health', methods=['GET'])
+async def get_db_health():
+    try:
+        health = await pool.health_check()
+        return jsonify(health), 200 if health['healthy'] else 503
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+# API para consultar los contadores del buffer de eventos
+@metrics_bp.route('/metrics/events', methods=['GET'])
+async def get_event_metrics():
+    try:
+        return jsonify(get_event_buffer_metrics()), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+# API para consultar la ventana en memoria de lecturas recientes
+@metrics_bp.route('/metrics/readings', methods=['GET'])
+async def get_readings_metrics():
+    try:
+        return jsonify(get_hot_window_metrics()), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+# API para consultar los contadores de la ingesta de lecturas (cola, micro-lotes y duplicados descartados)
+@metrics_bp.route('/metrics/ingest', methods=['GET'])
+async def get_ingest_metrics():
+    try:
+        return jsonify({
+            "queue": get_ingest_queue_metrics(),
+            "dedup": get_dedup_metrics(),
+            "runtime": get_client_runtime_metrics(),
+            "last_seen": get_last_seen_metrics(),
+        }), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+# API para consultar la salud de la ingesta: 503 mientras se estan descartando mensajes
+@metrics_bp.route('/metrics/ingest/health', methods=['GET'])
+async def get_ingest_health_status():
+    try:
+        health = get_ingest_health()
+        return jsonify(health), 503 if health['status'] == 'shedding' else 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+# API para cambiar la politica de la cola de ingesta cuando se llena
+@metrics_bp.route('/metrics/ingest/policy', methods=['PUT'])
+async def update_ingest_policy():
+    data = request.get_json(silent=True) or {}
+    try:
+        set_ingest_policy(data.get('policy'))
+        return jsonify(get_ingest_health()), 200
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+# API para consultar los contadores del bus de cambios (invalidacion de caches)
+@metrics_bp.route('/metrics/changes', methods=['GET'])
+async def get_changes_metrics():
+    try:
+        return jsonify(get_change_bus_metrics()), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+# API para consultar el tamano y los aciertos de las caches en memoria
+@metrics_bp.route('/metrics/caches', methods=['GET'])
+async def get_caches_metrics():
+    try:
+        metrics = {"caches": get_cache_metrics()}
+        workers = get_worker_cache_metrics()
+        if workers is not None:
+            metrics["workers"] = workers
+        return jsonify(metrics), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
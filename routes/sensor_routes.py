@@ -1,12 +1,31 @@
 from flask import Blueprint, request, jsonify
 import asyncio
-from models.sensor_data import get_all_sht3x_data, get_ideal_params, update_ideal_params
+import gzip
+import io
+from models.sensor_data import get_all_sht3x_data, get_sht3x_data_after, get_ideal_params, update_ideal_params
+from models.pagination import next_cursor
+from models.bulk_import import IMPORT_FORMATS, import_readings
+from models.rollups import ROLLUP_RESOLUTIONS, get_rollups, rebuild_rollups
 from models.client import client_exists
 from mqtt_client import publish_message
 
 # Crear un Blueprint para las rutas de sensores
 sensor_bp = Blueprint('sensor_bp', __name__)
 
+# Respuesta paginada comun: por cursor si se envia 'after' (vacio para la primera pagina), o por page/pageSize
+async def sht3x_page_response(client_id):
+    page_size = int(request.args.get('pageSize', 10))
+    if 'after' in request.args:
+        try:
+            data = await get_sht3x_data_after(client_id, request.args.get('after'), page_size)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        return jsonify({"data": [dict(row) for row in data], "next": next_cursor(data, page_size)})
+    
+    page = int(request.args.get('page', 1))
+    data = await get_all_sht3x_data(client_id, page, page_size)
+    return jsonify([dict(row) for row in data])
+
 # API para obtener datos de sensor sht3x desde la base de datos
 @sensor_bp.route('/clients/<client_id>/Sht3xSensor', methods=['GET'])
 async def get_sht3x_sensor_data(client_id):
@@ -14,10 +33,7 @@ async def get_sht3x_sensor_data(client_id):
     if not await client_exists(client_id):
         return jsonify({"error": "Cliente no encontrado"}), 404
         
-    page = int(request.args.get('page', 1))
-    page_size = int(request.args.get('pageSize', 10))
-    data = await get_all_sht3x_data(client_id, page, page_size)
-    return jsonify([dict(row) for row in data])
+    return await sht3x_page_response(client_id)
 
 # API para obtener datos de sensor sht3x desde la base de datos sin automatizacin
 @sensor_bp.route('/clients/<client_id>/Sht3xSensorManual', methods=['GET'])
@@ -26,11 +42,59 @@ async def get_sht3x_sensor_data_manual(client_id):
     if not await client_exists(client_id):
         return jsonify({"error": "Cliente no encontrado"}), 404
         
-    page = int(request.args.get('page', 1))
-    page_size = int(request.args.get('pageSize', 10))
-    data = await get_all_sht3x_data(client_id, page, page_size)
+    return await sht3x_page_response(client_id)
+
+# API para obtener agregados (min/max/promedio) de temperatura y humedad por intervalo
+@sensor_bp.route('/clients/<client_id>/Sht3xSensor/aggregate', methods=['GET'])
+async def get_sht3x_aggregate(client_id):
+    # Verificar que el cliente existe
+    if not await client_exists(client_id):
+        return jsonify({"error": "Cliente no encontrado"}), 404
+        
+    resolution = request.args.get('resolution', '1h')
+    if resolution not in ROLLUP_RESOLUTIONS:
+        return jsonify({"error": f"Resolucion no valida. Opciones: {', '.join(ROLLUP_RESOLUTIONS)}"}), 400
+    data = await get_rollups(client_id, resolution, request.args.get('start'), request.args.get('end'))
     return jsonify([dict(row) for row in data])
 
+# API para reconstruir los agregados de un cliente desde los datos crudos
+@sensor_bp.route('/clients/<client_id>/Sht3xSensor/aggregate/rebuild', methods=['POST'])
+async def rebuild_sht3x_aggregate(client_id):
+    # Verificar que el cliente existe
+    if not await client_exists(client_id):
+        return jsonify({"error": "Cliente no encontrado"}), 404
+        
+    try:
+        await rebuild_rollups(client_id)
+        return jsonify({"message": "Agregados reconstruidos correctamente"}), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+# Formatos de importacion segun el Content-Type si no se indica 'format'
+IMPORT_CONTENT_TYPES = {
+    'text/csv': 'csv',
+    'application/x-ndjson': 'ndjson',
+    'application/jsonl': 'ndjson',
+}
+
+# API para importar lecturas historicas (CSV con cabecera o NDJSON, opcionalmente gzip).
+# El cuerpo se lee por streaming, linea a linea, sin cargarlo entero en memoria
+@sensor_bp.route('/Sht3xSensor/import', methods=['POST'])
+async def import_sht3x_data():
+    fmt = request.args.get('format') or IMPORT_CONTENT_TYPES.get(request.mimetype)
+    if fmt not in IMPORT_FORMATS:
+        return jsonify({"error": f"Formato no valido. Opciones: {', '.join(IMPORT_FORMATS)}"}), 400
+    
+    stream = request.stream
+    if request.headers.get('Content-Encoding', '').lower() == 'gzip':
+        stream = gzip.GzipFile(fileobj=stream, mode='rb')
+    lines = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    try:
+        report = await import_readings(lines, fmt, client_id=request.args.get('client_id'))
+    except (ValueError, EOFError, gzip.BadGzipFile) as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify(report), 200
+
 # API para obtener parametros ideales
 @sensor_bp.route('/clients/<client_id>/IdealParams/<param_type>', methods=['GET'])
 async def get_ideal_params_data(client_id, param_type):
@@ -0,0 +1,115 @@
+from flask import Blueprint, request, jsonify
+from models.compact_storage import get_migration_status, start_compact_migration
+from models.archive import get_archive_status, set_archive_after_days, run_archive
+from models.backfills import get_backfills
+from models.retention import (
+    ARCHIVE_TABLE, get_policies, set_policy, delete_policy, run_retention, get_retention_status
+)
+
+storage_bp = Blueprint('storage_bp', __name__)
+
+# API para consultar la distribucion de almacenamiento de las lecturas y el progreso de la migracion
+@storage_bp.route('/storage/compact', methods=['GET'])
+async def get_compact_storage_status():
+    try:
+        return jsonify(await get_migration_status()), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+# API para activar el almacenamiento compacto (migracion en linea por lotes)
+@storage_bp.route('/storage/compact', methods=['POST'])
+async def enable_compact_storage():
+    try:
+        status = await start_compact_migration()
+        return jsonify(status), 202
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+# API para consultar las politicas de retencion y el resultado de la ultima pasada
+@storage_bp.route('/storage/retention', methods=['GET'])
+async def get_retention():
+    try:
+        status = get_retention_status()
+        status['policies'] = await get_policies()
+        return jsonify(status), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+# API para fijar la retencion de una tabla, global o para un cliente
+@storage_bp.route('/storage/retention', methods=['PUT'])
+async def update_retention():
+    try:
+        data = request.json or {}
+        if 'table' not in data or 'retention_days' not in data:
+            return jsonify({"error": "Se requieren 'table' y 'retention_days'"}), 400
+        await set_policy(data['table'], data['retention_days'], data.get('client_id'))
+        return jsonify({"message": "Politica de retencion actualizada correctamente"}), 200
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+# API para eliminar una excepcion de retencion (vuelve a la politica global o por defecto)
+@storage_bp.route('/storage/retention', methods=['DELETE'])
+async def remove_retention():
+    try:
+        table = request.args.get('table')
+        if not table:
+            return jsonify({"error": "Se requiere el parametro 'table'"}), 400
+        if await delete_policy(table, request.args.get('client_id')):
+            return jsonify({"message": "Politica de retencion eliminada correctamente"}), 200
+        return jsonify({"message": "Politica de retencion no encontrada"}), 404
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+# API para aplicar la retencion inmediatamente y obtener las filas y bytes recuperados
+@storage_bp.route('/storage/retention/run', methods=['POST'])
+async def run_retention_now():
+    try:
+        report = await run_retention()
+        return jsonify(report), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+# API para consultar el archivo frio de lecturas (configuracion, ultima pasada y tamano por cliente)
+@storage_bp.route('/storage/archive', methods=['GET'])
+async def get_archive():
+    try:
+        status = await get_archive_status()
+        # Retencion global del archivo (politica 'sht3x_archive'; null = conservar siempre)
+        status['retention_days'] = next(policy['retention_days'] for policy in await get_policies()
+                                        if policy['table'] == ARCHIVE_TABLE and policy['client_id'] is None)
+        return jsonify(status), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+# API para fijar la antiguedad a partir de la cual las lecturas pasan al archivo (null lo desactiva)
+@storage_bp.route('/storage/archive', methods=['PUT'])
+async def update_archive():
+    try:
+        data = request.json or {}
+        if 'archive_after_days' not in data:
+            return jsonify({"error": "Se requiere 'archive_after_days'"}), 400
+        await set_archive_after_days(data['archive_after_days'])
+        return jsonify({"message": "Configuracion del archivo actualizada correctamente"}), 200
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+# API para archivar inmediatamente las lecturas antiguas
+@storage_bp.route('/storage/archive/run', methods=['POST'])
+async def run_archive_now():
+    try:
+        report = await run_archive()
+        return jsonify(report), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+# API para consultar el progreso de los backfills por lotes (migraciones de datos en segundo plano)
+@storage_bp.route('/storage/backfills', methods=['GET'])
+async def list_backfills():
+    try:
+        return jsonify(await get_backfills()), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+"""
+Enrutador de los topicos MQTT de los clientes (`clients/<client_id>/<sufijo>`).
+
+Cada tipo de mensaje es un TopicHandler registrado por su sufijo, con su parser
+y su sink. El topico se parte una sola vez y el manejador se busca en un dict,
+asi que el coste por mensaje no depende del numero de tipos registrados. Para
+un nuevo sensor (CO2, luz, humedad del suelo...) basta con registrar su
+manejador; la ingesta no cambia.
+"""
+
+TOPIC_PREFIX = 'clients'
+
+
+class TopicHandler:
+    """
+    Tipo de mensaje de un cliente.
+
+    `parse(client_id, payload, received)` devuelve la lista de elementos del
+    mensaje (lanza payloads.PayloadError si no es valido) y `sink(items)` (async)
+    guarda de una vez los elementos de todo un micro-lote. Los manejadores que
+    comparten sink (p. ej. las lecturas de texto y binarias) se guardan juntos.
+    Con `coalesce` un mensaje puede sustituirse por uno mas reciente del mismo
+    topico si la cola de ingesta se llena (politica latest_per_client).
+    """
+
+    def __init__(self, name, suffix, parse, sink, coalesce=False):
+        self.name = name
+        self.suffix = suffix
+        self.parse = parse
+        self.sink = sink
+        self.coalesce = coalesce
+
+    @property
+    def subscription(self):
+        return f'{TOPIC_PREFIX}/+/{self.suffix}'
+
+
+class TopicRouter:
+    """Registro de manejadores por sufijo del topico"""
+
+    def __init__(self):
+        self._handlers = {}
+        self.sinks = []  # Sinks distintos en orden de registro (orden en que se guarda cada micro-lote)
+
+    def register(self, handler):
+        if handler.suffix in self._handlers:
+            raise ValueError(f"Ya hay un manejador para el topico {handler.subscription}")
+        self._handlers[handler.suffix] = handler
+        if handler.sink not in self.sinks:
+            self.sinks.append(handler.sink)
+        return handler
+
+    # (client_id, manejador) del topico, o None si no es de un cliente o no tiene manejador
+    def match(self, topic):
+        parts = topic.split('/', 2)
+        if len(parts) != 3 or parts[0] != TOPIC_PREFIX or not parts[1]:
+            return None
+        handler = self._handlers.get(parts[2])
+        if handler is None:
+            return None
+        return parts[1], handler
+
+    def subscriptions(self):
+        return [handler.subscription for handler in self._handlers.values()]
+
+    def __iter__(self):
+        return iter(self._handlers.values())